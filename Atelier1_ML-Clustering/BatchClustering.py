@@ -0,0 +1,281 @@
+"""
+Headless batch version of the clustering notebooks.
+
+Runs import -> maps -> deconvolution -> k selection -> clustering -> PCA for
+every dataset given on the command line, on a pool of worker processes, and
+writes the figures and CSV files to Results/<mode>/<sample>, where <sample>
+is the file name followed by a short hash of its full path (see `sample_name`).
+Results/<mode>/index.csv maps every <sample> folder to its dataset, with the
+number of clusters and how it was chosen ('knee', or 'fallback' when the
+curve has no knee).
+
+Example:
+    python BatchClustering.py "Dataset/MatrixFibers/*.xlsx" "Dataset/Ni_SiC/*.xls" --mode 3D_Clustering -j 8
+"""
+import argparse
+import glob
+import hashlib
+import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import matplotlib
+matplotlib.use('Agg')  # No display: figures are only saved
+import matplotlib.pyplot as plt
+import pandas as pd
+import seaborn as sns
+from sklearn.cluster import KMeans
+from sklearn.decomposition import PCA
+from sklearn.mixture import GaussianMixture
+from sklearn.preprocessing import StandardScaler
+
+from GridIndex import grid_index, to_grid
+from Instrumentation import PROFILER, format_summary, merge_traces, span, summarize
+from KAMM import add_kam_metric
+from Loader import load_ni_data
+from Mapping import plot_cdf_with_weibull_fit_on_axis
+from Mapping import plot_clustered_data
+from Mapping import plot_map
+from Mapping import plot_pdf_with_deconvolution_on_axis
+from Mapping import plot_pixel_map
+from ModelSelection import feature_matrix, select_n_clusters
+
+MODES = {
+    '2D_Clustering': ['HARDNESS_GPa', 'MODULUS_GPa'],
+    '3D_Clustering': ['HARDNESS_GPa', 'MODULUS_GPa', 'KAMM_HARDNESS_GPa', 'KAMM_MODULUS_GPa'],
+}
+FEATURE_NAMES = {'2D_Clustering': 'Hardness and Modulus', '3D_Clustering': 'Hardness and Modulus with KAMM'}
+FALLBACK_K = 2  # Number of clusters when the elbow/BIC curve has no knee
+
+def default_sheet_name(file_path):
+    # Sheet names used by the datasets of the workshop
+    return 'Sheet1' if Path(file_path).suffix == '.xlsx' else 'Sample'
+
+def _save_figure(fig, file_path):
+    with span('savefig', path=str(file_path)):
+        fig.savefig(file_path)
+
+def run_sample(file_path, sheet_name, result_dir, mode='2D_Clustering', method='KMeans',
+               n_components=3, xDim=4, yDim=2, cMap='viridis', store=False):
+    """
+    Run the whole clustering workflow on one dataset and save its results.
+
+    With `store`, the properties, features, labels, model and maps are also
+    saved to 'results.h5' (see ResultStore, requires h5py). Stages are timed
+    when the profiler is enabled (see Instrumentation).
+
+    Returns the number of clusters and how it was chosen: 'knee', or
+    'fallback' (FALLBACK_K) when the curve has no knee.
+    """
+    result_dir = Path(result_dir)
+    result_dir.mkdir(parents=True, exist_ok=True)
+    x_col, y_col = 'X Position_µm', 'Y Position_µm'
+
+    # Import
+    data = load_ni_data([file_path], sheet_name=sheet_name)
+    properties = list(data.columns)
+    data.to_csv(result_dir / 'imported_data.csv', index=False)
+
+    # Maps
+    fig, axes = plt.subplots(1, 3, figsize=(4*xDim, 2*yDim))
+    plot_map(data[x_col], data[y_col], data['HARDNESS_GPa'], title='Hardness (GPa)',
+             xlabel='X Position (µm)', ylabel='Y Position (µm)', ax=axes[0], cmap=cMap)
+    plot_map(data[x_col], data[y_col], data['MODULUS_GPa'], title='Modulus Map (GPa)',
+             xlabel='X Position (µm)', ylabel='Y Position (µm)', ax=axes[1], cmap=cMap)
+    sns.scatterplot(y='MODULUS_GPa', x='HARDNESS_GPa', data=data, ax=axes[2])
+    axes[2].set_title('Modulus vs Hardness')
+    fig.tight_layout()
+    _save_figure(fig, result_dir / 'maps_and_scatter.png')
+    plt.close(fig)
+
+    # Deconvolution and Weibull fits
+    fig, axes = plt.subplots(1, 2, figsize=(4*xDim, 2*yDim))
+    plot_pdf_with_deconvolution_on_axis(data, 'HARDNESS_GPa', n_components=n_components, ax=axes[0])
+    plot_pdf_with_deconvolution_on_axis(data, 'MODULUS_GPa', n_components=n_components, ax=axes[1])
+    fig.tight_layout()
+    _save_figure(fig, result_dir / 'pdf_gmm_deconvolution.png')
+    plt.close(fig)
+
+    fig, axes = plt.subplots(1, 2, figsize=(4*xDim, 2*yDim))
+    plot_cdf_with_weibull_fit_on_axis(data, 'HARDNESS_GPa', ax=axes[0])
+    plot_cdf_with_weibull_fit_on_axis(data, 'MODULUS_GPa', ax=axes[1])
+    fig.tight_layout()
+    _save_figure(fig, result_dir / 'cdf_weibull_fit.png')
+    plt.close(fig)
+
+    # KAMM features
+    features = MODES[mode]
+    if mode == '3D_Clustering':
+        data = add_kam_metric(data, 'HARDNESS_GPa', 'KAMM_HARDNESS_GPa')
+        data = add_kam_metric(data, 'MODULUS_GPa', 'KAMM_MODULUS_GPa')
+    data = data.dropna(subset=features).reset_index(drop=True)
+
+    # Number of clusters (single process: samples already run in parallel)
+    K = range(1, 10)
+    selection = select_n_clusters(feature_matrix(data, ['HARDNESS_GPa', 'MODULUS_GPa'], standardize=False),
+                                  K, method=method, n_jobs=1)
+    if selection.knee is None:
+        optimal_k, k_source = FALLBACK_K, 'fallback'
+        print(f"{file_path}: no knee in the {'inertia' if method == 'KMeans' else 'BIC'} curve, "
+              f"falling back to {optimal_k} clusters", file=sys.stderr)
+    else:
+        optimal_k, k_source = selection.knee, 'knee'
+    fig, ax = plt.subplots(figsize=(2*xDim, 1.5*yDim))
+    if method == 'KMeans':
+        ax.plot(K, selection.inertia, 'bx-')
+        ax.set_ylabel('Inertia')
+        ax.set_title('Elbow Method For Optimal k')
+        _save_figure(fig, result_dir / 'elbow_method.png')
+    else:
+        ax.plot(K, selection.bic, 'bx-')
+        ax.set_ylabel('BIC')
+        ax.set_title('BIC For Optimal k')
+        _save_figure(fig, result_dir / 'bic_method.png')
+    plt.close(fig)
+
+    # Clustering
+    if method == 'KMeans':
+        model = KMeans(n_clusters=optimal_k, random_state=42)
+    else:
+        model = GaussianMixture(n_components=optimal_k, random_state=42)
+    with span('clustering', method=method, k=optimal_k):
+        data['Cluster'] = model.fit(data[features]).predict(data[features]).astype(int)
+    colors = sns.color_palette('tab10', n_colors=optimal_k)
+    cmap = {i: colors[i] for i in range(optimal_k)}
+    plot_clustered_data(data, 'HARDNESS_GPa', 'MODULUS_GPa', 'Cluster', colors, result_dir, xDim, yDim,
+                        f'{method} Clustering of Hardness and Modulus', 'Hardness (GPa)', 'Modulus (GPa)')
+    plot_pixel_map(data[x_col], data[y_col], data['Cluster'], title=f'{method} Clusters',
+                   xlabel='X Position (µm)', ylabel='Y Position (µm)', xDim=xDim, yDim=yDim,
+                   cluster_colors=cmap, save_path=result_dir / f'{method.lower()}_clusters_map.png')
+    plt.close('all')
+
+    # PCA
+    with span('PCA'):
+        principal_components = PCA(n_components=2).fit_transform(StandardScaler().fit_transform(data[features]))
+    pc_df = pd.DataFrame(data=principal_components, columns=['PC1', 'PC2'])
+    pc_df['Cluster'] = data['Cluster'].values
+    data[['PC1', 'PC2']] = principal_components
+    plot_clustered_data(pc_df, 'PC1', 'PC2', 'Cluster', colors, result_dir, xDim, yDim,
+                        f'PCA of {FEATURE_NAMES[mode]}', 'Principal Component 1', 'Principal Component 2')
+    plt.close('all')
+
+    with span('write_csv'):
+        data.to_csv(result_dir / 'clustered_data.csv', index=False)
+    if store:
+        save_results(result_dir / 'results.h5', file_path, data, properties, method, optimal_k, model, k_source)
+    return optimal_k, k_source
+
+def save_results(store_path, file_path, data, properties, method, k, model, k_source='knee'):
+    """Save the results of `run_sample` to a ResultStore file, with the metadata files of the dataset."""
+    from ResultStore import (open_store, set_metadata, write_grid, write_labels, write_sidecar_metadata,
+                             write_table)
+    with open_store(store_path, 'w') as store:
+        write_sidecar_metadata(store, file_path)
+        set_metadata(store, 'k_source', k_source)
+        write_table(store, 'properties', data[properties])
+        write_table(store, 'features', data.drop(columns=properties + ['Cluster']))
+        write_labels(store, method, k, data['Cluster'], model)
+        index = grid_index(data['X Position_µm'], data['Y Position_µm'])
+        for column in ('HARDNESS_GPa', 'MODULUS_GPa'):
+            write_grid(store, column, to_grid(data[column], index, aggregate='mean'))
+        write_grid(store, f"{method}_k{k}", to_grid(data['Cluster'], index, aggregate='mode'))
+
+def _run_job(job):
+    # Worker entry point: never raise, report the error instead
+    file_path, kwargs, profile_dir = job
+    if profile_dir is not None:
+        PROFILER.enable()
+        PROFILER.reset()  # Workers run several samples: one trace each
+    try:
+        with span('run_sample', sample=str(file_path)):
+            result = file_path, run_sample(file_path, **kwargs), None
+    except Exception:
+        result = file_path, None, traceback.format_exc()
+    if profile_dir is not None:
+        PROFILER.write_trace(trace_path(profile_dir, file_path))
+    return result
+
+def sample_name(file_path):
+    """
+    Name of the results of one dataset: its file name and a short hash of its
+    full path, so that same-named files of different folders do not overwrite
+    each other.
+    """
+    file_path = Path(file_path)
+    digest = hashlib.sha1(str(file_path.resolve()).encode()).hexdigest()[:8]
+    return f"{file_path.stem}_{digest}"
+
+def trace_path(profile_dir, file_path):
+    """Chrome trace of one dataset in a profiled run."""
+    return Path(profile_dir) / f"{sample_name(file_path)}_trace.json"
+
+def update_index(index_path, entries):
+    """
+    Add the samples of a run to the index of a results directory (CSV mapping
+    every sample folder to its dataset). Samples run again replace their row.
+    """
+    index_path = Path(index_path)
+    index = pd.DataFrame(entries, columns=['sample', 'dataset', 'status', 'k', 'k_source'])
+    if index_path.exists():
+        previous = pd.read_csv(index_path)
+        index = pd.concat([previous[~previous['sample'].isin(index['sample'])], index], ignore_index=True)
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    index.sort_values('sample').to_csv(index_path, index=False)
+
+def expand_datasets(patterns):
+    """Expand file paths and glob patterns into a sorted list of unique datasets."""
+    file_paths = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        file_paths.extend(Path(match) for match in matches)
+    return list(dict.fromkeys(file_paths))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the NI clustering workflow on many datasets.")
+    parser.add_argument('datasets', nargs='+', help="Excel exports or glob patterns (quoted)")
+    parser.add_argument('--mode', choices=sorted(MODES), default='2D_Clustering')
+    parser.add_argument('--method', choices=['KMeans', 'GMM'], default='KMeans')
+    parser.add_argument('--sheet', default=None, help="Sheet name (default: 'Sheet1' for .xlsx, 'Sample' otherwise)")
+    parser.add_argument('--n-components', type=int, default=3, help="Components of the PDF deconvolution")
+    parser.add_argument('--results', default='Results', help="Root results directory")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Number of worker processes")
+    parser.add_argument('--store', action='store_true', help="Also save the results to results.h5 (needs h5py)")
+    parser.add_argument('--profile', default=None, metavar='DIR',
+                        help="Time every stage and save the Chrome traces and a summary to DIR")
+    args = parser.parse_args(argv)
+
+    jobs = []
+    for file_path in expand_datasets(args.datasets):
+        jobs.append((file_path, dict(
+            sheet_name=args.sheet or default_sheet_name(file_path),
+            result_dir=Path(args.results) / args.mode / sample_name(file_path),
+            mode=args.mode, method=args.method, n_components=args.n_components, store=args.store),
+            args.profile))
+    if not jobs:
+        parser.error("no dataset found")
+
+    failures = 0
+    entries = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for file_path, result, error in executor.map(_run_job, jobs):
+            if error is None:
+                optimal_k, k_source = result
+                print(f"{file_path}: done ({optimal_k} clusters, {k_source})")
+                entries.append((sample_name(file_path), str(file_path.resolve()), 'done', optimal_k, k_source))
+            else:
+                failures += 1
+                print(f"{file_path}: FAILED\n{error}", file=sys.stderr)
+                entries.append((sample_name(file_path), str(file_path.resolve()), 'failed', None, None))
+    update_index(Path(args.results) / args.mode / 'index.csv', entries)
+    print(f"{len(jobs) - failures}/{len(jobs)} datasets processed")
+    if args.profile:
+        events = merge_traces([trace_path(args.profile, file_path) for file_path, _, _ in jobs],
+                              Path(args.profile) / 'trace.json')
+        summary = format_summary(summarize(events))
+        (Path(args.profile) / 'summary.txt').write_text(summary + '\n', encoding='utf-8')
+        print(summary)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+import hashlib
+import json
+from collections import OrderedDict, namedtuple
+from pathlib import Path
+
+import numpy as np
+from sklearn.mixture import GaussianMixture
+
+from Instrumentation import instrument
+
+# Result of a 1D GMM deconvolution (one entry per component)
+Deconvolution = namedtuple('Deconvolution', ['weights', 'means', 'sigmas'])
+
+# In-memory LRU cache of the fitted deconvolutions
+_cache = OrderedDict()
+CACHE_SIZE = 128
+
+def _key(values, n_components, random_state):
+    digest = hashlib.sha1(np.ascontiguousarray(values).tobytes()).hexdigest()
+    return f"{digest}_{n_components}_{random_state}"
+
+@instrument
+def fit_deconvolution(values, n_components, random_state=0, cache_dir=None):
+    """
+    Fit a 1D Gaussian Mixture deconvolution, once per set of inputs.
+
+    Results are memoized by (data hash, n_components, random_state) in an
+    in-memory LRU cache and, if `cache_dir` is given, in small JSON files so
+    that they survive kernel restarts.
+
+    Parameters:
+    - values: array-like
+        Property values (NaN are ignored).
+    - n_components: int
+        Number of Gaussian components.
+
+    Returns:
+    - Deconvolution
+        Weights, means and standard deviations of the components.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[~np.isnan(values)]
+    key = _key(values, n_components, random_state)
+
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    cache_file = Path(cache_dir) / f"gmm1d_{key}.json" if cache_dir is not None else None
+    if cache_file is not None and cache_file.exists():
+        with open(cache_file, 'r') as file:
+            result = Deconvolution(*(np.array(v) for v in json.load(file)))
+    else:
+        gmm = GaussianMixture(n_components=n_components, random_state=random_state)
+        gmm.fit(values.reshape(-1, 1))
+        result = Deconvolution(gmm.weights_, gmm.means_.ravel(), np.sqrt(gmm.covariances_.ravel()))
+        if cache_file is not None:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_file, 'w') as file:
+                json.dump([v.tolist() for v in result], file)
+
+    _cache[key] = result
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return result
+
+def deconvolution_pdf(result, x):
+    """
+    Evaluate the weighted component densities and the total GMM density.
+
+    Returns:
+    - components: ndarray (len(x), n_components)
+    - total: ndarray (len(x),)
+    """
+    x = np.asarray(x, dtype=np.float64).reshape(-1, 1)
+    components = (result.weights / (result.sigmas * np.sqrt(2 * np.pi))
+                  * np.exp(-0.5 * ((x - result.means) / result.sigmas)**2))
+    return components, components.sum(axis=1)
+
+def clear_cache():
+    """Empty the in-memory cache (files in `cache_dir` are kept)."""
+    _cache.clear()
@@ -0,0 +1,135 @@
+from collections import namedtuple
+
+import numpy as np
+
+# Integer grid position of every indent of a map, computed once per dataset
+GridIndex = namedtuple('GridIndex', ['rows', 'cols', 'shape', 'x_coords', 'y_coords', 'regular', 'unique'])
+GridIndex.__doc__ = """
+Grid index of a map.
+
+- rows, cols: row (Y) and column (X) index of each indent.
+- shape: (n_rows, n_cols) of the grid.
+- x_coords, y_coords: positions of the grid columns and rows.
+- regular: True if every indent lies on a grid node.
+- unique: True if no grid node holds more than one indent.
+"""
+
+def _axis_indices(values):
+    # Integer index of each position along one axis, robust to float noise
+    unique_values = np.unique(values)
+    if len(unique_values) < 2:
+        return np.zeros(len(values), dtype=np.intp)
+    steps = np.diff(unique_values)
+    spacing = np.median(steps[steps > 1e-6 * np.ptp(unique_values)])
+    return np.rint((values - unique_values[0]) / spacing).astype(np.intp)
+
+def positions_to_grid(x, y):
+    """
+    Compute the grid indices of each indent from its X/Y positions.
+
+    Works for square, non-square and zig-zag grids since the acquisition
+    order of the indents is never used.
+
+    Returns:
+    - rows, cols: ndarray of int
+        Row (Y) and column (X) index of each indent.
+    - shape: tuple
+        Shape (n_rows, n_cols) of the grid.
+    """
+    rows = _axis_indices(np.asarray(y, dtype=float))
+    cols = _axis_indices(np.asarray(x, dtype=float))
+    return rows, cols, (int(rows.max()) + 1, int(cols.max()) + 1)
+
+def _settings(grid_info):
+    # Accept the whole '_NI_info.json' content or its 'Test settings' section
+    return grid_info.get('Test settings', grid_info)
+
+def grid_index(x, y, grid_info=None):
+    """
+    Build the grid index of a map from the indent positions.
+
+    Parameters:
+    - x, y: array-like
+        X and Y positions of the indents.
+    - grid_info: dict, optional
+        '_NI_info.json' metadata. If given, the number of points along X and
+        Y are taken from it instead of being detected from the positions.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if grid_info is not None:
+        settings = _settings(grid_info)
+        shape = (int(settings['Number of points (Y axis)']), int(settings['Number of points (X axis)']))
+        spacing = [np.ptp(v) / (n - 1) if n > 1 else 1.0 for v, n in ((y, shape[0]), (x, shape[1]))]
+        rows = np.rint((y - y.min()) / spacing[0]).astype(np.intp)
+        cols = np.rint((x - x.min()) / spacing[1]).astype(np.intp)
+        if rows.max() >= shape[0] or cols.max() >= shape[1]:
+            raise ValueError("Positions do not match the grid size given in the metadata")
+    else:
+        rows, cols, shape = positions_to_grid(x, y)
+        spacing = [np.ptp(v) / max(n - 1, 1) for v, n in ((y, shape[0]), (x, shape[1]))]
+
+    # Positions must fall on the grid nodes, with at most one indent per node
+    regular = all(step == 0 or np.max(np.abs(v - v.min() - idx * step)) <= 1e-3 * step
+                  for v, idx, step in ((y, rows, spacing[0]), (x, cols, spacing[1])))
+    unique = np.unique(rows * shape[1] + cols).size == len(rows)
+
+    x_coords = x.min() + np.arange(shape[1]) * spacing[1]
+    y_coords = y.min() + np.arange(shape[0]) * spacing[0]
+    return GridIndex(rows, cols, shape, x_coords, y_coords, regular, unique)
+
+def acquisition_grid_index(grid_info, n_points=None):
+    """
+    Build the grid index from the acquisition order only (no positions).
+
+    Rows are filled one after another and, for a 'Zigzag' pattern, every
+    other row is acquired from right to left.
+    """
+    settings = _settings(grid_info)
+    shape = (int(settings['Number of points (Y axis)']), int(settings['Number of points (X axis)']))
+    order = np.arange(n_points if n_points is not None else shape[0] * shape[1])
+    rows, cols = np.divmod(order, shape[1])
+    if str(settings.get('Grid indentation pattern', '')).lower() == 'zigzag':
+        cols = np.where(rows % 2 == 1, shape[1] - 1 - cols, cols)
+    x_spacing = float(settings.get('Space between points (X axis)') or 1.0)
+    y_spacing = float(settings.get('Space between points (Y axis)') or x_spacing)
+    return GridIndex(rows, cols, shape, np.arange(shape[1]) * x_spacing, np.arange(shape[0]) * y_spacing,
+                     True, True)
+
+def to_grid(values, index, aggregate=None, fill=np.nan):
+    """
+    Scatter per-indent values (labels, KAMM, PCA scores...) into a 2D array.
+
+    Runs in O(n) (O(n log n) with 'mode'). Grid nodes without indent get
+    `fill`. If several indents share a node, set `aggregate='mean'` to
+    average them (continuous properties) or `aggregate='mode'` to keep the
+    most frequent value, the smallest on a tie (cluster labels); NaN are
+    ignored. Otherwise the last one wins.
+    """
+    values = np.asarray(values, dtype=float)
+    if aggregate is None or index.unique:
+        grid = np.full(index.shape, fill, dtype=float)
+        grid[index.rows, index.cols] = values
+        return grid
+    if aggregate not in ('mean', 'mode'):
+        raise ValueError("aggregate must be None, 'mean' or 'mode'")
+    flat = index.rows * index.shape[1] + index.cols
+    valid = ~np.isnan(values)
+    size = index.shape[0] * index.shape[1]
+    if aggregate == 'mode':
+        # Count every (node, value) pair, then keep the most frequent pair of each node
+        pairs, counts = np.unique(np.column_stack([flat[valid], values[valid]]), axis=0, return_counts=True)
+        order = np.lexsort((pairs[:, 1], -counts, pairs[:, 0]))
+        first = order[np.r_[True, np.diff(pairs[order, 0]) != 0]]
+        grid = np.full(size, fill, dtype=float)
+        grid[pairs[first, 0].astype(np.intp)] = pairs[first, 1]
+        return grid.reshape(index.shape)
+    sums = np.bincount(flat[valid], weights=values[valid], minlength=size)
+    counts = np.bincount(flat[valid], minlength=size)
+    with np.errstate(invalid='ignore'):
+        grid = np.where(counts > 0, sums / counts, fill)
+    return grid.reshape(index.shape)
+
+def from_grid(grid, index):
+    """Gather the values of a 2D array back to the indents."""
+    return grid[index.rows, index.cols]
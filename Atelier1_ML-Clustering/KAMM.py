@@ -0,0 +1,106 @@
+import warnings
+
+import numpy as np
+
+from GridIndex import grid_index, to_grid, from_grid
+from Instrumentation import instrument
+
+# Neighbour offsets (row, column) for first and second order KAMM
+NEIGHBOR_OFFSETS = {
+    1: [(0, 1), (0, -1), (1, 0), (-1, 0)],
+    2: [(-2, 0), (2, 0), (0, -2), (0, 2),
+        (-1, -1), (-1, 1), (1, -1), (1, 1)],
+}
+
+def _shifted(padded, pad, di, dj, shape):
+    # View of the padded grid shifted by (di, dj)
+    rows, cols = shape
+    return padded[pad + di:pad + di + rows, pad + dj:pad + dj + cols]
+
+def compute_kam_metric(grid, order=1, metric='mean', offsets=None):
+    """
+    Compute a neighbour-contrast (KAMM) map over the whole grid at once.
+
+    Parameters:
+    - grid: 2D ndarray
+        Property map, NaN for missing indents.
+    - order: int, optional
+        1 for first order, 2 for second order neighbours (default is 1).
+    - metric: str or callable, optional
+        'mean', 'max', 'min', 'std' or 'median' of the absolute differences
+        with the neighbours (default is 'mean'). A callable receives the
+        stacked differences (n_neighbors, rows, cols), NaN where a neighbour
+        is missing, and must reduce them along axis 0.
+    - offsets: list of (int, int), optional
+        Custom neighbour offsets, overriding `order`.
+    """
+    if offsets is None:
+        if order not in NEIGHBOR_OFFSETS:
+            raise ValueError("order must be 1 or 2")
+        offsets = NEIGHBOR_OFFSETS[order]
+
+    grid = np.asarray(grid, dtype=float)
+    pad = max(max(abs(di), abs(dj)) for di, dj in offsets)
+    padded = np.pad(grid, pad, mode='constant', constant_values=np.nan)
+
+    # Stacked differences are only needed for order statistics
+    if callable(metric) or metric == 'median':
+        diffs = np.stack([np.abs(_shifted(padded, pad, di, dj, grid.shape) - grid)
+                          for di, dj in offsets])
+        reduce = np.nanmedian if metric == 'median' else metric
+        with warnings.catch_warnings():
+            # All-NaN neighbourhoods are expected on holes and borders
+            warnings.simplefilter('ignore', RuntimeWarning)
+            kam = reduce(diffs, axis=0)
+        kam[np.isnan(grid)] = np.nan
+        return kam
+
+    if metric not in ('mean', 'std', 'max', 'min'):
+        raise ValueError(f"Unsupported KAMM metric: {metric}")
+
+    # Running reductions keep memory at a few grids whatever the order
+    count = np.zeros(grid.shape)
+    total = np.zeros(grid.shape)
+    total_sq = np.zeros(grid.shape)
+    extreme = np.full(grid.shape, -np.inf if metric == 'max' else np.inf)
+    for di, dj in offsets:
+        diff = np.abs(_shifted(padded, pad, di, dj, grid.shape) - grid)
+        valid = ~np.isnan(diff)
+        diff = np.where(valid, diff, 0.0)
+        count += valid
+        if metric in ('mean', 'std'):
+            total += diff
+            total_sq += diff**2
+        elif metric == 'max':
+            extreme = np.where(valid, np.maximum(extreme, diff), extreme)
+        else:
+            extreme = np.where(valid, np.minimum(extreme, diff), extreme)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        if metric == 'mean':
+            kam = total / count
+        elif metric == 'std':
+            mean = total / count
+            kam = np.sqrt(np.maximum(total_sq / count - mean**2, 0.0))
+        else:
+            kam = extreme
+    kam[count == 0] = np.nan
+    return kam
+
+@instrument
+def add_kam_metric(dataframe, column, name, x_column='X Position_µm', y_column='Y Position_µm',
+                   order=1, metric='mean', offsets=None, index=None):
+    """
+    Add the KAMM values of `column` to the dataframe as a new column `name`.
+
+    The grid is rebuilt from the X/Y positions, so zig-zag and non-square
+    maps, as well as missing indents, are handled. Pass a precomputed
+    GridIndex as `index` to reuse it between columns.
+    """
+    if index is None:
+        index = grid_index(dataframe[x_column], dataframe[y_column])
+    grid = to_grid(dataframe[column], index)
+
+    kam = compute_kam_metric(grid, order=order, metric=metric, offsets=offsets)
+    dataframe[name] = from_grid(kam, index)
+    return dataframe
@@ -0,0 +1,392 @@
+"""
+Token-efficient, cached and concurrent chat-completion client for the LLM analysis of maps.
+
+Instead of raw records, each map is summarized by a compact statistical
+digest (quantiles, GMM deconvolution and a block-averaged grid of every
+property), a few hundred tokens whatever the size of the map. Responses are
+cached on disk by prompt hash, and many samples are analysed concurrently
+with asyncio, under a token-bucket rate limit, with jittered exponential
+backoff on 429/5xx responses. Only the standard library is used for HTTP, and
+`MockLLMServer` serves canned completions for offline runs.
+
+Example (Jupyter, Azure OpenAI):
+    client = LLMClient(os.environ["AZURE_OPENAI_ENDPOINT"], os.environ["AZURE_OPENAI_API_KEY"], model='gpt-4.1',
+                       api_version="2024-12-01-preview", cache_dir=result_dir / "cache")
+    digests = {name: map_digest(data) for name, data in samples.items()}
+    results = await client.analyze_samples(digests)
+
+Offline demo against the mock server:
+    python LLMClient.py Results/LLM/imported_data.csv
+"""
+import argparse
+import asyncio
+import email.utils
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from Deconvolution import fit_deconvolution
+from GridIndex import grid_index, to_grid
+
+SYSTEM_PROMPT = ("You are a data scientist skilled in machine learning, materials science and nanoindentation. "
+                 "Answer concisely.")
+
+TASK_PROMPT = ("Below is a statistical digest of a nanoindentation map (hardness and elastic modulus in GPa): "
+               "quantiles, 1D Gaussian mixture components and a block-averaged map of each property "
+               "(rows are Y, columns are X, null for missing indents). Identify the phases, estimate their "
+               "fractions and properties, comment on their spatial arrangement, and propose a clustering "
+               "approach for the full map.")
+
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+# Result of one request: response text, prompt size and timing (content None and the error message
+# if the request failed)
+LLMResult = namedtuple('LLMResult', ['name', 'content', 'prompt_chars', 'prompt_tokens', 'completion_tokens',
+                                     'wall_time', 'attempts', 'cached', 'error'], defaults=[None])
+
+def _rounded(values, decimals):
+    # Nested lists of rounded floats, NaN as None (JSON null)
+    values = np.round(np.asarray(values, dtype=np.float64), decimals)
+    return np.where(np.isnan(values), None, values).tolist()
+
+def block_average(grid, max_size):
+    """Average a 2D map over blocks so that it is at most `max_size` pixels along each axis."""
+    factor = int(np.ceil(max(grid.shape) / max_size))
+    if factor <= 1:
+        return grid
+    rows, cols = -(-grid.shape[0] // factor) * factor, -(-grid.shape[1] // factor) * factor
+    padded = np.full((rows, cols), np.nan)
+    padded[:grid.shape[0], :grid.shape[1]] = grid
+    blocks = padded.reshape(rows // factor, factor, cols // factor, factor)
+    counts = np.sum(~np.isnan(blocks), axis=(1, 3))
+    sums = np.nansum(blocks, axis=(1, 3))
+    return np.divide(sums, counts, out=np.full(counts.shape, np.nan), where=counts > 0)
+
+def map_digest(data, columns=('HARDNESS_GPa', 'MODULUS_GPa'), n_components=3, grid_size=16, decimals=2,
+               x_column='X Position_µm', y_column='Y Position_µm'):
+    """
+    Compact statistical digest of a map, to send instead of its raw records.
+
+    Returns:
+    - dict
+        Number of indents and, for every property: missing values, mean,
+        std, quantiles, GMM components (weights, means, sigmas, see
+        Deconvolution.fit_deconvolution) and a map averaged to at most
+        `grid_size` x `grid_size` blocks. All floats are rounded to
+        `decimals`.
+    """
+    digest = {'n_indents': len(data)}
+    index = None
+    if x_column in data and y_column in data:
+        index = grid_index(data[x_column], data[y_column])
+        digest['grid'] = {'shape': list(index.shape),
+                          'x_range_um': _rounded([index.x_coords[0], index.x_coords[-1]], decimals),
+                          'y_range_um': _rounded([index.y_coords[0], index.y_coords[-1]], decimals)}
+    for column in columns:
+        values = data[column].to_numpy(dtype=np.float64)
+        valid = values[~np.isnan(values)]
+        summary = {'missing': int(len(values) - len(valid)),
+                   'mean': _rounded(valid.mean(), decimals), 'std': _rounded(valid.std(), decimals),
+                   'quantiles': dict(zip((f"q{round(q * 100)}" for q in QUANTILES),
+                                         _rounded(np.quantile(valid, QUANTILES), decimals)))}
+        if n_components:
+            deconvolution = fit_deconvolution(valid, n_components, random_state=0)
+            order = np.argsort(deconvolution.means)
+            summary['gmm'] = {field: _rounded(np.asarray(value)[order], decimals)
+                              for field, value in deconvolution._asdict().items()}
+        if index is not None and grid_size:
+            summary['map'] = _rounded(block_average(to_grid(values, index, aggregate='mean'), grid_size), decimals)
+        digest[column] = summary
+    if len(columns) == 2:
+        digest['correlation'] = _rounded(data[list(columns)].corr().iloc[0, 1], decimals)
+    return digest
+
+def build_messages(digest, task=TASK_PROMPT, system=SYSTEM_PROMPT):
+    """Chat messages of one analysis, with the digest as compact JSON."""
+    return [{"role": "system", "content": system},
+            {"role": "user", "content": f"{task}\n{json.dumps(digest, separators=(',', ':'))}"}]
+
+def prompt_size(messages):
+    """Characters of the messages and a rough token estimate (4 characters per token)."""
+    chars = sum(len(message['content']) for message in messages)
+    return chars, -(-chars // 4)
+
+class TokenBucket:
+    """Asyncio rate limiter: `rate` requests per second on average, bursts of up to `capacity`."""
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+def parse_retry_after(value):
+    """Delay in seconds of a Retry-After header (seconds or HTTP-date), or None if missing or invalid."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+class RetryableError(Exception):
+    """Rate limit (429), server error (5xx) or connection failure, with the delay asked by the server if any."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class LLMClient:
+    """
+    Chat-completion client for Azure OpenAI (`api_version` given) or OpenAI-compatible endpoints.
+
+    Parameters:
+    - cache_dir: path, optional
+        Responses are saved as '<prompt hash>.json' and reused for identical
+        requests (model, messages and options).
+    - max_concurrency: int
+        Requests in flight at once.
+    - requests_per_minute: float
+        Token-bucket rate limit shared by all the requests of the client.
+    - max_retries, base_delay, max_delay: backoff on 429/5xx
+        The n-th retry waits a random time in [0, min(max_delay,
+        base_delay * 2**n)] ("full jitter"), or the server's Retry-After.
+    """
+
+    def __init__(self, endpoint, api_key, model, api_version=None, cache_dir=None, max_concurrency=4,
+                 requests_per_minute=60, burst=1, max_retries=6, base_delay=1.0, max_delay=60.0, timeout=120,
+                 **options):
+        self.endpoint = endpoint.rstrip('/')
+        self.api_key = api_key
+        self.model = model
+        self.api_version = api_version
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.options = options  # e.g. temperature, max_tokens
+
+    def _url(self):
+        if self.api_version is not None:
+            return (f"{self.endpoint}/openai/deployments/{self.model}/chat/completions"
+                    f"?api-version={self.api_version}")
+        return f"{self.endpoint}/v1/chat/completions"
+
+    def _headers(self):
+        headers = {'Content-Type': 'application/json'}
+        if self.api_version is not None:
+            headers['api-key'] = self.api_key
+        else:
+            headers['Authorization'] = f"Bearer {self.api_key}"
+        return headers
+
+    def request_hash(self, messages):
+        payload = json.dumps({'model': self.model, 'messages': messages, 'options': self.options}, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def _post(self, body):
+        # Blocking HTTP call, run in a worker thread
+        request = urllib.request.Request(self._url(), data=body, headers=self._headers(), method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as error:
+            if error.code == 429 or error.code >= 500:
+                raise RetryableError(f"HTTP {error.code}", parse_retry_after(error.headers.get('Retry-After'))) from error
+            raise
+        except (urllib.error.URLError, TimeoutError, ConnectionError) as error:
+            raise RetryableError(str(error)) from error
+
+    def _backoff(self, attempt, retry_after):
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def complete(self, messages, name=None, limiter=None, semaphore=None):
+        """Send one chat completion (or read it from the cache) and return an LLMResult."""
+        start = time.perf_counter()
+        prompt_chars, prompt_tokens = prompt_size(messages)
+        cache_file = self.cache_dir / f"{self.request_hash(messages)}.json" if self.cache_dir is not None else None
+        if cache_file is not None and cache_file.exists():
+            with open(cache_file, 'r', encoding='utf-8') as file:
+                response = json.load(file)
+            return self._result(name, response, prompt_chars, prompt_tokens, start, 0, True)
+
+        body = json.dumps({'model': self.model, 'messages': messages, **self.options}).encode()
+        limiter = limiter or TokenBucket(self.requests_per_minute / 60, self.burst)
+        semaphore = semaphore or asyncio.Semaphore(self.max_concurrency)
+        for attempt in range(self.max_retries + 1):
+            await limiter.acquire()
+            try:
+                async with semaphore:
+                    response = await asyncio.to_thread(self._post, body)
+                break
+            except RetryableError as error:
+                if attempt == self.max_retries:
+                    raise
+                delay = self._backoff(attempt, error.retry_after)
+                print(f"{name or 'request'}: {error}, retrying in {delay:.1f} s")
+                await asyncio.sleep(delay)
+
+        if cache_file is not None:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(cache_file, 'w', encoding='utf-8') as file:
+                json.dump(response, file)
+        return self._result(name, response, prompt_chars, prompt_tokens, start, attempt + 1, False)
+
+    @staticmethod
+    def _result(name, response, prompt_chars, prompt_tokens, start, attempts, cached):
+        usage = response.get('usage') or {}
+        return LLMResult(name, response['choices'][0]['message']['content'], prompt_chars,
+                         usage.get('prompt_tokens', prompt_tokens), usage.get('completion_tokens'),
+                         time.perf_counter() - start, attempts, cached)
+
+    async def analyze_samples(self, digests, task=TASK_PROMPT, system=SYSTEM_PROMPT):
+        """
+        Analyse many samples concurrently.
+
+        Parameters:
+        - digests: dict
+            Sample name -> digest (see `map_digest`).
+
+        Returns:
+        - list of LLMResult, in the order of `digests`
+            A request that fails (e.g. HTTP 400, or retries exhausted) does
+            not cancel the others: its result has no content and the error
+            message in `error`.
+        """
+        limiter = TokenBucket(self.requests_per_minute / 60, self.burst)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def analyze(name, messages):
+            start = time.perf_counter()
+            try:
+                return await self.complete(messages, name, limiter, semaphore)
+            except Exception as error:
+                return LLMResult(name, None, *prompt_size(messages), None, time.perf_counter() - start, None, False,
+                                 f"{type(error).__name__}: {error}")
+
+        return await asyncio.gather(*(analyze(name, build_messages(digest, task, system))
+                                      for name, digest in digests.items()))
+
+def report(results):
+    """Prompt size, token usage, attempts and wall time of every request."""
+    return pd.DataFrame([result._asdict() for result in results]).drop(columns='content')
+
+class MockLLMServer:
+    """
+    Local OpenAI-compatible server for offline runs.
+
+    Answers every chat completion with a short canned analysis after
+    `latency` seconds, and answers 429 (with Retry-After) to every
+    `fail_every`-th request to exercise the backoff.
+
+    Example:
+        with MockLLMServer(fail_every=3) as server:
+            client = LLMClient(server.url, 'test', 'mock')
+    """
+
+    def __init__(self, latency=0.1, fail_every=0, retry_after=0.2):
+        self.latency = latency
+        self.fail_every = fail_every
+        self.retry_after = retry_after
+        self.requests = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with server._lock:
+                    server.requests += 1
+                    count = server.requests
+                if server.fail_every and count % server.fail_every == 0:
+                    self.send_response(429)
+                    self.send_header('Retry-After', str(server.retry_after))
+                    self.end_headers()
+                    return
+                time.sleep(server.latency)
+                prompt = ''.join(message['content'] for message in body['messages'])
+                content = f"Mock analysis of a {len(prompt)}-character prompt."
+                payload = json.dumps({'choices': [{'message': {'role': 'assistant', 'content': content}}],
+                                      'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': 10}})
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload.encode())
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyse map digests concurrently against the local mock server.")
+    parser.add_argument('csv_files', nargs='+', help="Maps with the columns of 'imported_data.csv'")
+    parser.add_argument('--copies', type=int, default=4, help="Analyses per file (distinct tasks)")
+    parser.add_argument('--fail-every', type=int, default=3, help="Answer 429 to every n-th request")
+    parser.add_argument('--cache-dir', default=None)
+    args = parser.parse_args(argv)
+
+    digests = {}
+    for file_path in args.csv_files:
+        digest = map_digest(pd.read_csv(file_path))
+        for copy in range(args.copies):
+            digests[f"{Path(file_path).stem}#{copy}"] = dict(digest, request=copy)
+    raw = pd.read_csv(args.csv_files[0]).head(500).to_dict(orient='records')
+    print(f"Raw prompt (500 records): {len(json.dumps(raw))} characters, "
+          f"digest prompt: {prompt_size(build_messages(next(iter(digests.values()))))[0]} characters")
+
+    with MockLLMServer(fail_every=args.fail_every) as server:
+        client = LLMClient(server.url, 'mock-key', 'mock', cache_dir=args.cache_dir, requests_per_minute=600,
+                           burst=4, base_delay=0.1)
+        start = time.perf_counter()
+        results = asyncio.run(client.analyze_samples(digests))
+        print(report(results).to_string(index=False))
+        print(f"{len(results)} analyses in {time.perf_counter() - start:.2f} s, {server.requests} HTTP requests")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from Instrumentation import instrument
+
+CACHE_VERSION = 1
+
+# Default cache folder, next to this module whatever the working directory
+CACHE_DIR = Path(__file__).resolve().parent / 'Results' / 'cache'
+
+@instrument
+def read_ni_export(file_path, sheet_name):
+    """
+    Parse a nanoindentation map export (.xls/.xlsx) into a typed DataFrame.
+
+    The first row holding the units is merged into the headers (e.g.
+    'HARDNESS_GPa'), numeric columns are coerced and the 'Markers' and
+    'Index' columns are removed.
+    """
+    data = pd.read_excel(file_path, sheet_name=sheet_name)
+
+    # Merge first row (containing units) with the header
+    data.columns = [f"{col}_{unit}" if unit else col for col, unit in zip(data.columns, data.iloc[0])]
+    data = data.drop(index=0).reset_index(drop=True)
+
+    # Replace empty strings with NaN
+    data.replace("", np.nan, inplace=True)
+
+    # Coerce numeric columns, keep the others as text
+    for col in data.columns:
+        try:
+            data[col] = pd.to_numeric(data[col])
+        except (ValueError, TypeError):
+            data[col] = data[col].astype(str)
+
+    # Remove colums Markers and Index Integer
+    data.drop(columns=[col for col in data.columns if 'Markers_nan' in col or 'Index_Integer' in col], inplace=True)
+    return data
+
+def _file_hash(file_path):
+    sha = hashlib.sha1()
+    with open(file_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def _cache_path(file_path, sheet_name, cache_dir):
+    # One cache file per (export path, sheet)
+    key = hashlib.sha1(f"{Path(file_path).resolve()}|{sheet_name}".encode()).hexdigest()[:16]
+    return Path(cache_dir) / f"{Path(file_path).stem}_{key}.npz"
+
+def _read_cache(cache_file, file_path):
+    # Return the cached columns if they are still valid for the export
+    if not cache_file.exists():
+        return None
+    with np.load(cache_file, allow_pickle=False) as npz:
+        meta = json.loads(str(npz['__meta__']))
+        if meta['version'] != CACHE_VERSION:
+            return None
+        columns = {col: npz[f"col{i}"] for i, col in enumerate(meta['columns'])}
+    stat = os.stat(file_path)
+    if (meta['mtime_ns'], meta['size']) != (stat.st_mtime_ns, stat.st_size):
+        # Touched but possibly unchanged: fall back on the content hash, then record the new
+        # mtime so that the next loads do not hash the export again
+        if meta['sha1'] != _file_hash(file_path):
+            return None
+        meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+        _save_cache(cache_file, meta, {f"col{i}": values for i, values in enumerate(columns.values())})
+    return columns
+
+def _save_cache(cache_file, meta, arrays):
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename so that a crash never leaves a truncated cache
+    tmp_file = cache_file.with_suffix('.tmp.npz')
+    np.savez(tmp_file, __meta__=json.dumps(meta), **arrays)
+    os.replace(tmp_file, cache_file)
+
+def _write_cache(cache_file, file_path, data):
+    stat = os.stat(file_path)
+    meta = {
+        'version': CACHE_VERSION,
+        'source': str(Path(file_path).resolve()),
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha1': _file_hash(file_path),
+        'columns': list(data.columns),
+    }
+    arrays = {f"col{i}": data[col].to_numpy() for i, col in enumerate(data.columns)}
+    for name, values in arrays.items():
+        if values.dtype == object:
+            arrays[name] = values.astype(str)
+    _save_cache(cache_file, meta, arrays)
+
+@instrument
+def load_ni_columns(file_path, sheet_name, cache_dir=CACHE_DIR):
+    """
+    Load one export as a dict of column arrays, parsing the Excel file only
+    when its cache is missing or stale.
+
+    The cache is a '.npz' file in `cache_dir` (default: Results/cache next
+    to this module) keyed on the export path and sheet name, and validated
+    against the export mtime/size and, if those changed, its hash.
+    """
+    cache_file = _cache_path(file_path, sheet_name, cache_dir)
+    columns = _read_cache(cache_file, file_path)
+    if columns is None:
+        data = read_ni_export(file_path, sheet_name)
+        _write_cache(cache_file, file_path, data)
+        columns = _read_cache(cache_file, file_path)
+    return columns
+
+def load_ni_samples(file_paths, sheet_name, cache_dir=CACHE_DIR, n_jobs=1):
+    """
+    Load several exports in one call as a single dict of column arrays.
+
+    Columns are concatenated with NumPy and a 'Sample' column holds the index
+    of the export each row comes from. Exports without a valid cache are
+    parsed on `n_jobs` worker processes.
+    """
+    file_paths = list(file_paths)
+    if n_jobs == 1 or len(file_paths) == 1:
+        samples = [load_ni_columns(path, sheet_name, cache_dir) for path in file_paths]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            samples = list(executor.map(load_ni_columns, file_paths,
+                                        [sheet_name] * len(file_paths),
+                                        [cache_dir] * len(file_paths)))
+
+    names = list(samples[0])
+    for path, sample in zip(file_paths, samples):
+        if list(sample) != names:
+            raise ValueError(f"Columns of '{path}' do not match those of '{file_paths[0]}'")
+
+    columns = {name: np.concatenate([sample[name] for sample in samples]) for name in names}
+    columns['Sample'] = np.repeat(np.arange(len(samples)), [len(sample[names[0]]) for sample in samples])
+    return columns
+
+@instrument
+def load_ni_data(file_paths, sheet_name, cache_dir=CACHE_DIR, n_jobs=1):
+    """Load one or several exports into a single DataFrame (see `load_ni_samples`)."""
+    file_paths = list(file_paths)
+    columns = load_ni_samples(file_paths, sheet_name, cache_dir, n_jobs)
+    if len(file_paths) == 1:
+        del columns['Sample']
+    return pd.DataFrame(columns)
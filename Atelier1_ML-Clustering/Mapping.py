@@ -1,33 +1,53 @@
+import hashlib
+import json
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+
 import numpy as np
 import matplotlib.pyplot as plt
-import pandas as pd
 import seaborn as sns
-from sklearn.mixture import GaussianMixture
+from matplotlib.colors import ListedColormap, to_rgba
+from matplotlib.lines import Line2D
+from matplotlib.tri import Triangulation
+
+from Deconvolution import fit_deconvolution, deconvolution_pdf
+from GridIndex import grid_index, to_grid
+from Instrumentation import instrument, span
 
-def plot_pdf_with_deconvolution_on_axis(data, column, n_components, ax):
+@instrument
+def plot_deconvolution_on_axis(result, x, ax, colors=None, vertical=False):
+    # Plot the GMM components and total density of a fitted deconvolution
+    components, pdf = deconvolution_pdf(result, x)
+    for i in range(components.shape[1]):
+        color = colors[i] if colors is not None else None
+        if vertical:
+            ax.plot(components[:, i], x, label=f'Component {i+1}', color=color)
+        else:
+            ax.plot(x, components[:, i], label=f'Component {i+1}', color=color)
+    if vertical:
+        ax.plot(pdf, x, '-k', label='GMM Total')
+    else:
+        ax.plot(x, pdf, '-k', label='GMM Total')
+
+@instrument
+def plot_pdf_with_deconvolution_on_axis(data, column, n_components, ax, cache_dir=None):
     # Plot histogram
     sns.histplot(data[column].dropna(), bins=30, kde=False, stat='density', color='lightgray', edgecolor='black', ax=ax)
     
-    # Fit Gaussian Mixture Model
-    gmm = GaussianMixture(n_components=n_components, random_state=0)
-    gmm.fit(data[[column]].dropna())
-    
-    # Generate x values for plotting the GMM components
-    x = np.linspace(data[column].min(), data[column].max(), 1000).reshape(-1, 1)
-    logprob = gmm.score_samples(x)
-    responsibilities = gmm.predict_proba(x)
-    pdf = np.exp(logprob)
+    # Fit Gaussian Mixture Model (cached, see Deconvolution.fit_deconvolution)
+    result = fit_deconvolution(data[column], n_components, random_state=0, cache_dir=cache_dir)
     
     # Plot GMM components
-    for i in range(n_components):
-        ax.plot(x, responsibilities[:, i] * pdf, label=f'Component {i+1}')
+    x = np.linspace(data[column].min(), data[column].max(), 1000)
+    plot_deconvolution_on_axis(result, x, ax)
     
-    ax.plot(x, pdf, '-k', label='GMM Total')
     ax.set_title(f'PDF and GMM Deconvolution of {column}')
     ax.set_xlabel(column)
     ax.set_ylabel('Density')
     ax.legend()
 
+@instrument
 def plot_cdf_with_weibull_fit_on_axis(data, column, ax):
     # Sort data and compute CDF
     sorted_data = np.sort(data[column].dropna())
@@ -50,7 +70,8 @@ def plot_cdf_with_weibull_fit_on_axis(data, column, ax):
     ax.set_ylabel('CDF')
     ax.legend() 
 
-def plot_clustered_data(data, xdata, ydata, huedata, colors, result_dir, xDim=10, yDim=6, title='KMeans Clustering of Hardness and Modulus', xlabel='Hardness (GPa)', ylabel='Modulus (GPa)'):
+@instrument
+def plot_clustered_data(data, xdata, ydata, huedata, colors, result_dir, xDim=10, yDim=6, title='KMeans Clustering of Hardness and Modulus', xlabel='Hardness (GPa)', ylabel='Modulus (GPa)', ax=None):
     """
     Plot clustered data using the provided colors and save the plot.
 
@@ -60,33 +81,74 @@ def plot_clustered_data(data, xdata, ydata, huedata, colors, result_dir, xDim=10
     - colors: list or dict
         The color palette for the clusters.
     - result_dir: Path or str
-        The directory where the plot will be saved.
+        The directory where the plot will be saved (None to skip saving).
     - xDim: int, optional
         The width of the figure (default is 10).
     - yDim: int, optional
         The height of the figure (default is 6).
+    - ax: Axes, optional
+        Axis to draw on. If given, the pyplot state is not used and the
+        figure is not shown (see Rendering.py).
     """
     # Plot clustered data
-    plt.figure(figsize=(xDim, yDim))
-    sns.scatterplot(x=xdata, y=ydata, hue=huedata, palette=colors, data=data)
-    plt.title(title)
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
-    plt.legend(title='Cluster', bbox_to_anchor=(1.05, 1), loc='upper left')
-    file_path = result_dir / (title.replace(" ", "_") + '.png')
-    plt.savefig(file_path)
-    print(f"Clustered data plot saved to {file_path}")
-    plt.show()
+    interactive = ax is None
+    if interactive:
+        plt.figure(figsize=(xDim, yDim))
+        ax = plt.gca()
+    sns.scatterplot(x=xdata, y=ydata, hue=huedata, palette=colors, data=data, ax=ax)
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.legend(title='Cluster', bbox_to_anchor=(1.05, 1), loc='upper left')
+    if result_dir is not None:
+        file_path = Path(result_dir) / (title.replace(" ", "_") + '.png')
+        with span('savefig', path=str(file_path)):
+            ax.figure.savefig(file_path)
+        print(f"Clustered data plot saved to {file_path}")
+    if interactive:
+        plt.show()
+
+def read_ni_info(file_path):
+    """Read the '_NI_info.json' metadata of a map (grid size, spacing, pattern...)."""
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return json.load(file)
+
+# Delaunay triangulations reused across all the columns of a map
+_triangulations = OrderedDict()
+
+def _cached_triangulation(x, y):
+    key = hashlib.sha1(x.tobytes() + y.tobytes()).hexdigest()
+    if key not in _triangulations:
+        with span('triangulation', n_points=len(x)):
+            _triangulations[key] = Triangulation(x, y)
+        if len(_triangulations) > 16:
+            _triangulations.popitem(last=False)
+    _triangulations.move_to_end(key)
+    return _triangulations[key]
 
 # Function to plot a map with given x, y, z data
-def plot_map(x, y, z, title, xlabel, ylabel, ax, cmap='viridis', save_path=None):
-    # Filter out non-finite values
-    mask = np.isfinite(x) & np.isfinite(y) & np.isfinite(z)
+@instrument
+def plot_map(x, y, z, title, xlabel, ylabel, ax, cmap='viridis', save_path=None, grid_info=None):
+    # Filter out non-finite positions (NaN values are handled below)
+    x, y, z = (np.asarray(v, dtype=float) for v in (x, y, z))
+    mask = np.isfinite(x) & np.isfinite(y)
     x, y, z = x[mask], y[mask], z[mask]
     
     # Use the provided axis for plotting
-    contour = ax.tricontourf(x, y, z, levels=14, cmap=cmap)
-    cbar = plt.colorbar(contour, ax=ax)  # Add colorbar to the axis
+    index = grid_index(x, y, grid_info)
+    if index.regular and index.unique:
+        # Regular (e.g. zig-zag) grid: contour the reshaped array, no triangulation
+        Z = to_grid(z, index)
+        contour = ax.contourf(index.x_coords, index.y_coords, np.ma.masked_invalid(Z), levels=14, cmap=cmap)
+    else:
+        # Scattered positions: triangulate once per map, mask triangles touching NaN values
+        triangulation = _cached_triangulation(x, y)
+        invalid = ~np.isfinite(z)
+        if invalid.any():
+            triangulation = Triangulation(x, y, triangulation.triangles,
+                                          mask=invalid[triangulation.triangles].any(axis=1))
+        contour = ax.tricontourf(triangulation, np.where(invalid, 0.0, z), levels=14, cmap=cmap)
+    cbar = ax.figure.colorbar(contour, ax=ax)  # Add colorbar to the axis
     cbar.set_label(title)
     ax.set_title(title)
     ax.set_xlabel(xlabel)
@@ -94,36 +156,49 @@ def plot_map(x, y, z, title, xlabel, ylabel, ax, cmap='viridis', save_path=None)
     
     # Save the figure if a save path is provided
     if save_path:
-        plt.savefig(save_path)
+        with span('savefig', path=str(save_path)):
+            ax.figure.savefig(save_path)
         print(f"Map plot saved to {save_path}")
 
+@lru_cache(maxsize=64)
+def cluster_colormap(colors):
+    """Return the (cached) colormap for a tuple of cluster colors."""
+    return ListedColormap(colors)
+
 # Function to create a grid and plot square pixels
-def plot_pixel_map(x, y, z, title, xlabel, ylabel, xDim, yDim, cluster_colors, save_path=None):
-    # Create a pivot table to structure data into a grid
-    grid_data = pd.DataFrame({'X': x, 'Y': y, 'Cluster': z})
-    pivot = grid_data.pivot(index='Y', columns='X', values='Cluster')
+@instrument
+def plot_pixel_map(x, y, z, title, xlabel, ylabel, xDim, yDim, cluster_colors, save_path=None, ax=None, index=None):
+    # Scatter the values into a grid (pass `index` to reuse the GridIndex of the map)
+    if index is None:
+        index = grid_index(x, y)
+    grid = to_grid(z, index, aggregate='mode')
     
-    # Sort the grid to ensure proper alignment
-    pivot = pivot.sort_index(ascending=False)  # Y-axis should be inverted for plotting
+    # Flip the rows: Y-axis should be inverted for plotting
+    grid = grid[::-1]
     
     # Create a colormap for clusters
-    unique_clusters = np.unique(z)
-    cluster_cmap = [cluster_colors[cluster] for cluster in unique_clusters]
-    cmap = plt.matplotlib.colors.ListedColormap(cluster_cmap)
+    unique_clusters = np.unique(np.asarray(z))
+    cluster_cmap = [to_rgba(cluster_colors[cluster]) for cluster in unique_clusters]
+    cmap = cluster_colormap(tuple(cluster_cmap))
     
-    # Plot the grid as square pixels
-    plt.figure(figsize=(xDim, yDim))
-    plt.imshow(pivot, cmap=cmap, aspect='equal', interpolation='none')  # Square pixels
-    plt.title(title)
-    plt.xlabel(xlabel)
-    plt.ylabel(ylabel)
+    # Plot the grid as square pixels (on the given axis, or a new pyplot figure)
+    interactive = ax is None
+    if interactive:
+        plt.figure(figsize=(xDim, yDim))
+        ax = plt.gca()
+    ax.imshow(grid, cmap=cmap, aspect='equal', interpolation='none')  # Square pixels
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
     
     # Add a legend for clusters
-    handles = [plt.Line2D([0], [0], marker='s', color=color, linestyle='', markersize=10, label=f'Cluster {cluster}')
+    handles = [Line2D([0], [0], marker='s', color=color, linestyle='', markersize=10, label=f'Cluster {cluster}')
                for cluster, color in zip(unique_clusters, cluster_cmap)]
-    plt.legend(handles=handles, title="Clusters", bbox_to_anchor=(1.05, 1), loc='upper left')
+    ax.legend(handles=handles, title="Clusters", bbox_to_anchor=(1.05, 1), loc='upper left')
     
     if save_path:
-        plt.savefig(save_path, bbox_inches='tight')  # Save with tight layout to include the legend
+        with span('savefig', path=str(save_path)):
+            ax.figure.savefig(save_path, bbox_inches='tight')  # Save with tight layout to include the legend
         print(f"Pixel map plot saved to {save_path}")
-    plt.show()
\ No newline at end of file
+    if interactive:
+        plt.show()
@@ -0,0 +1,171 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+from kneed import KneeLocator
+from sklearn.cluster import KMeans
+from sklearn.metrics import silhouette_score
+from sklearn.mixture import GaussianMixture
+
+from Instrumentation import instrument
+
+# Feature matrix shared by the worker processes (set once per worker)
+_X = None
+
+@dataclass
+class ClusterSelection:
+    """Scores of every candidate number of clusters and the selected knee."""
+    method: str
+    k_values: list
+    inertia: np.ndarray
+    bic: np.ndarray
+    silhouette: np.ndarray
+    knee: int = None
+    labels: dict = field(default_factory=dict, repr=False)
+
+def feature_matrix(data, features, standardize=True):
+    """
+    Build the feature matrix used for model selection, once per dataset.
+
+    Rows with NaN are dropped and the columns are standardized in place, so
+    the returned float64 array is the only copy of the features.
+    """
+    X = np.ascontiguousarray(data[features].dropna().to_numpy(dtype=np.float64))
+    if standardize:
+        X -= X.mean(axis=0)
+        std = X.std(axis=0)
+        X /= np.where(std > 0, std, 1.0)
+    return X
+
+def _init_worker(X):
+    global _X
+    _X = X
+
+def _kmeans_bic(X, centers, labels, inertia):
+    # BIC of the identical spherical Gaussians model behind KMeans
+    n, d = X.shape
+    k = len(centers)
+    variance = max(inertia / (d * max(n - k, 1)), np.finfo(float).tiny)
+    counts = np.bincount(labels, minlength=k)
+    nonzero = counts > 0
+    log_likelihood = (np.sum(counts[nonzero] * np.log(counts[nonzero] / n))
+                      - 0.5 * n * d * np.log(2 * np.pi * variance)
+                      - 0.5 * (n - k) * d)
+    n_parameters = k * (d + 1)
+    return n_parameters * np.log(n) - 2 * log_likelihood
+
+def _fit_one(method, X, k, init, random_state):
+    # Fit one model and return (labels, centers, inertia, bic)
+    if method == 'KMeans':
+        if init is None:
+            model = KMeans(n_clusters=k, random_state=random_state)
+        else:
+            model = KMeans(n_clusters=k, init=init, n_init=1, random_state=random_state)
+        labels = model.fit_predict(X)
+        return labels, model.cluster_centers_, model.inertia_, _kmeans_bic(X, model.cluster_centers_, labels, model.inertia_)
+    elif method == 'GMM':
+        model = GaussianMixture(n_components=k, means_init=init, random_state=random_state)
+        model.fit(X)
+        labels = model.predict(X)
+        inertia = np.sum((X - model.means_[labels])**2)
+        return labels, model.means_, inertia, model.bic(X)
+    raise ValueError("Unsupported clustering method")
+
+def _fit(method, X, k, inits, random_state):
+    # Best fit (lowest inertia for KMeans, lowest BIC for GMM) over the initializations
+    # (None is a cold start)
+    fits = [_fit_one(method, X, k, init, random_state) for init in (inits or [None])]
+    return min(fits, key=lambda fit: fit[2] if method == 'KMeans' else fit[3])
+
+def _fit_in_worker(method, k, random_state):
+    return _fit(method, _X, k, None, random_state)
+
+def _silhouette_in_worker(labels, sample_size, random_state):
+    if len(np.unique(labels)) < 2:
+        return np.nan
+    return silhouette_score(_X, labels, sample_size=sample_size, random_state=random_state)
+
+def _next_inits(X, centers, n_init, rng):
+    # Warm start: previous centers plus a new one drawn with the k-means++ rule (probability
+    # proportional to the squared distance to the nearest center), `n_init` draws
+    distances = np.full(len(X), np.inf)
+    for center in centers:
+        np.minimum(distances, ((X - center)**2).sum(axis=1), out=distances)
+    total = distances.sum()
+    if not total > 0:  # All the points are on the centers
+        return None
+    draws = rng.choice(len(X), size=n_init, p=distances / total)
+    return [np.vstack([centers, X[index]]) for index in draws]
+
+@instrument
+def select_n_clusters(X, k_values=range(1, 10), method='KMeans', n_jobs=None, warm_start=False,
+                      n_init=4, random_state=42, silhouette_sample_size=2000):
+    """
+    Fit every candidate number of clusters and score them in one pass.
+
+    Parameters:
+    - X: ndarray
+        Feature matrix without NaN (see `feature_matrix`). It is
+        sent once to each worker process and never copied per fit.
+    - k_values: iterable of int, optional
+        Candidate numbers of clusters (default is 1 to 9).
+    - method: str, optional
+        'KMeans' (knee of the inertia) or 'GMM' (knee of the BIC).
+    - n_jobs: int, optional
+        Number of worker processes (default is the number of CPUs).
+    - warm_start: bool, optional
+        By default every k is fitted from scratch, all the fits in parallel
+        on the pool. With a warm start, each k is initialized from the k-1
+        centers plus a new center drawn with the k-means++ rule (best of
+        `n_init` draws); the fits then run one after another and only the
+        silhouette scores are spread over the pool.
+    - n_init: int, optional
+        Number of drawn initializations per k of a warm start.
+    - silhouette_sample_size: int, optional
+        Number of points used for the silhouette score of large maps.
+    """
+    X = np.ascontiguousarray(X, dtype=np.float64)
+    k_values = sorted(k_values)
+    n_jobs = n_jobs or os.cpu_count()
+    sample_size = silhouette_sample_size if len(X) > silhouette_sample_size else None
+
+    # A single job runs in this process, without the pool overhead
+    if n_jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(X,))
+        map_ = executor.map
+    else:
+        _init_worker(X)
+        executor, map_ = None, map
+
+    try:
+        if warm_start:
+            rng = np.random.default_rng(random_state)
+            fits = []
+            inits = None
+            for k in k_values:
+                if inits is not None and len(inits[0]) != k:
+                    inits = None
+                fits.append(_fit(method, X, k, inits, random_state))
+                inits = _next_inits(X, fits[-1][1], n_init, rng)
+        else:
+            fits = list(map_(_fit_in_worker, [method] * len(k_values), k_values,
+                             [random_state] * len(k_values)))
+        silhouettes = list(map_(_silhouette_in_worker, [fit[0] for fit in fits],
+                                [sample_size] * len(fits), [random_state] * len(fits)))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    inertia = np.array([fit[2] for fit in fits])
+    bic = np.array([fit[3] for fit in fits])
+
+    # Same knee criteria as the notebooks
+    if method == 'KMeans':
+        knee = KneeLocator(k_values, inertia, curve="convex", direction="decreasing").knee
+    else:
+        knee = KneeLocator(k_values, bic, curve="convex", direction="increasing").knee
+
+    return ClusterSelection(method=method, k_values=k_values, inertia=inertia, bic=bic,
+                            silhouette=np.array(silhouettes), knee=knee,
+                            labels={k: fit[0] for k, fit in zip(k_values, fits)})
@@ -0,0 +1,116 @@
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
+
+from Mapping import plot_clustered_data, plot_map, plot_pixel_map
+
+# Plot helpers available for off-screen rendering
+PLOTTERS = {
+    'map': plot_map,
+    'pixel_map': plot_pixel_map,
+    'clustered_data': plot_clustered_data,
+}
+
+# Figures reused between calls in this process, keyed by size
+_figures = {}
+
+def get_figure(figsize):
+    """Return an empty Agg figure of the given size, reusing an existing one if possible."""
+    figsize = tuple(figsize)
+    fig = _figures.get(figsize)
+    if fig is None:
+        fig = Figure(figsize=figsize)
+        FigureCanvasAgg(fig)
+        _figures[figsize] = fig
+    else:
+        fig.clf()
+    return fig
+
+def _update_hash(sha, value):
+    # Hash plot inputs by content (arrays, pandas objects) or by repr
+    if isinstance(value, (pd.Series, pd.DataFrame)):
+        sha.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+        sha.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+    elif isinstance(value, np.ndarray):
+        sha.update(f"{value.dtype}{value.shape}".encode())
+        sha.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, dict):
+        for key in sorted(value, key=repr):
+            sha.update(repr(key).encode())
+            _update_hash(sha, value[key])
+    else:
+        sha.update(repr(value).encode())
+
+def input_hash(kind, kwargs):
+    """Hash of the plot kind and of all its inputs."""
+    sha = hashlib.sha1(kind.encode())
+    _update_hash(sha, kwargs)
+    return sha.hexdigest()
+
+def _stored_hash(save_path):
+    # Input hash written in the PNG metadata by a previous rendering
+    try:
+        with Image.open(save_path) as image:
+            return image.info.get('InputHash')
+    except (OSError, ValueError):
+        return None
+
+def render_figure(kind, save_path, figsize=(10, 6), dpi=100, force=False, **kwargs):
+    """
+    Render one plot helper off-screen with the object-oriented Agg API.
+
+    No pyplot state is used. The hash of the inputs is stored in the PNG
+    metadata and the rasterization is skipped when it has not changed,
+    unless `force` is True.
+
+    Returns:
+    - bool
+        True if the figure was rendered, False if it was up to date.
+    """
+    save_path = Path(save_path)
+    digest = input_hash(kind, dict(kwargs, figsize=figsize, dpi=dpi))
+    if not force and _stored_hash(save_path) == digest:
+        return False
+
+    fig = get_figure(figsize)
+    ax = fig.add_subplot()
+    # The helpers must not save on their own: the figure is saved below
+    if kind == 'clustered_data':
+        kwargs['result_dir'] = None
+    else:
+        kwargs['save_path'] = None
+    PLOTTERS[kind](ax=ax, **kwargs)
+
+    save_path.parent.mkdir(parents=True, exist_ok=True)
+    fig.savefig(save_path, dpi=dpi, bbox_inches='tight', metadata={'InputHash': digest})
+    return True
+
+def _render_job(job):
+    return render_figure(**job)
+
+def render_batch(jobs, n_jobs=None):
+    """
+    Render a batch of figures across a process pool.
+
+    Parameters:
+    - jobs: list of dict
+        Keyword arguments of `render_figure` for each figure, e.g.
+        {'kind': 'pixel_map', 'save_path': ..., 'x': ..., 'y': ..., 'z': ...}.
+    - n_jobs: int, optional
+        Number of worker processes (default is the number of CPUs, 1 renders
+        in this process).
+
+    Returns:
+    - list of bool
+        For each job, whether the figure was rendered or skipped.
+    """
+    if n_jobs == 1:
+        return [_render_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(_render_job, jobs))
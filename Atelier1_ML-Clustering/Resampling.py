@@ -0,0 +1,368 @@
+"""
+Resampling of indentation maps to another grid resolution.
+
+Produces the artificially interpolated maps of the datasets (e.g.
+'MTS_example1_25x25.xls_interp_81x81.xls') used to study how the mapping
+resolution affects clustering: any map on a regular grid is up- or
+downsampled with a separable kernel ('nearest', 'linear', 'cubic',
+'lanczos3' or the cubic 'bspline'), and written with an updated
+'_NI_info.json'. Each axis is resampled by a sparse matrix, one band of
+about CHUNK_SIZE output indents at a time, so memory only grows with the
+source map, not with the target resolution. Downsampling widens the kernel
+(antialiasing).
+
+Examples:
+    python Resampling.py Dataset/Ni_SiC/MTS_example1_25x25.xls_interp_81x81.xls --shape 193 193
+    python Resampling.py Dataset/MatrixFibers/synthetic_composite_data_ratio_E_1.5.xlsx \
+        --sweep 25x25 49x49 97x97 193x193 385x385 --n-clusters 2 -j 4
+"""
+import argparse
+import copy
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import ndimage, sparse
+
+from GridIndex import grid_index, to_grid
+from Loader import load_ni_data
+from Mapping import read_ni_info
+from Streaming import cluster_out_of_core, iter_chunks
+from SyntheticData import MAX_EXCEL_INDENTS, to_excel_export
+
+# Output indents resampled at once
+CHUNK_SIZE = 65536
+
+def _keys_cubic(t, a=-0.5):
+    t = np.abs(t)
+    return np.where(t <= 1, (a + 2) * t**3 - (a + 3) * t**2 + 1,
+                    np.where(t < 2, a * t**3 - 5 * a * t**2 + 8 * a * t - 4 * a, 0.0))
+
+def _bspline(t):
+    t = np.abs(t)
+    return np.where(t <= 1, 2 / 3 - t**2 + t**3 / 2, np.where(t < 2, (2 - t)**3 / 6, 0.0))
+
+# name -> (support radius in source pixels, kernel function)
+KERNELS = {
+    'nearest': (0.5, lambda t: ((t >= -0.5) & (t < 0.5)).astype(float)),
+    'linear': (1.0, lambda t: np.maximum(1 - np.abs(t), 0.0)),
+    'cubic': (2.0, _keys_cubic),
+    'lanczos3': (3.0, lambda t: np.where(np.abs(t) < 3, np.sinc(t) * np.sinc(t / 3), 0.0)),
+    'bspline': (2.0, _bspline),  # Applied to the spline coefficients of the map
+}
+
+def _mirror(indices, n):
+    # Reflect indices outside [0, n - 1] about the edges (scipy.ndimage 'mirror' mode)
+    if n == 1:
+        return np.zeros_like(indices)
+    period = 2 * (n - 1)
+    indices = np.abs(indices) % period
+    return np.where(indices >= n, period - indices, indices)
+
+def kernel_matrix(n_in, n_out, kernel='cubic', antialias=True):
+    """
+    Sparse (n_out, n_in) matrix resampling one axis of a map.
+
+    The first and last samples stay at the first and last positions of the
+    source (the scanned area is unchanged) and the edges are mirrored. When
+    downsampling with `antialias`, the kernel is stretched by the reduction
+    factor, so every source indent contributes to the output.
+    """
+    support, function = KERNELS[kernel]
+    step = (n_in - 1) / (n_out - 1) if n_out > 1 else 0.0
+    positions = np.arange(n_out) * step if n_out > 1 else np.array([(n_in - 1) / 2])
+    scale = max(step, 1.0) if antialias else 1.0
+    radius = int(np.ceil(support * scale))
+    indices = np.floor(positions)[:, None].astype(np.intp) + np.arange(-radius, radius + 2)
+    weights = function((indices - positions[:, None]) / scale)
+    totals = weights.sum(axis=1, keepdims=True)
+    weights = np.divide(weights, totals, out=np.zeros_like(weights), where=totals != 0)
+    rows = np.repeat(np.arange(n_out), indices.shape[1])
+    return sparse.csr_matrix((weights.ravel(), (rows, _mirror(indices, n_in).ravel())), shape=(n_out, n_in))
+
+def _spline_coefficients(grid, shape):
+    # B-spline prefilter along the upsampled axes, so that the 'bspline' kernel interpolates
+    for axis in range(2):
+        if shape[axis] >= grid.shape[axis] > 1:
+            grid = ndimage.spline_filter1d(grid, order=3, axis=axis, mode='mirror')
+    return grid
+
+def iter_resampled_grids(grids, shape, kernel='cubic', tile_rows=256):
+    """
+    Resample 2D maps of the same shape, one band of output rows at a time.
+
+    Missing values (NaN) are filled with the nearest indent before
+    resampling, and every output pixel whose nearest source pixel is missing
+    is set to NaN.
+
+    Parameters:
+    - grids: dict
+        Name -> 2D array (e.g. from `GridIndex.to_grid`).
+    - shape: tuple
+        (rows, cols) of the output maps.
+
+    Yields:
+    - rows: slice
+        Output rows of the band.
+    - bands: dict
+        Name -> (band rows, cols) array.
+    """
+    if kernel not in KERNELS:
+        raise ValueError(f"Unknown kernel '{kernel}', use one of {sorted(KERNELS)}")
+    source_shape = next(iter(grids.values())).shape
+    resample_y = kernel_matrix(source_shape[0], shape[0], kernel)
+    resample_x = kernel_matrix(source_shape[1], shape[1], kernel).T.tocsc()
+    nearest_y = kernel_matrix(source_shape[0], shape[0], 'nearest', antialias=False)
+    nearest_x = kernel_matrix(source_shape[1], shape[1], 'nearest', antialias=False).T.tocsc()
+
+    coefficients, masks = {}, {}
+    for name, grid in grids.items():
+        missing = np.isnan(grid)
+        if missing.all():
+            raise ValueError(f"Map '{name}' has no valid value")
+        if missing.any():
+            nearest = ndimage.distance_transform_edt(missing, return_distances=False, return_indices=True)
+            grid = grid[tuple(nearest)]
+            masks[name] = missing.astype(float)
+        coefficients[name] = _spline_coefficients(grid, shape) if kernel == 'bspline' else grid
+
+    for start in range(0, shape[0], tile_rows):
+        rows = slice(start, min(start + tile_rows, shape[0]))
+        bands = {}
+        for name, grid in coefficients.items():
+            band = (resample_y[rows] @ grid) @ resample_x
+            if name in masks:
+                band[(nearest_y[rows] @ masks[name]) @ nearest_x > 0.5] = np.nan
+            bands[name] = band
+        yield rows, bands
+
+def resample_grid(grid, shape, kernel='cubic'):
+    """Resample a whole 2D map (see `iter_resampled_grids`)."""
+    return np.vstack([bands['grid'] for _, bands in iter_resampled_grids({'grid': grid}, shape, kernel)])
+
+def _is_zigzag(grid_info):
+    settings = (grid_info or {}).get('Test settings', grid_info or {})
+    return str(settings.get('Grid indentation pattern', '')).lower() == 'zigzag'
+
+def iter_resampled_map(data, shape, columns=None, kernel='cubic', chunk_size=CHUNK_SIZE, zigzag=False,
+                       x_column='X Position_µm', y_column='Y Position_µm'):
+    """
+    Resample an indentation map, yielding its indents chunk by chunk.
+
+    Parameters:
+    - columns: list of str, optional
+        Properties to resample (default: every float column but the positions).
+    - zigzag: bool
+        Order the indents of every other row from right to left, as in a
+        'Zigzag' acquisition; otherwise row by row from left to right.
+
+    Yields:
+    - DataFrame
+        Positions and resampled properties of whole rows of indents, about
+        `chunk_size` indents.
+    """
+    if columns is None:
+        columns = [column for column in data.columns
+                   if column not in (x_column, y_column) and pd.api.types.is_float_dtype(data[column])]
+    index = grid_index(data[x_column], data[y_column])
+    if not index.regular:
+        raise ValueError("Resampling needs a map whose indents lie on a regular grid")
+    grids = {column: to_grid(data[column], index, aggregate='mean') for column in columns}
+    x_coords = np.linspace(index.x_coords[0], index.x_coords[-1], shape[1])
+    y_coords = np.linspace(index.y_coords[0], index.y_coords[-1], shape[0])
+
+    for rows, bands in iter_resampled_grids(grids, shape, kernel, max(1, chunk_size // shape[1])):
+        band_rows = np.arange(shape[0])[rows]
+        cols = np.broadcast_to(np.arange(shape[1]), (len(band_rows), shape[1]))
+        if zigzag:
+            cols = np.where((band_rows % 2 == 1)[:, None], cols[:, ::-1], cols)
+        chunk = {x_column: x_coords[cols].ravel(), y_column: np.repeat(y_coords[band_rows], shape[1])}
+        for column in columns:
+            chunk[column] = np.take_along_axis(bands[column], cols, axis=1).ravel()
+        yield pd.DataFrame(chunk)
+
+def resampled_ni_info(grid_info, shape, spacing, kernel, source=None):
+    """
+    '_NI_info.json' content of a resampled map: number of points and spacing
+    updated, and a 'Resampling' section recording the source and kernel.
+    """
+    grid_info = copy.deepcopy(grid_info) if grid_info else {}
+    settings = grid_info.setdefault("Test settings", {})
+    source_shape = (settings.get("Number of points (Y axis)"), settings.get("Number of points (X axis)"))
+    settings["Number of points (X axis)"] = int(shape[1])
+    settings["Number of points (Y axis)"] = int(shape[0])
+    settings["Space between points (X axis)"] = float(spacing[1])
+    settings["Space between points (Y axis)"] = float(spacing[0])
+    if "General information" in grid_info:
+        grid_info["General information"]["Analysis Date"] = date.today().isoformat()
+    grid_info["Resampling"] = {
+        "Source": str(source) if source is not None else None,
+        "Source points (X axis)": source_shape[1],
+        "Source points (Y axis)": source_shape[0],
+        "Kernel": kernel,
+    }
+    return grid_info
+
+def write_resampled_map(data, output_path, shape, kernel='cubic', grid_info=None, columns=None, chunk_size=CHUNK_SIZE,
+                        source=None, x_column='X Position_µm', y_column='Y Position_µm'):
+    """
+    Resample a map and write it with its '<output stem>_NI_info.json'.
+
+    The format follows the extension of `output_path`: '.csv' and '.parquet'
+    (requires pyarrow) are written chunk by chunk, so target maps larger than
+    the memory can be produced; '.xlsx' (at most MAX_EXCEL_INDENTS indents)
+    uses the export layout of the indenter, sheet 'Sheet1'. The indents
+    follow the acquisition pattern of `grid_info` ('Zigzag' or row by row).
+
+    Returns:
+    - dict
+        The '_NI_info.json' content of the resampled map.
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    suffix = output_path.suffix
+    if suffix not in ('.csv', '.parquet', '.xlsx'):
+        raise ValueError("Output format must be .csv, .parquet or .xlsx")
+    if suffix == '.xlsx' and shape[0] * shape[1] > MAX_EXCEL_INDENTS:
+        raise ValueError(f"Excel exports are limited to {MAX_EXCEL_INDENTS} indents, use .csv or .parquet")
+
+    chunks, writer = [], None
+    try:
+        for i, chunk in enumerate(iter_resampled_map(data, shape, columns, kernel, chunk_size, _is_zigzag(grid_info),
+                                                     x_column, y_column)):
+            if suffix == '.csv':
+                chunk.to_csv(output_path, mode='a' if i else 'w', header=not i, index=False)
+            elif suffix == '.parquet':
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+            else:
+                chunks.append(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if suffix == '.xlsx':
+        to_excel_export(pd.concat(chunks, ignore_index=True), output_path)
+
+    spacing = [np.ptp(data[column]) / max(n - 1, 1) for column, n in ((y_column, shape[0]), (x_column, shape[1]))]
+    info = resampled_ni_info(grid_info, shape, spacing, kernel, source)
+    with open(output_path.with_name(f"{output_path.stem}_NI_info.json"), 'w') as file:
+        json.dump(info, file, indent=4, ensure_ascii=False)
+    print(f"{shape[0]}x{shape[1]} map saved to {output_path}")
+    return info
+
+def read_dataset_ni_info(file_path):
+    """Content of the '<name>_NI_info.json' file next to a dataset, or None (see `Mapping.read_ni_info`)."""
+    file_path = Path(file_path)
+    info_path = file_path.with_name(f"{file_path.stem}_NI_info.json")
+    return read_ni_info(info_path) if info_path.exists() else None
+
+def resampled_path(file_path, shape, suffix=None):
+    """Name of a resampled dataset, as in the shipped ones: '<file name>_interp_<rows>x<cols><suffix>'."""
+    file_path = Path(file_path)
+    if suffix is None:
+        suffix = '.xlsx' if shape[0] * shape[1] <= MAX_EXCEL_INDENTS else '.csv'
+    return file_path.with_name(f"{file_path.name}_interp_{shape[0]}x{shape[1]}{suffix}")
+
+def _cluster_summary(map_path, labels_path, features, chunksize):
+    # Indents and feature sums of every cluster, in one pass over the map and its labels
+    counts, sums = {}, {}
+    for chunk, labels in zip(iter_chunks(map_path, features, chunksize),
+                             iter_chunks(labels_path, ['Cluster'], chunksize)):
+        for cluster, group in chunk.groupby(labels['Cluster'].to_numpy()):
+            counts[cluster] = counts.get(cluster, 0) + len(group)
+            sums[cluster] = sums.get(cluster, 0) + group[features].sum().to_numpy()
+    return counts, sums
+
+def _sweep_job(job):
+    # Worker: resample to one shape, cluster out of core and summarize the clusters
+    data, shape, grid_info, source, features, n_clusters, kernel, method, work_dir, chunksize = job
+    start = time.perf_counter()
+    map_path = Path(work_dir) / resampled_path(source, shape, '.csv').name
+    write_resampled_map(data, map_path, shape, kernel, grid_info, columns=list(features), source=source)
+    labels_path = map_path.with_name(f"{map_path.stem}_labels.csv")
+    cluster_out_of_core(map_path, labels_path, list(features), n_clusters, method, chunksize)
+    counts, sums = _cluster_summary(map_path, labels_path, list(features), chunksize)
+    n_indents = sum(counts.values())
+    clusters = sorted((cluster for cluster in counts if cluster >= 0), key=lambda c: sums[c][0] / counts[c])
+    rows = []
+    for rank, cluster in enumerate(clusters):
+        row = {'shape': f"{shape[0]}x{shape[1]}", 'n_indents': n_indents, 'cluster': rank,
+               'fraction': counts[cluster] / n_indents}
+        row.update({f"mean {feature}": total / counts[cluster] for feature, total in zip(features, sums[cluster])})
+        rows.append(row)
+    elapsed = time.perf_counter() - start
+    for row in rows:
+        row['time_s'] = elapsed
+    return rows
+
+def resolution_sweep(data, shapes, n_clusters, features=('HARDNESS_GPa', 'MODULUS_GPa'), kernel='cubic',
+                     method='KMeans', grid_info=None, source='map', work_dir=Path("Results/Resampling"),
+                     n_jobs=None, chunksize=100000):
+    """
+    Cluster a map resampled to several resolutions, one resolution per worker process.
+
+    Every resolution is written to `work_dir` chunk by chunk and clustered out
+    of core (see `Streaming.cluster_out_of_core`), so the memory of a worker
+    stays flat whatever the target resolution.
+
+    Returns:
+    - DataFrame
+        One row per resolution and cluster (ordered by the mean of the first
+        feature): number of indents, cluster fraction, feature means and
+        time; also saved to '<work_dir>/resolution_sweep.csv'.
+    """
+    work_dir = Path(work_dir)
+    work_dir.mkdir(parents=True, exist_ok=True)
+    jobs = [(data, tuple(shape), grid_info, source, tuple(features), n_clusters, kernel, method, work_dir, chunksize)
+            for shape in shapes]
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        summary = pd.DataFrame([row for rows in executor.map(_sweep_job, jobs) for row in rows])
+    summary.to_csv(work_dir / 'resolution_sweep.csv', index=False)
+    return summary
+
+def _shape(text):
+    rows, cols = text.lower().split('x')
+    return int(rows), int(cols)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resample an indentation map, or cluster it at several resolutions.")
+    parser.add_argument('dataset', help="Excel export (.xls/.xlsx) of a map on a regular grid")
+    parser.add_argument('--sheet', default=None, help="Sheet name (default: 'Sheet1' for .xlsx, 'Sample' otherwise)")
+    parser.add_argument('--shape', nargs=2, type=int, metavar=('ROWS', 'COLS'), help="Resample to this grid")
+    parser.add_argument('--output', default=None,
+                        help="Output file (.csv, .parquet or .xlsx, default: '<dataset>_interp_<rows>x<cols>.xlsx')")
+    parser.add_argument('--kernel', choices=sorted(KERNELS), default='cubic')
+    parser.add_argument('--sweep', nargs='+', type=_shape, metavar='ROWSxCOLS', help="Resolutions of the sweep")
+    parser.add_argument('--n-clusters', type=int, default=3)
+    parser.add_argument('--method', choices=['KMeans', 'GMM'], default='KMeans')
+    parser.add_argument('--results', default='Results/Resampling', help="Directory of the sweep maps and summary")
+    parser.add_argument('-j', '--jobs', type=int, default=None, help="Number of worker processes")
+    args = parser.parse_args(argv)
+    if (args.shape is None) == (args.sweep is None):
+        parser.error("give either --shape or --sweep")
+
+    file_path = Path(args.dataset)
+    sheet_name = args.sheet or ('Sheet1' if file_path.suffix == '.xlsx' else 'Sample')
+    data = load_ni_data([file_path], sheet_name=sheet_name)
+    grid_info = read_dataset_ni_info(file_path)
+    if args.shape is not None:
+        output = Path(args.output) if args.output else resampled_path(file_path, args.shape)
+        write_resampled_map(data, output, args.shape, args.kernel, grid_info, source=file_path.name)
+    else:
+        summary = resolution_sweep(data, args.sweep, args.n_clusters, kernel=args.kernel, method=args.method,
+                                   grid_info=grid_info, source=file_path.name, work_dir=args.results,
+                                   n_jobs=args.jobs)
+        print(summary.to_string(index=False))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,147 @@
+"""
+One chunked, compressed HDF5 store per sample (or per campaign) for the results of a run.
+
+Layout of a sample (the root of the file, or one group per sample of a campaign):
+    properties/<column>       raw property columns (X/Y positions, hardness, modulus...)
+    features/<column>         derived features (KAMM, PCA scores...), same rows
+    labels/<method>_k<k>      cluster labels of every method and number of clusters
+    models/<method>_k<k>/...  fitted model parameters (centers, means, covariances...)
+    grids/<name>              2D maps, stored by tiles
+and the JSON metadata ('_NI_info.json', '_stats.json'...) as attributes.
+
+Every column and tile is a separate chunk, so a dashboard reads only the
+columns, rows or tiles it asks for. Requires h5py (optional dependency).
+"""
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Chunk size of the columns, and tile shape of the grids
+CHUNK_ROWS = 65536
+TILE = (128, 128)
+
+# Side-car metadata files of a dataset, stored as attributes of its sample
+SIDECAR_METADATA = {'NI_info': '_NI_info.json', 'stats': '_stats.json'}
+
+def open_store(file_path, mode='a'):
+    """Open (or create) a result store; use it as a context manager."""
+    import h5py
+    return h5py.File(file_path, mode)
+
+def _replace(group, name, data, chunks, compression='gzip'):
+    # Write a dataset, replacing any previous version of it
+    import h5py
+    if name in group:
+        del group[name]
+    data = np.asarray(data)
+    dtype = None
+    if data.dtype.kind in 'OU':  # Text columns
+        data, dtype = data.astype(str).astype(object), h5py.string_dtype()
+    chunks = tuple(min(c, s) for c, s in zip(chunks, data.shape)) if data.size else True
+    return group.create_dataset(name, data=data, dtype=dtype, chunks=chunks, compression=compression,
+                                shuffle=compression is not None and dtype is None)
+
+def set_metadata(node, key, value):
+    """Store a JSON-serializable value (e.g. the content of '_NI_info.json') as an attribute."""
+    node.attrs[key] = json.dumps(value)
+
+def get_metadata(node, key, default=None):
+    """Read back an attribute written by `set_metadata`."""
+    return json.loads(node.attrs[key]) if key in node.attrs else default
+
+def write_sidecar_metadata(root, file_path):
+    """Store the '<name>_NI_info.json' and '<name>_stats.json' files next to a dataset, if any."""
+    file_path = Path(file_path)
+    for key, suffix in SIDECAR_METADATA.items():
+        sidecar = file_path.with_name(file_path.stem + suffix)
+        if sidecar.exists():
+            with open(sidecar, 'r', encoding='utf-8') as file:
+                set_metadata(root, key, json.load(file))
+
+def write_table(root, name, data, chunk_rows=CHUNK_ROWS, compression='gzip'):
+    """
+    Write the columns of a DataFrame, one chunked dataset per column.
+
+    Columns already in the group are replaced, the others are kept, so
+    features can be added run after run.
+    """
+    group = root.require_group(name)
+    columns = list(get_metadata(group, 'columns', []))
+    for column in data.columns:
+        _replace(group, column, data[column].to_numpy(), (chunk_rows,), compression)
+        if column not in columns:
+            columns.append(column)
+    set_metadata(group, 'columns', columns)
+    return group
+
+def read_table(root, name, columns=None, rows=slice(None)):
+    """
+    Read some columns (default: all) and rows of a table into a DataFrame.
+
+    Only the chunks holding the requested rows of the requested columns are
+    read and decompressed.
+    """
+    group = root[name]
+    columns = get_metadata(group, 'columns') if columns is None else list(columns)
+    return pd.DataFrame({column: (group[column].asstr() if group[column].dtype.kind == 'O' else group[column])[rows]
+                         for column in columns})
+
+def write_labels(root, method, k, labels, model=None, compression='gzip'):
+    """
+    Write the cluster labels of one method and number of clusters, and the
+    fitted model parameters (see `write_model`) if a model is given.
+    """
+    key = f"{method}_k{k}"
+    dataset = _replace(root.require_group('labels'), key, np.asarray(labels, dtype=np.int32), (CHUNK_ROWS,),
+                       compression)
+    dataset.attrs['method'], dataset.attrs['k'] = method, int(k)
+    if model is not None:
+        write_model(root, key, model)
+    return dataset
+
+def read_labels(root, method, k, rows=slice(None)):
+    """Labels of one method and number of clusters (all rows, or the given ones)."""
+    return root['labels'][f"{method}_k{k}"][rows]
+
+def write_model(root, name, model):
+    """
+    Write the fitted parameters of a scikit-learn model: its array and scalar
+    attributes ending with '_' (cluster_centers_, means_, covariances_,
+    weights_, inertia_...) as datasets, and its hyper-parameters as metadata.
+    """
+    models = root.require_group('models')
+    if name in models:
+        del models[name]
+    group = models.create_group(name)
+    group.attrs['class'] = type(model).__name__
+    set_metadata(group, 'params', {key: value for key, value in model.get_params().items()
+                                   if isinstance(value, (bool, int, float, str, type(None)))})
+    for attribute, value in vars(model).items():
+        if attribute.endswith('_') and not attribute.startswith('_'):
+            value = np.asarray(value) if isinstance(value, (np.ndarray, np.generic, bool, int, float)) else None
+            if value is not None and value.dtype.kind in 'biuf':
+                group.create_dataset(attribute, data=value)
+    return group
+
+def read_model(root, name):
+    """Parameters of a stored model as a dict (class name and hyper-parameters included)."""
+    group = root['models'][name]
+    parameters = {attribute: group[attribute][()] for attribute in group}
+    parameters['class'] = group.attrs['class']
+    parameters['params'] = get_metadata(group, 'params')
+    return parameters
+
+def write_grid(root, name, grid, tile=TILE, compression='gzip'):
+    """Write a 2D map (e.g. from `GridIndex.to_grid`) by tiles of `tile` pixels."""
+    return _replace(root.require_group('grids'), name, grid, tile, compression)
+
+def read_tile(root, name, rows=slice(None), cols=slice(None)):
+    """Read a window of a map; only the tiles overlapping it are read."""
+    return root['grids'][name][rows, cols]
+
+def list_results(root):
+    """Names of the tables, labels, models and grids of a sample."""
+    return {group: sorted(root[group]) for group in ('properties', 'features', 'labels', 'models', 'grids')
+            if group in root}
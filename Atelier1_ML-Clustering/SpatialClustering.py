@@ -0,0 +1,137 @@
+import numpy as np
+from scipy import sparse
+from sklearn.cluster import AgglomerativeClustering, KMeans
+from sklearn.mixture import GaussianMixture
+from sklearn.neighbors import kneighbors_graph
+
+from GridIndex import grid_index
+from Instrumentation import instrument
+
+# Neighbour offsets (row, col) of the 4- and 8-connected grid graphs
+GRID_OFFSETS = {
+    4: [(0, 1), (1, 0)],
+    8: [(0, 1), (1, 0), (1, 1), (1, -1)],
+}
+
+def grid_connectivity(index, neighbors=4):
+    """
+    Sparse adjacency matrix of the indents from their grid index.
+
+    Runs in O(n) time and memory: every indent is linked to the indents of
+    the neighbouring grid nodes (4 or 8 neighbours).
+
+    Returns:
+    - scipy.sparse.csr_matrix (n, n)
+        Symmetric 0/1 matrix.
+    """
+    n = len(index.rows)
+    ids = np.full(index.shape, -1, dtype=np.intp)
+    ids[index.rows, index.cols] = np.arange(n)
+    sources, targets = [], []
+    for dr, dc in GRID_OFFSETS[neighbors]:
+        rows, cols = index.rows + dr, index.cols + dc
+        inside = (rows >= 0) & (rows < index.shape[0]) & (cols >= 0) & (cols < index.shape[1])
+        neighbor = np.full(n, -1, dtype=np.intp)
+        neighbor[inside] = ids[rows[inside], cols[inside]]
+        linked = neighbor >= 0
+        sources.append(np.flatnonzero(linked))
+        targets.append(neighbor[linked])
+    sources, targets = np.concatenate(sources), np.concatenate(targets)
+    adjacency = sparse.coo_matrix((np.ones(len(sources)), (sources, targets)), shape=(n, n))
+    return ((adjacency + adjacency.T) > 0).astype(np.float64).tocsr()
+
+def knn_connectivity(x, y, n_neighbors=8):
+    """Symmetric sparse k-nearest-neighbour adjacency matrix of scattered positions."""
+    positions = np.column_stack((np.asarray(x, dtype=float), np.asarray(y, dtype=float)))
+    adjacency = kneighbors_graph(positions, n_neighbors=n_neighbors, include_self=False)
+    return ((adjacency + adjacency.T) > 0).astype(np.float64).tocsr()
+
+@instrument
+def spatial_connectivity(x, y, index=None, neighbors=4, n_neighbors=8):
+    """
+    Sparse connectivity of a map, built once per dataset.
+
+    Uses the grid adjacency when the indents lie on a regular grid with at
+    most one indent per node, and falls back to k nearest neighbours
+    otherwise.
+
+    Returns:
+    - connectivity: scipy.sparse.csr_matrix (n, n)
+    - parity: ndarray of int or None
+        Checkerboard colouring of the grid (used by `mrf_smooth`), None
+        for the k-nearest-neighbour graph.
+    """
+    if index is None:
+        index = grid_index(x, y)
+    if index.regular and index.unique:
+        parity = (index.rows + index.cols) % 2 if neighbors == 4 else None
+        return grid_connectivity(index, neighbors), parity
+    return knn_connectivity(x, y, n_neighbors), None
+
+@instrument
+def agglomerative_spatial(X, connectivity, n_clusters, linkage='ward'):
+    """
+    Connectivity-constrained agglomerative clustering.
+
+    Only neighbouring indents (or clusters) can be merged, so the tree is
+    built from the sparse connectivity instead of all pairwise distances.
+    """
+    model = AgglomerativeClustering(n_clusters=n_clusters, connectivity=connectivity, linkage=linkage)
+    return model.fit_predict(X)
+
+def unary_costs(model, X):
+    """
+    Cost (negative log-likelihood) of every label for every indent.
+
+    For a GaussianMixture, -log(weight_k * N(x | k)); for KMeans, the
+    identical spherical Gaussians model behind it.
+
+    Returns:
+    - ndarray (n, n_clusters)
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if isinstance(model, GaussianMixture):
+        log_resp = np.log(np.maximum(model.predict_proba(X), np.finfo(float).tiny))
+        return -(log_resp + model.score_samples(X)[:, None])
+    if isinstance(model, KMeans):
+        distances = ((X[:, None, :] - model.cluster_centers_[None, :, :])**2).sum(axis=2)
+        variance = max(model.inertia_ / X.size, np.finfo(float).tiny)
+        return distances / (2 * variance)
+    raise ValueError("Unsupported clustering model")
+
+@instrument
+def mrf_smooth(costs, connectivity, beta=1.0, n_iter=20, labels=None, parity=None):
+    """
+    Markov random field (Potts model) smoothing of cluster labels by iterated conditional modes.
+
+    Each indent takes the label minimizing its unary cost minus `beta` times
+    the number of neighbours sharing that label. All indents are updated at
+    once with one sparse product per iteration; with a checkerboard
+    `parity`, the two colours are updated in turn, which avoids
+    oscillations.
+
+    Parameters:
+    - costs: ndarray (n, n_clusters)
+        Unary costs, e.g. from `unary_costs`.
+    - connectivity: scipy.sparse matrix (n, n)
+    - labels: ndarray, optional
+        Initial labels (default: the labels of minimal unary cost).
+
+    Returns:
+    - ndarray of int (n,)
+        Smoothed labels.
+    """
+    n, n_clusters = costs.shape
+    labels = np.argmin(costs, axis=1) if labels is None else np.asarray(labels).copy()
+    groups = [np.arange(n)] if parity is None else [np.flatnonzero(parity == p) for p in (0, 1)]
+    for _ in range(n_iter):
+        changed = 0
+        for group in groups:
+            one_hot = sparse.csr_matrix((np.ones(n), (np.arange(n), labels)), shape=(n, n_clusters))
+            agreement = (connectivity[group] @ one_hot).toarray()
+            new_labels = np.argmin(costs[group] - beta * agreement, axis=1)
+            changed += np.count_nonzero(new_labels != labels[group])
+            labels[group] = new_labels
+        if changed == 0:
+            break
+    return labels
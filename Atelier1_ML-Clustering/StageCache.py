@@ -0,0 +1,219 @@
+"""
+Disk memoization of pipeline stages, keyed by a content hash of their inputs.
+
+A stage is any function of arrays, DataFrames, scalars and (unfitted)
+scikit-learn models. Its output is pickled under a hash of the code of the
+stage (see `_source`) and of every input argument, so a stage re-runs only
+when its inputs or its code change: re-running a notebook after changing a
+plotting option (cMap, xDim...) reloads the fitted models instead of
+refitting them. The cache is bounded in size, the least recently used entries are evicted first.
+
+Atelier2_CPFEM-NI/2_postProc/stageCache_def.py is a copy of this module, so that
+each workshop runs from its own folder: keep both in sync
+(benchmarks/check_shared_copies.py).
+
+Example:
+    stages = StageCache(result_dir / 'cache' / 'stages')
+    select_n_clusters = stages.stage(select_n_clusters, ignore=('n_jobs',))
+    kmeans = stages.run(KMeans(n_clusters=3, random_state=42).fit, X)
+"""
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import tempfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from Instrumentation import span
+
+CACHE_VERSION = 2
+
+def _update(sha, value):
+    # Feed a canonical byte representation of `value` to the hash
+    if isinstance(value, (pd.DataFrame, pd.Series, pd.Index)):
+        sha.update(type(value).__name__.encode())
+        if not isinstance(value, pd.Index):
+            _update(sha, list(value.columns) if isinstance(value, pd.DataFrame) else value.name)
+            _update(sha, value.index)
+        sha.update(pd.util.hash_pandas_object(value, index=False).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        value = np.ascontiguousarray(value)
+        sha.update(f"ndarray{value.dtype.str}{value.shape}".encode())
+        sha.update(value.tobytes() if value.dtype.kind != 'O' else pickle.dumps(value.tolist()))
+    elif sparse.issparse(value):  # e.g. a spatial connectivity
+        value = sparse.csr_matrix(value)
+        sha.update(f"sparse{value.shape}".encode())
+        for array in (value.indptr, value.indices, value.data):
+            _update(sha, array)
+    elif isinstance(value, (list, tuple)):
+        sha.update(f"{type(value).__name__}{len(value)}".encode())
+        for item in value:
+            _update(sha, item)
+    elif isinstance(value, dict):
+        sha.update(f"dict{len(value)}".encode())
+        for key in sorted(value, key=repr):
+            _update(sha, key)
+            _update(sha, value[key])
+    elif value is None or isinstance(value, (bool, int, float, complex, str, bytes, range, Path, np.generic)):
+        sha.update(f"{type(value).__name__}:{value!r}".encode())
+    elif inspect.ismethod(value):
+        _update(sha, value.__self__)
+        sha.update(value.__func__.__qualname__.encode())
+    elif callable(getattr(value, 'get_params', None)):
+        # Unfitted scikit-learn estimator: its class and hyper-parameters
+        sha.update(f"{type(value).__module__}.{type(value).__qualname__}".encode())
+        _update(sha, value.get_params(deep=False))
+    elif callable(value):
+        sha.update(f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', repr(value))}".encode())
+    else:
+        raise TypeError(f"Cannot hash a stage input of type {type(value).__name__}")
+
+def input_hash(*values):
+    """Content hash of stage inputs (arrays, DataFrames, sparse matrices, scalars, containers, estimators)."""
+    sha = hashlib.sha1(f"v{CACHE_VERSION}".encode())
+    for value in values:
+        _update(sha, value)
+    return sha.hexdigest()
+
+def _local_modules(module, modules):
+    # `module` and the modules of its own folder that it uses, directly or through one another
+    modules[module.__name__] = module
+    folder = Path(module.__file__).parent
+    for value in vars(module).values():
+        used = value if inspect.ismodule(value) else inspect.getmodule(value)
+        if used is None or used.__name__ in modules or getattr(used, '__file__', None) is None:
+            continue
+        if Path(used.__file__).parent == folder:
+            _local_modules(used, modules)
+    return modules
+
+def _source(function):
+    """
+    Code a stage depends on, so that editing it invalidates its cached outputs.
+
+    This is the source of the whole module defining the stage and of the
+    modules of the same folder it uses (so that editing a helper, e.g.
+    `ModelSelection._fit`, is detected), plus the version of the package the
+    module belongs to (e.g. scikit-learn for `KMeans.fit`).
+    """
+    function = getattr(function, '__func__', function)
+    module = inspect.getmodule(function)
+    if module is None or getattr(module, '__file__', None) is None:  # Builtins, interactive code
+        try:
+            return inspect.getsource(function)
+        except (OSError, TypeError):
+            return getattr(function, '__qualname__', repr(function))
+    package = sys.modules.get(module.__name__.partition('.')[0])
+    parts = [f"{module.__name__}.{getattr(function, '__qualname__', '')} {getattr(package, '__version__', '')}"]
+    for name, used in sorted(_local_modules(module, {}).items()):
+        try:
+            parts.append(f"{name}\n{inspect.getsource(used)}")
+        except (OSError, TypeError):
+            parts.append(name)
+    return '\n'.join(parts)
+
+class StageCache:
+    """
+    Pickled stage outputs in `cache_dir`, at most `max_bytes` in total.
+
+    Entries are files named '<stage>_<hash>.pkl'; their modification time
+    records the last use, and the least recently used ones are deleted when
+    the cache grows beyond `max_bytes`.
+    """
+
+    def __init__(self, cache_dir, max_bytes=512 * 2**20):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, name, function, arguments):
+        return f"{name}_{input_hash(_source(function), arguments)}"
+
+    def _load(self, file_path):
+        try:
+            with open(file_path, 'rb') as file:
+                output = pickle.load(file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return False, None
+        os.utime(file_path)  # Mark as recently used
+        return True, output
+
+    def _save(self, file_path, output):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so that parallel runs never read a partial file
+        with tempfile.NamedTemporaryFile(dir=self.cache_dir, suffix='.tmp', delete=False) as file:
+            pickle.dump(output, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(file.name, file_path)
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used entries until the cache fits in `max_bytes`."""
+        entries = []
+        for file_path in self.cache_dir.glob('*.pkl'):
+            try:
+                stat = file_path.stat()
+            except FileNotFoundError:  # Evicted by another process
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, file_path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, file_path in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            file_path.unlink(missing_ok=True)
+            total -= size
+
+    def run(self, function, *args, name=None, ignore=(), **kwargs):
+        """Call `function(*args, **kwargs)`, or return its cached output for the same inputs."""
+        if name is None:
+            name = getattr(function, '__name__', 'stage')
+        try:
+            bound = inspect.signature(function).bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {key: value for key, value in bound.arguments.items() if key not in ignore}
+        except (TypeError, ValueError):  # No signature (e.g. some builtins)
+            arguments = {'args': args, 'kwargs': kwargs}
+        inputs = (function.__self__ if inspect.ismethod(function) else None, arguments)
+        file_path = self.cache_dir / f"{self.key(name, function, inputs)}.pkl"
+        if file_path.exists():
+            with span(f"stage:{name}", cached=True):
+                found, output = self._load(file_path)
+            if found:
+                self.hits += 1
+                return output
+        self.misses += 1
+        with span(f"stage:{name}", cached=False):
+            output = function(*args, **kwargs)
+            self._save(file_path, output)
+        return output
+
+    def stage(self, function=None, *, name=None, ignore=()):
+        """
+        Memoized version of `function` (also usable as a decorator).
+
+        Parameters:
+        - ignore: tuple of str
+            Arguments that do not change the output (e.g. 'n_jobs').
+        """
+        if function is None:
+            return functools.partial(self.stage, name=name, ignore=ignore)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            return self.run(function, *args, name=name or function.__name__, ignore=ignore, **kwargs)
+        return wrapper
+
+    def size(self):
+        """Total size of the cached outputs in bytes."""
+        return sum(file_path.stat().st_size for file_path in self.cache_dir.glob('*.pkl'))
+
+    def clear(self):
+        """Delete all the cached outputs."""
+        for file_path in self.cache_dir.glob('*.pkl'):
+            file_path.unlink(missing_ok=True)
@@ -0,0 +1,228 @@
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.mixture import GaussianMixture
+
+def weibull_fit(samples, n_iter=50, tol=1e-10):
+    """
+    Maximum likelihood Weibull fit (location fixed at 0) of many samples at once.
+
+    Same estimate as `scipy.stats.weibull_min.fit(x, floc=0)`, solved with a
+    Newton iteration on the shape of every row simultaneously.
+
+    Parameters:
+    - samples: array-like (n_fits, n) or (n,)
+        Positive values, one sample per row. NaN are ignored.
+
+    Returns:
+    - shape: ndarray (n_fits,)
+        Weibull modulus (NaN for rows with less than 2 distinct values).
+    - scale: ndarray (n_fits,)
+        Weibull scale (NaN for the same rows).
+    """
+    x = np.atleast_2d(np.asarray(samples, dtype=np.float64))
+    valid = np.isfinite(x) & (x > 0)
+    n = np.maximum(valid.sum(axis=1), 1)
+    # The shape does not depend on the scale: normalize by the row maximum for stability
+    x_max = np.where(valid, x, 0).max(axis=1, keepdims=True, initial=0)
+    x_max[x_max == 0] = 1
+    log_x = np.where(valid, np.log(np.where(valid, x, 1) / x_max), 0.0)
+    mean_log = log_x.sum(axis=1) / n
+
+    # Initial guess from the spread of log(x) (Menon estimator)
+    std_log = np.sqrt((np.where(valid, log_x - mean_log[:, None], 0)**2).sum(axis=1) / n)
+    # No spread (single value, or a resample of one repeated value): the modulus is undefined
+    degenerate = std_log <= 1e-12 * np.maximum(np.abs(mean_log), 1)
+    k = np.pi / (np.sqrt(6) * np.where(degenerate, 1, std_log))
+    for _ in range(n_iter):
+        x_k = np.where(valid, np.exp(k[:, None] * log_x), 0.0)
+        s0 = x_k.sum(axis=1)
+        s1 = (x_k * log_x).sum(axis=1)
+        s2 = (x_k * log_x**2).sum(axis=1)
+        g = s1 / s0 - 1 / k - mean_log
+        dg = s2 / s0 - (s1 / s0)**2 + 1 / k**2
+        step = np.where(degenerate, 0, g / dg)
+        k = np.maximum(k - step, k / 10)
+        if np.all(np.abs(step) <= tol * k):
+            break
+
+    x_k = np.where(valid, np.exp(k[:, None] * log_x), 0.0)
+    scale = x_max[:, 0] * (x_k.sum(axis=1) / n)**(1 / k)
+    return np.where(degenerate, np.nan, k), np.where(degenerate, np.nan, scale)
+
+def bootstrap_weibull(values, n_resamples=1000, random_state=0, chunk_size=200):
+    """
+    Weibull fit of the values and of `n_resamples` bootstrap resamples.
+
+    Resamples are fitted `chunk_size` rows at a time to bound memory.
+
+    Returns:
+    - estimate: ndarray (2,)
+        Shape and scale of the fit of the values.
+    - resampled: ndarray (n_resamples, 2)
+        Shape and scale of every resample.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values) & (values > 0)]
+    estimate = np.ravel(weibull_fit(values))
+    rng = np.random.default_rng(random_state)
+    resampled = np.empty((n_resamples, 2))
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        samples = values[rng.integers(0, len(values), size=(size, len(values)))]
+        resampled[start:start + size] = np.column_stack(weibull_fit(samples))
+    return estimate, resampled
+
+def _em_1d(centers, counts, weights, means, variances, n_iter=200, tol=1e-6, reg_covar=1e-6):
+    # EM of a 1D GMM on binned data, for many count vectors (rows of `counts`) at once.
+    # Rows are dropped from the iteration as soon as they have converged.
+    weights, means, variances = (np.array(v, dtype=np.float64) for v in (weights, means, variances))
+    n = counts.sum(axis=1)
+    active = np.arange(len(counts))
+    previous = np.full(len(counts), -np.inf)
+    for _ in range(n_iter):
+        c, w, mu, var = counts[active], weights[active], means[active], variances[active]
+        log_prob = (np.log(w / np.sqrt(2 * np.pi * var))[:, :, None]
+                    - 0.5 * (centers[None, None, :] - mu[:, :, None])**2 / var[:, :, None])
+        log_max = log_prob.max(axis=1, keepdims=True)
+        prob = np.exp(log_prob - log_max)
+        total = prob.sum(axis=1, keepdims=True)
+        resp = prob * (c[:, None, :] / total)
+        nk = resp.sum(axis=2) + 10 * np.finfo(float).eps
+        weights[active] = nk / n[active, None]
+        mu = (resp @ centers) / nk
+        means[active] = mu
+        variances[active] = np.einsum('bkm,bkm->bk', resp, (centers[None, None, :] - mu[:, :, None])**2) / nk + reg_covar
+        lower_bound = (c * (np.log(total[:, 0]) + log_max[:, 0])).sum(axis=1) / n[active]
+        converged = np.abs(lower_bound - previous[active]) < tol
+        previous[active] = lower_bound
+        active = active[~converged]
+        if not len(active):
+            break
+    return weights, means, variances
+
+def bootstrap_phase_fractions(values, n_components, n_resamples=1000, random_state=0, n_bins=256, chunk_size=250):
+    """
+    1D GMM phase fractions, means and standard deviations, with bootstrap resamples.
+
+    The values and all the resamples are fitted together by a vectorized EM
+    on a fine histogram of the values (a bootstrap resample is a
+    multinomial draw of the bin counts). Every fit starts from the
+    scikit-learn fit of the values, which also keeps the components matched
+    across resamples. Components are sorted by increasing mean.
+
+    Returns:
+    - estimate: ndarray (3, n_components)
+        Fractions, means and standard deviations of the fit of the values.
+    - resampled: ndarray (n_resamples, 3, n_components)
+    """
+    values = np.asarray(values, dtype=np.float64)
+    values = values[np.isfinite(values)]
+    gmm = GaussianMixture(n_components=n_components, random_state=random_state).fit(values.reshape(-1, 1))
+    order = np.argsort(gmm.means_.ravel())
+    init = gmm.weights_[order], gmm.means_.ravel()[order], gmm.covariances_.ravel()[order]
+
+    counts, edges = np.histogram(values, bins=n_bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    # Only the non-empty bins of the values can be drawn
+    centers, counts = centers[counts > 0], counts[counts > 0]
+    weights, means, variances = (v[0] for v in _em_1d(centers, counts[None].astype(np.float64),
+                                                       *(np.atleast_2d(v) for v in init)))
+    estimate = np.array([weights, means, np.sqrt(variances)])
+    rng = np.random.default_rng(random_state)
+    resampled = np.empty((n_resamples, 3, n_components))
+    for start in range(0, n_resamples, chunk_size):
+        size = min(chunk_size, n_resamples - start)
+        sample_counts = rng.multinomial(len(values), counts / counts.sum(), size=size).astype(np.float64)
+        fit = _em_1d(centers, sample_counts, np.tile(weights, (size, 1)), np.tile(means, (size, 1)),
+                     np.tile(variances, (size, 1)))
+        resampled[start:start + size] = np.stack([fit[0], fit[1], np.sqrt(fit[2])], axis=1)
+    return estimate, resampled
+
+def _rows(property_name, cluster, n, n_used, statistic, estimate, resampled, alpha):
+    if resampled is None:  # Not fitted: NaN statistics
+        return [{'Property': property_name, 'Cluster': cluster, 'N': n, 'N_used': n_used, 'Statistic': name,
+                 'Estimate': np.nan, 'CI_low': np.nan, 'CI_high': np.nan, 'Std': np.nan} for name in statistic]
+    low, high = np.nanpercentile(resampled, [100 * alpha / 2, 100 * (1 - alpha / 2)], axis=0)
+    return [{'Property': property_name, 'Cluster': cluster, 'N': n, 'N_used': n_used, 'Statistic': name,
+             'Estimate': e, 'CI_low': l, 'CI_high': h, 'Std': s}
+            for name, e, l, h, s in zip(statistic, np.ravel(estimate), np.ravel(low), np.ravel(high),
+                                        np.ravel(np.nanstd(resampled, axis=0)))]
+
+def _run_task(task):
+    # One property of one cluster: Weibull and GMM bootstraps. Every group gets the same
+    # statistics, with NaN (and N_used = 0) for the fits that were skipped.
+    property_name, cluster, values, n_components, n_resamples, confidence, min_size, random_state = task
+    alpha = 1 - confidence
+    n = len(values)
+    positive = values[values > 0]  # The Weibull fit needs positive values
+    if len(positive) >= min_size:
+        estimate, resampled = bootstrap_weibull(positive, n_resamples, random_state)
+        rows = _rows(property_name, cluster, n, len(positive), ['Weibull modulus', 'Weibull scale'],
+                     estimate, resampled, alpha)
+    else:
+        rows = _rows(property_name, cluster, n, 0, ['Weibull modulus', 'Weibull scale'], None, None, alpha)
+    if n_components:
+        names = [f"GMM {stat} {i + 1}" for stat in ('fraction', 'mean', 'std') for i in range(n_components)]
+        if n >= min_size and n > n_components:
+            estimate, resampled = bootstrap_phase_fractions(values, n_components, n_resamples, random_state)
+            rows += _rows(property_name, cluster, n, n, names, estimate, resampled.reshape(n_resamples, -1), alpha)
+        else:
+            rows += _rows(property_name, cluster, n, 0, names, None, None, alpha)
+    return rows
+
+def batch_statistics(data, columns, cluster_column=None, n_components=3, n_resamples=1000, confidence=0.95,
+                     min_size=2, n_jobs=None, random_state=0):
+    """
+    Weibull and GMM statistics with bootstrap confidence intervals, for every
+    property and every cluster.
+
+    Each (property, cluster) pair is a task run on a pool of worker processes.
+    Within a task, the Weibull fits of all the resamples are vectorized.
+
+    Parameters:
+    - data: DataFrame
+    - columns: list of str
+        Properties to analyse (e.g. ['HARDNESS_GPa', 'MODULUS_GPa']).
+    - cluster_column: str, optional
+        Column of cluster labels. The whole dataset is reported as cluster
+        'All' in any case.
+    - n_components: int
+        Components of the GMM deconvolution (0 or None to skip it).
+    - min_size: int
+        Groups with fewer valid values are not fitted and get NaN statistics.
+        Non-positive values are left out of the Weibull fit (with a warning).
+    - n_jobs: int, optional
+        Number of worker processes (default is the number of CPUs, 1 runs
+        everything in this process).
+
+    Returns:
+    - DataFrame
+        Tidy table with one row per (Property, Cluster, Statistic), the same
+        statistics for every group, and the columns N (finite values),
+        N_used (values used by the fit, 0 if skipped), Estimate, CI_low,
+        CI_high and Std.
+    """
+    groups = [('All', data)]
+    if cluster_column is not None:
+        groups += [(cluster, group) for cluster, group in data.groupby(cluster_column)]
+    tasks = []
+    for column in columns:
+        for cluster, group in groups:
+            values = group[column].to_numpy(dtype=np.float64)
+            tasks.append((column, cluster, values[np.isfinite(values)],
+                          n_components, n_resamples, confidence, min_size, random_state))
+    for column in columns:
+        n_dropped = int((data[column] <= 0).sum())
+        if n_dropped:
+            warnings.warn(f"{n_dropped} non-positive values of {column} are left out of the Weibull fits",
+                          RuntimeWarning)
+
+    if n_jobs == 1:
+        results = [_run_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            results = list(executor.map(_run_task, tasks))
+    return pd.DataFrame([row for rows in results for row in rows])
@@ -0,0 +1,208 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.special import logsumexp
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.mixture import GaussianMixture
+
+def iter_chunks(file_path, columns, chunksize=100000):
+    """
+    Yield the requested columns of a large map file chunk by chunk.
+
+    CSV files (e.g. 'imported_data.csv') are read with pandas; Parquet files
+    are read batch by batch with pyarrow (optional dependency).
+    """
+    file_path = Path(file_path)
+    if file_path.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(file_path).iter_batches(batch_size=chunksize, columns=list(columns)):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(file_path, usecols=list(columns), chunksize=chunksize)
+
+def _valid_features(chunk, features):
+    # Feature matrix of the chunk and mask of the rows without NaN
+    X = chunk[features].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(X).any(axis=1)
+    return X[valid], valid
+
+def streaming_moments(file_path, features, chunksize=100000):
+    """Mean and standard deviation of the features computed in one pass over the chunks."""
+    n = 0
+    total = np.zeros(len(features))
+    total_sq = np.zeros(len(features))
+    for chunk in iter_chunks(file_path, features, chunksize):
+        X, _ = _valid_features(chunk, features)
+        n += len(X)
+        total += X.sum(axis=0)
+        total_sq += (X**2).sum(axis=0)
+    mean = total / n
+    std = np.sqrt(np.maximum(total_sq / n - mean**2, 0.0))
+    return mean, np.where(std > 0, std, 1.0)
+
+def fit_streaming_kmeans(file_path, features, n_clusters, chunksize=100000, n_epochs=20, batch_size=1024,
+                         tol=1e-4, scaling=None, random_state=42):
+    """
+    Fit a MiniBatchKMeans model out of core, one `partial_fit` per minibatch.
+
+    Every chunk is shuffled and split into minibatches of `batch_size` rows,
+    so even a file held in a single chunk gets many center updates per pass.
+    The first minibatches (3 * `batch_size` rows, as `MiniBatchKMeans.fit`)
+    initialize the centers.
+
+    Parameters:
+    - scaling: tuple (mean, std), optional
+        Feature scaling applied to every chunk (see `streaming_moments`).
+    - n_epochs: int, optional
+        Maximum number of passes over the file (default is 20).
+    - tol: float, optional
+        Stop when no center moves more than `tol` (scaled units) over a pass.
+    """
+    model = MiniBatchKMeans(n_clusters=n_clusters, random_state=random_state, n_init=3, batch_size=batch_size)
+    rng = np.random.default_rng(random_state)
+    for _ in range(n_epochs):
+        previous = model.cluster_centers_.copy() if hasattr(model, 'cluster_centers_') else None
+        for chunk in iter_chunks(file_path, features, chunksize):
+            X, _ = _valid_features(chunk, features)
+            if len(X) == 0:
+                continue
+            if scaling is not None:
+                X = (X - scaling[0]) / scaling[1]
+            X = X[rng.permutation(len(X))]
+            start = 0
+            if not hasattr(model, 'cluster_centers_'):
+                # MiniBatchKMeans needs at least n_clusters points to initialize
+                if len(X) < n_clusters:
+                    continue
+                start = 3 * batch_size
+                model.partial_fit(X[:start])
+            for batch in range(start, len(X), batch_size):
+                model.partial_fit(X[batch:batch + batch_size])
+        if previous is not None and np.max(np.abs(model.cluster_centers_ - previous)) < tol:
+            break
+    return model
+
+def _precisions_cholesky(covariances):
+    # Inverse Cholesky factors of the covariances (sklearn convention)
+    d = covariances.shape[1]
+    return np.array([np.linalg.solve(np.linalg.cholesky(cov), np.eye(d)).T for cov in covariances])
+
+def _log_resp(X, weights, means, prec_chol):
+    # Log-responsibilities and per-sample log-likelihood of a full-covariance GMM
+    d = X.shape[1]
+    log_prob = np.empty((len(X), len(weights)))
+    for k, (mu, pc) in enumerate(zip(means, prec_chol)):
+        y = (X - mu) @ pc
+        log_prob[:, k] = -0.5 * (d * np.log(2 * np.pi) + np.sum(y**2, axis=1)) + np.sum(np.log(np.diag(pc)))
+    weighted = log_prob + np.log(weights)
+    log_norm = logsumexp(weighted, axis=1)
+    return weighted - log_norm[:, None], log_norm
+
+def fit_streaming_gmm(file_path, features, n_components, chunksize=100000, max_iter=100, tol=1e-3,
+                      reg_covar=1e-6, scaling=None, random_state=42):
+    """
+    Fit a full-covariance GaussianMixture out of core.
+
+    Each EM iteration is one pass over the chunks accumulating the sufficient
+    statistics (counts, sums and outer products per component), so only one
+    chunk is ever held in memory. The model is initialized from a streaming
+    MiniBatchKMeans and returned as a fitted sklearn GaussianMixture.
+    """
+    kmeans = fit_streaming_kmeans(file_path, features, n_components, chunksize, n_epochs=1,
+                                  scaling=scaling, random_state=random_state)
+    d = len(features)
+    means = kmeans.cluster_centers_
+    covariances = np.array([np.eye(d)] * n_components)
+    weights = np.full(n_components, 1.0 / n_components)
+
+    previous = -np.inf
+    converged = False
+    for n_iter in range(1, max_iter + 1):
+        prec_chol = _precisions_cholesky(covariances)
+        counts = np.zeros(n_components)
+        sums = np.zeros((n_components, d))
+        outer = np.zeros((n_components, d, d))
+        log_likelihood = 0.0
+        n = 0
+        for chunk in iter_chunks(file_path, features, chunksize):
+            X, _ = _valid_features(chunk, features)
+            if scaling is not None:
+                X = (X - scaling[0]) / scaling[1]
+            log_resp, log_norm = _log_resp(X, weights, means, prec_chol)
+            resp = np.exp(log_resp)
+            counts += resp.sum(axis=0)
+            sums += resp.T @ X
+            for k in range(n_components):
+                outer[k] += (X * resp[:, k:k + 1]).T @ X
+            log_likelihood += log_norm.sum()
+            n += len(X)
+
+        # M-step from the accumulated statistics
+        counts += 10 * np.finfo(float).eps
+        weights = counts / n
+        means = sums / counts[:, None]
+        covariances = outer / counts[:, None, None] - np.einsum('ki,kj->kij', means, means)
+        covariances += reg_covar * np.eye(d)
+
+        log_likelihood /= n
+        if abs(log_likelihood - previous) < tol:
+            converged = True
+            break
+        previous = log_likelihood
+
+    model = GaussianMixture(n_components=n_components, covariance_type='full', reg_covar=reg_covar,
+                            random_state=random_state)
+    model.weights_ = weights
+    model.means_ = means
+    model.covariances_ = covariances
+    model.precisions_cholesky_ = _precisions_cholesky(covariances)
+    model.precisions_ = np.array([pc @ pc.T for pc in model.precisions_cholesky_])
+    model.converged_ = converged
+    model.n_iter_ = n_iter
+    model.lower_bound_ = log_likelihood
+    return model
+
+def label_streaming(file_path, model, features, output_path, x_column='X Position_µm',
+                    y_column='Y Position_µm', chunksize=100000, scaling=None, label='Cluster'):
+    """
+    Label the map chunk by chunk and write X/Y positions with the labels.
+
+    Indents with missing features get the label -1. The output CSV is
+    written incrementally, so it can be larger than the available memory.
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    header = True
+    for chunk in iter_chunks(file_path, [x_column, y_column] + list(features), chunksize):
+        X, valid = _valid_features(chunk, features)
+        if scaling is not None:
+            X = (X - scaling[0]) / scaling[1]
+        labels = np.full(len(chunk), -1, dtype=np.int64)
+        if len(X):
+            labels[valid] = model.predict(X)
+        out = pd.DataFrame({x_column: chunk[x_column].to_numpy(), y_column: chunk[y_column].to_numpy(), label: labels})
+        out.to_csv(output_path, mode='w' if header else 'a', header=header, index=False)
+        header = False
+    print(f"Labels saved to {output_path}")
+    return output_path
+
+def cluster_out_of_core(file_path, output_path, features, n_clusters, method='KMeans', chunksize=100000,
+                        standardize=True, x_column='X Position_µm', y_column='Y Position_µm', random_state=42):
+    """
+    Streaming clustering mode: fit on chunks, then label chunk by chunk.
+
+    Peak memory is bounded by `chunksize` whatever the size of the map.
+    Returns the fitted model and the scaling applied to the features.
+    """
+    scaling = streaming_moments(file_path, features, chunksize) if standardize else None
+    if method == 'KMeans':
+        model = fit_streaming_kmeans(file_path, features, n_clusters, chunksize,
+                                     scaling=scaling, random_state=random_state)
+    elif method == 'GMM':
+        model = fit_streaming_gmm(file_path, features, n_clusters, chunksize,
+                                  scaling=scaling, random_state=random_state)
+    else:
+        raise ValueError("Unsupported clustering method")
+    label_streaming(file_path, model, features, output_path, x_column, y_column, chunksize, scaling)
+    return model, scaling
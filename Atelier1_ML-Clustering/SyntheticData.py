@@ -0,0 +1,311 @@
+"""
+Synthetic nanoindentation maps of any size, with their ground truth.
+
+Builds matrix/fibre or multi-phase (Voronoi grains) microstructures on a
+regular grid of indents, draws the hardness and modulus of every indent from
+the distribution of its phase, and streams the map chunk by chunk to CSV or
+Parquet (same columns as 'imported_data.csv'), or to an Excel export for
+small maps (same layout as the files of Dataset/MatrixFibers). The realized
+statistics of every phase are written to '<name>_stats.json', in the format
+of the shipped datasets.
+
+Example:
+    python SyntheticData.py Dataset/Large/fibers_E_1.5.csv --shape 3163 3163 --size 1000 1000 --ratio-E 1.5
+"""
+import argparse
+import json
+import sys
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+
+COLUMNS = ['X Position_µm', 'Y Position_µm', 'MODULUS_GPa', 'HARDNESS_GPa']
+
+# Rows of an .xlsx sheet, minus the header and units rows
+MAX_EXCEL_INDENTS = 2**20 - 2
+
+# Property distribution of a phase (GPa)
+Phase = namedtuple('Phase', ['name', 'hardness', 'hardness_std', 'modulus', 'modulus_std'])
+
+# Matrix of the shipped MatrixFibers datasets
+MATRIX = Phase('Matrix', 1.5, 0.5, 15.0, 5.0)
+
+# Second-phase regions: nearest centre within `radius` (np.inf for Voronoi grains),
+# indents farther than `radius` from every centre belong to phase 0
+Layout = namedtuple('Layout', ['tree', 'phases', 'radius'])
+
+def composite_phases(ratios_E, ratios_H, matrix=MATRIX, hardness_std=0.7, modulus_std=7.0, names=None):
+    """
+    Matrix and reinforcement phases defined by their E and H ratios to the matrix.
+
+    With the defaults and a single ratio, the phases are those of the shipped
+    MatrixFibers datasets (e.g. ratios_E=[1.5], ratios_H=[3]).
+    """
+    ratios_E, ratios_H = np.atleast_1d(ratios_E), np.atleast_1d(ratios_H)
+    if len(ratios_E) != len(ratios_H):
+        raise ValueError("ratios_E and ratios_H must have the same length")
+    if names is None:
+        names = ['Fiber'] if len(ratios_E) == 1 else [f"Phase {i + 1}" for i in range(len(ratios_E))]
+    return [matrix] + [Phase(name, float(matrix.hardness * ratio_H), hardness_std,
+                             float(matrix.modulus * ratio_E), modulus_std)
+                       for name, ratio_E, ratio_H in zip(names, ratios_E, ratios_H)]
+
+def fiber_layout(size, radius, fraction, arrangement='hexagonal', random_state=0):
+    """
+    Circular fibre sections (phase 1) in a matrix (phase 0).
+
+    Parameters:
+    - size: (width, height) of the map in µm
+    - radius: float
+        Fibre radius in µm.
+    - fraction: float
+        Fibre area fraction. 'hexagonal' packing is limited to 0.9069
+        (touching fibres); 'random' centres may overlap (Boolean model).
+    """
+    width, height = size
+    if arrangement == 'hexagonal':
+        if not 0 < fraction <= np.pi / (2 * np.sqrt(3)):
+            raise ValueError("Hexagonal fibre fraction must be in ]0, 0.9069]")
+        spacing = radius * np.sqrt(2 * np.pi / (np.sqrt(3) * fraction))
+        rows = np.arange(-1, int(height / (spacing * np.sqrt(3) / 2)) + 2)
+        cols = np.arange(-1, int(width / spacing) + 2)
+        r, c = np.meshgrid(rows, cols, indexing='ij')
+        centers = np.column_stack(((c + 0.5 * (r % 2)).ravel() * spacing, r.ravel() * spacing * np.sqrt(3) / 2))
+    elif arrangement == 'random':
+        if not 0 < fraction < 1:
+            raise ValueError("Random fibre fraction must be in ]0, 1[")
+        rng = np.random.default_rng(random_state)
+        # Poisson density giving the requested covered fraction, on the map padded by one radius
+        area = (width + 2 * radius) * (height + 2 * radius)
+        n_fibers = rng.poisson(-np.log(1 - fraction) * area / (np.pi * radius**2))
+        centers = rng.uniform((-radius, -radius), (width + radius, height + radius), size=(n_fibers, 2))
+    else:
+        raise ValueError("arrangement must be 'hexagonal' or 'random'")
+    return Layout(cKDTree(centers), np.ones(len(centers), dtype=np.int64), float(radius))
+
+def grain_layout(size, n_grains, fractions, random_state=0):
+    """
+    Voronoi grains, each of a phase drawn with the given fractions.
+
+    The area fractions match `fractions` on average (exactly in the limit of
+    many grains).
+    """
+    fractions = np.asarray(fractions, dtype=np.float64)
+    rng = np.random.default_rng(random_state)
+    seeds = rng.uniform((0, 0), size, size=(n_grains, 2))
+    phases = rng.choice(len(fractions), size=n_grains, p=fractions / fractions.sum())
+    return Layout(cKDTree(seeds), phases, np.inf)
+
+def assign_phases(layout, x, y):
+    """Phase index of every indent."""
+    distance, nearest = layout.tree.query(np.column_stack((x, y)), distance_upper_bound=layout.radius)
+    inside = np.isfinite(distance)
+    labels = np.zeros(len(x), dtype=np.int64)
+    labels[inside] = layout.phases[nearest[inside]]
+    return labels
+
+def _sample(phases, labels, rng, distribution):
+    # Hardness and modulus of every indent from the distribution of its phase
+    table = np.array([phase[1:] for phase in phases], dtype=np.float64)
+    mean_H, std_H, mean_E, std_E = table[labels].T
+    values = []
+    for mean, std in ((mean_E, std_E), (mean_H, std_H)):
+        if distribution == 'normal':
+            values.append(rng.normal(mean, std))
+        elif distribution == 'lognormal':
+            # Same mean and standard deviation, strictly positive
+            sigma2 = np.log1p((std / mean)**2)
+            values.append(rng.lognormal(np.log(mean) - sigma2 / 2, np.sqrt(sigma2)))
+        else:
+            raise ValueError("distribution must be 'normal' or 'lognormal'")
+    return values
+
+def iter_synthetic_map(layout, phases, shape, size, chunk_rows=256, distribution='normal', noise=0.0,
+                       nan_fraction=0.0, random_state=0):
+    """
+    Generate the map chunk by chunk (`chunk_rows` rows of the grid at a time).
+
+    X varies fastest, as in the exports of the indenter. The result depends
+    on `random_state` and `chunk_rows`.
+
+    Parameters:
+    - shape: (rows, cols) of the grid of indents
+    - size: (width, height) of the map in µm
+    - distribution: 'normal' or 'lognormal'
+        Distribution of the properties of a phase. Values are clipped at 0
+        (the realized moments of '_stats.json' include the clipping).
+    - noise: float
+        Relative standard deviation of the measurement noise added to every
+        value.
+    - nan_fraction: float
+        Fraction of failed indents (hardness and modulus set to NaN).
+
+    Yields:
+    - chunk: DataFrame with the columns of COLUMNS
+    - labels: ndarray of int
+        Phase of every indent of the chunk.
+    """
+    n_rows, n_cols = shape
+    width, height = size
+    x_grid = np.linspace(0, width, n_cols)
+    y_grid = np.linspace(0, height, n_rows)
+    seeds = np.random.SeedSequence(random_state).spawn(-(-n_rows // chunk_rows))
+    for seed, start in zip(seeds, range(0, n_rows, chunk_rows)):
+        rng = np.random.default_rng(seed)
+        y, x = np.meshgrid(y_grid[start:start + chunk_rows], x_grid, indexing='ij')
+        x, y = x.ravel(), y.ravel()
+        labels = assign_phases(layout, x, y)
+        modulus, hardness = _sample(phases, labels, rng, distribution)
+        if noise:
+            modulus *= 1 + noise * rng.standard_normal(len(x))
+            hardness *= 1 + noise * rng.standard_normal(len(x))
+        # Properties are never negative: clip at 0, as in the shipped datasets
+        np.maximum(modulus, 0, out=modulus)
+        np.maximum(hardness, 0, out=hardness)
+        if nan_fraction:
+            failed = rng.random(len(x)) < nan_fraction
+            modulus[failed] = np.nan
+            hardness[failed] = np.nan
+        yield pd.DataFrame(dict(zip(COLUMNS, (x, y, modulus, hardness)))), labels
+
+def _stats(phases, moments, n_indents, n_missing):
+    # Ground truth in the format of the shipped '_stats.json' files, with the realized moments
+    stats = {}
+    for key, column in (("Mechanical Property 1 (Hardness)", 'HARDNESS_GPa'),
+                        ("Mechanical Property 2 (Elastic Modulus)", 'MODULUS_GPa')):
+        stats[key] = {}
+        for phase, (count, total, total_sq) in zip(phases, moments[column]):
+            mean = total / count if count else float('nan')
+            std = np.sqrt(max(total_sq / count - mean**2, 0.0) * count / (count - 1)) if count > 1 else float('nan')
+            stats[key][phase.name] = {"Mean": float(mean), "Standard Deviation": float(std)}
+    matrix = phases[0]
+    for phase in phases[1:]:
+        stats[f"Ratio of E_{phase.name} to E_{matrix.name}"] = phase.modulus / matrix.modulus
+        stats[f"Ratio of H_{phase.name} to H_{matrix.name}"] = phase.hardness / matrix.hardness
+    counts = moments['counts']
+    stats["Phase Fractions"] = {phase.name: int(count) / n_indents for phase, count in zip(phases, counts)}
+    stats["Number of Indents"] = n_indents
+    stats["Missing Values"] = n_missing
+    return stats
+
+def to_excel_export(data, output_path, sheet_name='Sheet1'):
+    """Write a map in the export layout of the indenter: Index column and a units row under the headers."""
+    names, units = zip(*(column.rsplit('_', 1) for column in data.columns))
+    sheet = pd.DataFrame([['Integer', *units]], columns=['Index', *names])
+    values = data.set_axis(names, axis=1)
+    values.insert(0, 'Index', np.arange(1, len(data) + 1))
+    pd.concat([sheet, values], ignore_index=True).to_excel(output_path, sheet_name=sheet_name, index=False)
+
+def write_synthetic_map(output_path, layout, phases, shape, size, chunk_rows=256, include_phase=False, **kwargs):
+    """
+    Stream a synthetic map to disk and write its ground truth.
+
+    The format follows the extension of `output_path`: '.csv', '.parquet'
+    (requires pyarrow) or '.xlsx' (at most MAX_EXCEL_INDENTS indents, read
+    with `Loader.load_ni_data(..., sheet_name='Sheet1')`). Only one chunk is
+    held in memory for CSV and Parquet, so maps of 10^7 indents and more can
+    be generated. Other keyword arguments are those of `iter_synthetic_map`.
+
+    Parameters:
+    - include_phase: bool
+        Also write the phase of every indent (column 'PHASE'), e.g. to score
+        a clustering.
+
+    Returns:
+    - dict
+        Ground truth, also saved to '<output stem>_stats.json'.
+    """
+    output_path = Path(output_path)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    suffix = output_path.suffix
+    if suffix not in ('.csv', '.parquet', '.xlsx'):
+        raise ValueError("Output format must be .csv, .parquet or .xlsx")
+    if suffix == '.xlsx' and shape[0] * shape[1] > MAX_EXCEL_INDENTS:
+        raise ValueError(f"Excel exports are limited to {MAX_EXCEL_INDENTS} indents, use .csv or .parquet")
+
+    moments = {column: np.zeros((len(phases), 3)) for column in ('HARDNESS_GPa', 'MODULUS_GPa')}
+    moments['counts'] = np.zeros(len(phases), dtype=np.int64)
+    n_indents = n_missing = 0
+    chunks, writer = [], None
+    try:
+        for i, (chunk, labels) in enumerate(iter_synthetic_map(layout, phases, shape, size, chunk_rows, **kwargs)):
+            n_indents += len(chunk)
+            n_missing += int(chunk['HARDNESS_GPa'].isna().sum())
+            moments['counts'] += np.bincount(labels, minlength=len(phases))
+            for column in ('HARDNESS_GPa', 'MODULUS_GPa'):
+                values = chunk[column].to_numpy()
+                valid = ~np.isnan(values)
+                for stat, weights in enumerate((None, values, values**2)):
+                    moments[column][:, stat] += np.bincount(labels[valid], None if weights is None else weights[valid],
+                                                            minlength=len(phases))
+            if include_phase:
+                chunk['PHASE'] = labels
+            if suffix == '.csv':
+                chunk.to_csv(output_path, mode='a' if i else 'w', header=not i, index=False)
+            elif suffix == '.parquet':
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+                table = pa.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                writer.write_table(table)
+            else:
+                chunks.append(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if suffix == '.xlsx':
+        data = pd.concat(chunks, ignore_index=True)
+        if include_phase:
+            data = data.rename(columns={'PHASE': 'PHASE_Integer'})
+        to_excel_export(data, output_path)
+
+    stats = _stats(phases, moments, n_indents, n_missing)
+    with open(output_path.with_name(f"{output_path.stem}_stats.json"), 'w') as file:
+        json.dump(stats, file, indent=4)
+    print(f"{n_indents} indents saved to {output_path}")
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic nanoindentation map and its ground truth.")
+    parser.add_argument('output', help="Output file (.csv, .parquet or .xlsx)")
+    parser.add_argument('--shape', nargs=2, type=int, default=[100, 100], metavar=('ROWS', 'COLS'))
+    parser.add_argument('--size', nargs=2, type=float, default=[100.0, 100.0], metavar=('WIDTH', 'HEIGHT'),
+                        help="Map size in µm")
+    parser.add_argument('--microstructure', choices=['fibers', 'grains'], default='fibers')
+    parser.add_argument('--ratio-E', nargs='+', type=float, default=[1.5], help="E ratio of each phase to the matrix")
+    parser.add_argument('--ratio-H', nargs='+', type=float, default=None,
+                        help="H ratio of each phase to the matrix (default: 3 for every phase)")
+    parser.add_argument('--fraction', nargs='+', type=float, default=[0.5],
+                        help="Fibre area fraction, or area fraction of each phase for grains (matrix first)")
+    parser.add_argument('--radius', type=float, default=5.0, help="Fibre radius in µm")
+    parser.add_argument('--arrangement', choices=['hexagonal', 'random'], default='hexagonal')
+    parser.add_argument('--grains', type=int, default=200, help="Number of Voronoi grains")
+    parser.add_argument('--distribution', choices=['normal', 'lognormal'], default='normal')
+    parser.add_argument('--noise', type=float, default=0.0, help="Relative measurement noise")
+    parser.add_argument('--nan-fraction', type=float, default=0.0, help="Fraction of failed indents")
+    parser.add_argument('--chunk-rows', type=int, default=256)
+    parser.add_argument('--include-phase', action='store_true', help="Write the phase of every indent")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    ratio_H = args.ratio_H or [3.0] * len(args.ratio_E)
+    phases = composite_phases(args.ratio_E, ratio_H)
+    if args.microstructure == 'fibers':
+        if len(phases) != 2:
+            parser.error("fibers need a single --ratio-E/--ratio-H")
+        layout = fiber_layout(args.size, args.radius, args.fraction[0], args.arrangement, args.seed)
+    else:
+        if len(args.fraction) != len(phases):
+            parser.error(f"grains need {len(phases)} --fraction values (matrix first)")
+        layout = grain_layout(args.size, args.grains, args.fraction, args.seed)
+    write_synthetic_map(args.output, layout, phases, args.shape, args.size, args.chunk_rows, args.include_phase,
+                        distribution=args.distribution, noise=args.noise, nan_fraction=args.nan_fraction,
+                        random_state=args.seed)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -102,6 +102,19 @@ MaterialIndenter = "Diamond (carbon)"
 #+++++++++++++++++++++++++++++++++++++++++++++
 outputPath = r"C:\SX_indentationModellig\{}_SX_indentation\SXgeom_Rtip_{}_tipFactor{}.dsco".format(MaterialSX, tipRadiusVal, tipFactor)
 
+#+++++++++++++++++++++++++++++++++++++++++++++
+# MANIFEST REPLAY (OPTIONAL)
+#+++++++++++++++++++++++++++++++++++++++++++++
+# Build one case of a manifest computed and validated offline with indentationGeometry_def.py
+# Its flags, dimensions and output path replace all the values defined above
+manifestPath = None # e.g. r"C:\SX_indentationModellig\geometry_manifest.json"
+manifestIndex = 0 # Index of the case to build
+if manifestPath:
+    import json
+    with open(manifestPath) as manifestFile:
+        manifest = json.load(manifestFile)
+    globals().update(zip(manifest['columns'], manifest['rows'][manifestIndex]))
+
 #+++++++++++++++++++++++++++++++++++++++++++++
 # SAMPLE GEOMETRY
 #+++++++++++++++++++++++++++++++++++++++++++++
@@ -0,0 +1,242 @@
+## Solver-free geometry of the SX indentation model (plain CPython, also runs in Discovery's IronPython 2.7)
+"""
+Pure-geometry part of 3D_SX_indentation_allBodies_Discovery_Geometry.py.
+
+Computes and validates every sketch coordinate of the specimen and of the
+indenter for a grid of parameter sets, and writes them to one manifest that
+the Discovery script replays (see 'MANIFEST REPLAY' in that script).
+
+Example:
+    python indentationGeometry_def.py --tip-radius 1.0 7.4 27 --cone-angle 90 120 --tip-factor 5 10 -o manifest.json
+"""
+from __future__ import division, print_function
+
+import argparse
+import itertools
+import json
+import math
+
+# Single crystal materials: cubic or hexagonal unit cell
+SX_MATERIALS = {'Cu': True, 'TiAlloy': False}
+
+# Default parameters of the Discovery script
+DEFAULTS = {
+    'MaterialSX': 'TiAlloy',
+    'tipRadiusVal': 1.0,  # Radius of the indenter tip in microns
+    'coneAngle': 120,  # Cone angle of the indenter tip in degrees
+    'tipFactor': 5,  # Factor to scale the sample dimensions with respect to the indenter tip radius
+    'box_zfrac': 0.5,
+    'box_xfrac': 0.8,  # Usually 2x r_center_frac
+    'r_center_frac': 0.4,
+    'scaleFactor': 1e3,
+    'DiscoFlag': False,  # Discovery simulation (True) or Mechanical simulation (False)
+    'outputDir': r"C:\SX_indentationModellig",
+}
+
+# Parameters that are added to the output file name when they differ from the defaults
+_NAME_SUFFIXES = [('coneAngle', 'cone'), ('box_zfrac', 'zfrac'), ('box_xfrac', 'xfrac'), ('r_center_frac', 'rfrac')]
+
+def output_path(params):
+    """Path of the .dsco file, as built by the Discovery script."""
+    path = r"{}\{}_SX_indentation\SXgeom_Rtip_{}_tipFactor{}".format(
+        params['outputDir'], params['MaterialSX'], params['tipRadiusVal'], params['tipFactor'])
+    for key, label in _NAME_SUFFIXES:
+        if params[key] != DEFAULTS[key]:
+            path += "_{}{}".format(label, params[key])
+    return path + ".dsco"
+
+def compute_geometry(**params):
+    """
+    Computes all the values used by the sketches of the Discovery script.
+
+    Keyword arguments are those of DEFAULTS. Returns a dict keyed by the
+    variable names of the Discovery script (simulation flags, dimensions,
+    indenter profile, sample partitions and output path).
+    """
+    unknown = set(params) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown parameters: {}".format(", ".join(sorted(unknown))))
+    p = dict(DEFAULTS)
+    p.update(params)
+    if p['MaterialSX'] not in SX_MATERIALS:
+        raise ValueError("MaterialSX must be one of {}".format(sorted(SX_MATERIALS)))
+
+    # Indenter tip
+    tipRadius = p['tipRadiusVal'] / p['scaleFactor']
+    half_angle = math.radians(p['coneAngle'] / 2)
+    h_trans = tipRadius * (1 - math.sin(half_angle))
+    arcXVal = math.sqrt(tipRadius**2 - (tipRadius - h_trans)**2)
+    segXVal = arcXVal + math.tan(half_angle) * (tipRadius - h_trans)
+
+    # Sample
+    h_sample = p['tipFactor'] * tipRadius
+    D_sample = p['tipFactor'] * tipRadius
+    r_sample = D_sample / 2
+    z_ini = 0
+    geometry = {
+        'MaterialSX': p['MaterialSX'],
+        'cubicCell': SX_MATERIALS[p['MaterialSX']],
+        'tipRadiusVal': p['tipRadiusVal'],
+        'coneAngle': p['coneAngle'],
+        'tipFactor': p['tipFactor'],
+        'scaleFactor': p['scaleFactor'],
+        'box_zfrac': p['box_zfrac'],
+        'box_xfrac': p['box_xfrac'],
+        'r_center_frac': p['r_center_frac'],
+        'mergeFlag': p['DiscoFlag'],
+        'shareTopoFlag': not p['DiscoFlag'],
+        'unitCellFlag': p['DiscoFlag'],
+        'DiscoFlag': p['DiscoFlag'],
+        'tipRadius': tipRadius,
+        'h_trans': h_trans,
+        'arcXVal': arcXVal,
+        'segXVal': segXVal,
+        'h_sample': h_sample,
+        'D_sample': D_sample,
+        'r_sample': r_sample,
+        'a': p['r_center_frac'] * r_sample,
+        'z_ini': z_ini,
+        'z_mid': z_ini - h_sample * p['box_zfrac'],
+        'z_fin': z_ini - h_sample,
+        'x_mid': p['box_xfrac'] * r_sample,
+        'maxZdisp': -1e-01 if p['DiscoFlag'] else -1e-06,  # Maximum displacement along the z axis in meters
+        'unitCellDim': 0.05 * r_sample,
+        'outputPath': output_path(p),
+    }
+    return geometry
+
+def sketch_points(geometry):
+    """
+    Points (z, x) of every sketch of the Discovery script, in sketch order.
+
+    Returns:
+    - list of (str, list of tuple)
+        Name of the sketch and its points.
+    """
+    g = geometry
+    z_ini, z_mid, z_fin = g['z_ini'], g['z_mid'], g['z_fin']
+    a, x_mid, r_sample = g['a'], g['x_mid'], g['r_sample']
+    return [
+        ('center top rectangle', [(0, z_ini), (z_mid, 0), (z_mid, a)]),
+        ('center bottom rectangle', [(z_mid, 0), (z_fin, 0), (z_fin, a)]),
+        ('ring rectangle', [(z_ini, a), (z_mid, a), (z_mid, x_mid)]),
+        ('outer profile', [(z_ini, x_mid), (z_ini, r_sample), (z_fin, r_sample), (z_fin, a),
+                           (z_mid, a), (z_mid, x_mid), (z_ini, x_mid)]),
+        ('indenter cone', [(g['h_trans'], g['arcXVal']), (g['tipRadius'], g['segXVal'])]),
+        ('indenter arc', [(g['tipRadius'], z_ini), (z_ini, 0), (g['h_trans'], g['arcXVal'])]),
+    ]
+
+def validate_geometry(geometry):
+    """
+    Checks that the sketches of the Discovery script can be built.
+
+    Returns:
+    - list of str
+        Problems found (empty if the geometry is valid).
+    """
+    g = geometry
+    problems = []
+    if not 0 < g['coneAngle'] < 180:
+        problems.append("coneAngle must be in ]0, 180[")
+    if g['tipRadius'] <= 0 or g['tipFactor'] <= 0:
+        problems.append("tipRadiusVal and tipFactor must be positive")
+    if not 0 < g['box_zfrac'] < 1:
+        problems.append("box_zfrac must be in ]0, 1[ (z_fin < z_mid < z_ini)")
+    if not 0 < g['a'] < g['x_mid'] < g['r_sample']:
+        problems.append("partitions must satisfy 0 < a < x_mid < r_sample "
+                        "(0 < r_center_frac < box_xfrac < 1)")
+    if not 0 <= g['h_trans'] < g['tipRadius']:
+        problems.append("h_trans must be in [0, tipRadius[")
+    if g['segXVal'] >= g['r_sample']:
+        problems.append("indenter profile (segXVal) exceeds the sample radius, increase tipFactor")
+    for name, points in sketch_points(g):
+        if any(math.isinf(value) or math.isnan(value) for point in points for value in point):
+            problems.append("non-finite coordinate in sketch '{}'".format(name))
+    return problems
+
+def geometry_sweep(grid, **fixed):
+    """
+    Computes and validates the geometry of every combination of a parameter grid.
+
+    Parameters:
+    - grid: dict
+        Parameter name (of DEFAULTS) -> list of values.
+    - fixed: keyword arguments
+        Parameters common to all cases.
+
+    Returns:
+    - valid: list of dict
+        Geometries that passed `validate_geometry`.
+    - rejected: list of (dict, list of str)
+        Parameters and problems of the other combinations.
+    """
+    names = sorted(grid)
+    valid, rejected = [], []
+    for values in itertools.product(*(grid[name] for name in names)):
+        params = dict(fixed)
+        params.update(zip(names, values))
+        try:
+            geometry = compute_geometry(**params)
+        except ValueError as error:  # e.g. math domain error for an invalid cone angle
+            rejected.append((params, [str(error)]))
+            continue
+        problems = validate_geometry(geometry)
+        if problems:
+            rejected.append((params, problems))
+        else:
+            valid.append(geometry)
+    return valid, rejected
+
+def write_manifest(geometries, file_path):
+    """
+    Writes the geometries as one compact JSON manifest: the variable names once
+    ('columns') and one row of values per case ('rows').
+
+    Raises ValueError if two cases would be saved to the same output path.
+    """
+    paths = [geometry['outputPath'] for geometry in geometries]
+    duplicates = sorted(set(path for path in paths if paths.count(path) > 1))
+    if duplicates:
+        raise ValueError("Several cases share the output path(s): {}".format(", ".join(duplicates)))
+    columns = sorted(geometries[0]) if geometries else []
+    with open(file_path, 'w') as file:
+        json.dump({'columns': columns, 'rows': [[geometry[column] for column in columns] for geometry in geometries]},
+                  file, separators=(',', ':'))
+
+def read_manifest_case(file_path, index):
+    """Returns case `index` of a manifest as a dict of Discovery script variables."""
+    with open(file_path) as file:
+        manifest = json.load(file)
+    return dict(zip(manifest['columns'], manifest['rows'][index]))
+
+def _number(text):
+    # Keep '27' as int and '1.0' as float, so that output file names match the Discovery script
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compute and validate SX indentation geometries into a manifest.")
+    parser.add_argument('--material', nargs='+', default=[DEFAULTS['MaterialSX']], choices=sorted(SX_MATERIALS))
+    parser.add_argument('--tip-radius', nargs='+', type=_number, default=[DEFAULTS['tipRadiusVal']])
+    parser.add_argument('--cone-angle', nargs='+', type=_number, default=[DEFAULTS['coneAngle']])
+    parser.add_argument('--tip-factor', nargs='+', type=_number, default=[DEFAULTS['tipFactor']])
+    parser.add_argument('--box-zfrac', nargs='+', type=_number, default=[DEFAULTS['box_zfrac']])
+    parser.add_argument('--box-xfrac', nargs='+', type=_number, default=[DEFAULTS['box_xfrac']])
+    parser.add_argument('--disco', action='store_true', help="Discovery simulation instead of Mechanical")
+    parser.add_argument('-o', '--output', default='geometry_manifest.json')
+    args = parser.parse_args(argv)
+
+    grid = {'MaterialSX': args.material, 'tipRadiusVal': args.tip_radius, 'coneAngle': args.cone_angle,
+            'tipFactor': args.tip_factor, 'box_zfrac': args.box_zfrac, 'box_xfrac': args.box_xfrac}
+    valid, rejected = geometry_sweep(grid, DiscoFlag=args.disco)
+    for params, problems in rejected:
+        print("Rejected {}: {}".format(params, "; ".join(problems)))
+    write_manifest(valid, args.output)
+    print("{} valid case(s) written to '{}', {} rejected".format(len(valid), args.output, len(rejected)))
+    return 1 if not valid else 0
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,267 @@
+## Generation of Ansys crystal-plasticity (TB,XTAL) command snippets, single or in parametric sweeps
+import hashlib
+import itertools
+import json
+import re
+from pathlib import Path
+from string import Template
+
+import numpy as np
+from scipy.stats import qmc
+
+HEADER = """! Command snippet created by ANSYS Workbench
+
+!   Commands inserted into this file will be executed just prior to the ANSYS SOLVE command.
+!   These commands may supersede command settings set by Workbench.
+
+!   Active UNIT system in Workbench when this object was created:  Metric (um, kg, uN, s, V, mA)
+!   NOTE:  Any data that requires units (such as mass) is assumed to be in the consistent solver unit system.
+!                See Solving Units in the help system for more information.
+/prep7
+! Begin writing variables"""
+
+_MATERIAL = """
+! Begin writing grain materials
+*SET,matid,1
+TB,ELAS,matid,,9,
+TBDATA,1,${E_},${E_},${E_}, ${G_},${G_},${G_}, ${v_},
+TBDATA,7,${v_}, ${v_}, ${v_},
+TB,CTE,matid,
+TBDATA,1,${CTE},${CTE},${CTE}
+TB,PLAS,matid
+TB,XTAL,matid,,3,ORIE
+TBDATA,1,${EUL1},${EUL2},${EUL3}
+"""
+
+_SELECTION = """
+CMSEL,S,${NamedSelection}
+EMODIF,ALL,MAT,matid
+ALLSEL,ALL
+
+allsel,all
+TREF, ${Tref}
+TUNIF, ${Tref}
+/solu
+"""
+
+# Templates compiled once, per elastic type
+TEMPLATES = {
+    'CUBIC': Template(_MATERIAL + """
+TB,XTAL,matid,,1,NSLFAM
+TBDATA,1,${nSlipFamilies}
+TB,XTAL,matid,,1,FORM
+TBDATA,1,2
+TB,XTAL,matid,,6,XPARAM
+TBDATA,1,1,0,3,12,0,1
+TB,XTAL,matid,1,6,HARD
+TBTEMP, ${Tref},
+TBDATA,1,${ih},${hm},${sh},.0,2,0,1.4
+TB,XTAL,matid,1,6,FLFCC
+TBTEMP, ${Tref},
+TBDATA,1,1732000.0,0.131,1.1,0.7,2.5e-19,1
+""" + _SELECTION),
+    'HCP': Template(_MATERIAL + """
+TB,XTAL,matid,,1,NSLFAM
+TBDATA,1,${nSlipFamilies}
+TB,XTAL,matid,,1,FORM
+TBDATA,1,1
+TB,XTAL,matid,,10,XPARAM
+TBDATA,1,2,0,45,30,1,1,
+TBDATA,7,1,1,1,1
+TB,XTAL,matid,1,18,HARD
+TBTEMP, ${Tref},
+TBDATA,1,${ih1},${ih2},${ih3},${ih4},${ih5},
+TBDATA,7,${hm1},${hm2},${hm3},${hm4},${hm5},
+TBDATA,13,${sh1},${sh2},${sh3},${sh4},${sh5},.0,2,0,1.4
+TB,XTAL,matid,1,3,FLHCP
+TBTEMP, ${Tref},
+TBDATA,1,0.001,6.25,1.587
+""" + _SELECTION),
+}
+
+# Number of elastic constants and of slip families expected by each template
+N_ELASTIC_CONSTANTS = {'CUBIC': 3, 'HCP': 5}
+N_SLIP_FAMILIES = {'CUBIC': 1, 'HCP': 5}
+
+HARDENING_KEYS = ['InitialHardness_per_slipFamily', 'HardnessModulus_per_slipFamily',
+                  'SaturationHardness_per_slipFamily']
+
+# Materials of the workshop, with the parameters of CP_UMAT.ipynb
+TITANIUM = {
+    'material': 'Titanium',
+    'elasticType': 'HCP',
+    'ElasticConstants': [154000, 86000, 183000, 67300, 46700],  # C11, C12, C13, C33, C44 in MPa
+    'ElasticModulus': 120000,  # MPa
+    'ShearModulus': 45000,  # MPa
+    'PoissonRatio': 0.34,
+    'CTE': 1e-05,  # 1/K
+    'EUL1': 159, 'EUL2': 65, 'EUL3': 60,  # Euler angles in degrees
+    'nSlipFamilies': 5,
+    'InitialHardness_per_slipFamily': [12, 8, 80, 24, 80],  # MPa
+    'HardnessModulus_per_slipFamily': [18, 18, 180, 48, 180],  # MPa
+    'SaturationHardness_per_slipFamily': [12, 12, 12, 12, 12],  # MPa
+    'Tref': 298.0,  # K
+    'NamedSelection': 'SX',
+}
+
+COPPER = dict(TITANIUM, **{
+    'material': 'Copper',
+    'elasticType': 'CUBIC',
+    'ElasticConstants': [169000, 121000, 77100],  # C11, C12, C44 in MPa
+    'ElasticModulus': 110000,
+    'EUL1': 90, 'EUL2': 45, 'EUL3': 0,
+    'nSlipFamilies': 1,
+    'InitialHardness_per_slipFamily': [80],
+    'HardnessModulus_per_slipFamily': [180],
+    'SaturationHardness_per_slipFamily': [12],
+})
+
+def validate_parameters(params):
+    """Checks the elastic type, the number of elastic constants and of slip families values."""
+    elastic_type = params['elasticType']
+    if elastic_type not in TEMPLATES:
+        raise ValueError(f"elasticType must be one of {sorted(TEMPLATES)}, not '{elastic_type}'")
+    if len(params['ElasticConstants']) != N_ELASTIC_CONSTANTS[elastic_type]:
+        raise ValueError(f"{elastic_type} needs {N_ELASTIC_CONSTANTS[elastic_type]} elastic constants, "
+                         f"got {len(params['ElasticConstants'])}")
+    if params['nSlipFamilies'] != N_SLIP_FAMILIES[elastic_type]:
+        raise ValueError(f"{elastic_type} needs nSlipFamilies = {N_SLIP_FAMILIES[elastic_type]}")
+    for key in HARDENING_KEYS:
+        if len(params[key]) != params['nSlipFamilies']:
+            raise ValueError(f"{key} must have one value per slip family ({params['nSlipFamilies']})")
+
+def _substitutions(params):
+    # Values of the template placeholders, derived from the material parameters
+    values = {key: params[key] for key in ('CTE', 'EUL1', 'EUL2', 'EUL3', 'nSlipFamilies', 'Tref', 'NamedSelection')}
+    if params['elasticType'] == 'CUBIC':
+        C11, C12, C44 = params['ElasticConstants']
+        values.update(E_=(C11**2 + C12*C11 - 2*C12**2) / (C11 + C12), v_=C12 / (C11 + C12), G_=C44)
+        values.update(ih=params['InitialHardness_per_slipFamily'][0],
+                      hm=params['HardnessModulus_per_slipFamily'][0],
+                      sh=params['SaturationHardness_per_slipFamily'][0])
+    else:
+        values.update(E_=params['ElasticModulus'], v_=params['PoissonRatio'], G_=params['ElasticConstants'][4])
+        for prefix, key in zip(('ih', 'hm', 'sh'), HARDENING_KEYS):
+            values.update({f"{prefix}{i + 1}": value for i, value in enumerate(params[key])})
+    return values
+
+def render_umat(params, header=False):
+    """Returns the command snippet of one set of material parameters (with the Workbench header if asked)."""
+    validate_parameters(params)
+    umat = TEMPLATES[params['elasticType']].substitute(_substitutions(params))
+    return HEADER + umat if header else umat
+
+# Swept parameter names: a top-level key ('EUL1') or one slip family of a list ('InitialHardness_per_slipFamily[2]')
+_INDEXED = re.compile(r'^(\w+)\[(\d+)\]$')
+
+def set_parameter(params, name, value):
+    """Returns a copy of `params` with the (possibly indexed) parameter set to `value`."""
+    params = dict(params)
+    match = _INDEXED.match(name)
+    if match is None:
+        if name not in params:
+            raise KeyError(f"Unknown parameter '{name}'")
+        params[name] = value
+    else:
+        key, index = match.group(1), int(match.group(2))
+        values = list(params[key])
+        values[index] = value
+        params[key] = values
+    return params
+
+def _get_parameter(params, name):
+    match = _INDEXED.match(name)
+    return params[name] if match is None else params[match.group(1)][int(match.group(2))]
+
+def _clean(value, decimals):
+    # Plain Python numbers (rounded floats) so that snippets and manifest stay readable
+    if isinstance(value, (float, np.floating)):
+        value = round(float(value), decimals)
+        return int(value) if value.is_integer() else value
+    return value.item() if isinstance(value, np.generic) else value
+
+def parameter_grid(base, ranges, decimals=6):
+    """
+    Full factorial design: one variant per combination of the given values.
+
+    Parameters:
+    - base: dict
+        Material parameters (e.g. TITANIUM).
+    - ranges: dict
+        Parameter name -> list of values, e.g. {'EUL1': [0, 45, 90],
+        'InitialHardness_per_slipFamily[0]': [10, 12, 14]}.
+
+    Returns:
+    - list of dict
+        One parameter set per variant.
+    """
+    names = list(ranges)
+    variants = []
+    for combination in itertools.product(*(ranges[name] for name in names)):
+        params = base
+        for name, value in zip(names, combination):
+            params = set_parameter(params, name, _clean(value, decimals))
+        variants.append(params)
+    return variants
+
+def latin_hypercube(base, bounds, n_samples, seed=None, decimals=3):
+    """
+    Latin hypercube design within the given bounds.
+
+    Parameters:
+    - bounds: dict
+        Parameter name -> (low, high).
+    - decimals: int
+        Sampled values are rounded to this number of decimals, which also lets
+        `write_sweep` merge variants that end up identical.
+    """
+    names = list(bounds)
+    low, high = np.array([bounds[name] for name in names], dtype=float).T
+    samples = qmc.scale(qmc.LatinHypercube(d=len(names), seed=seed).random(n_samples), low, high)
+    variants = []
+    for sample in samples:
+        params = base
+        for name, value in zip(names, sample):
+            params = set_parameter(params, name, _clean(value, decimals))
+        variants.append(params)
+    return variants
+
+def write_sweep(variants, result_dir, prefix='UMAT', swept=None):
+    """
+    Writes the snippets of many variants and their manifest.
+
+    Identical snippets are written once: files are named after the hash of
+    their content, and files already on disk are not rewritten.
+
+    Parameters:
+    - variants: list of dict
+        Parameter sets, e.g. from `parameter_grid` or `latin_hypercube`.
+    - swept: list of str, optional
+        Parameter names to list in the manifest (default: all parameters).
+
+    Returns:
+    - Path
+        Path of the manifest ('<prefix>_manifest.json'), which lists for
+        every variant its snippet file and its parameters.
+    """
+    result_dir = Path(result_dir)
+    result_dir.mkdir(parents=True, exist_ok=True)
+    existing = {path.name for path in result_dir.glob(f"{prefix}_*.txt")}
+    entries = []
+    for i, params in enumerate(variants):
+        umat = render_umat(params)
+        digest = hashlib.sha1(umat.encode()).hexdigest()[:16]
+        file_name = f"{prefix}_{params['material']}_{digest}.txt"
+        if file_name not in existing:
+            with open(result_dir / file_name, "w") as file:
+                file.write(HEADER)
+                file.write(umat)
+            existing.add(file_name)
+        values = params if swept is None else {name: _get_parameter(params, name) for name in swept}
+        entries.append({'variant': i, 'file': file_name, 'parameters': values})
+
+    manifest = result_dir / f"{prefix}_manifest.json"
+    with open(manifest, "w") as file:
+        json.dump({'n_variants': len(entries), 'n_files': len({entry['file'] for entry in entries}),
+                   'variants': entries}, file, indent=1)
+    return manifest
@@ -0,0 +1,138 @@
+## Batch scoring of regridded CPFEM topographies against an AFM reference
+import matplotlib.pyplot as plt
+import numpy as np
+
+from instrumentation_def import instrument, span
+
+# Columns of the ranking table, in order
+METRICS = ['rms', 'max_abs', 'bias', 'correlation',
+           'pileup_height', 'pileup_height_error', 'pileup_volume', 'pileup_volume_error']
+
+def _pileup(fields, valid, base_level, cell_area):
+    # Height and volume of the material above the base level, per field
+    above = np.where(valid, fields - base_level, 0.0)
+    height = np.where(valid, above, -np.inf).max(axis=(-2, -1))
+    volume = np.clip(above, 0, None).sum(axis=(-2, -1)) * cell_area
+    return height, volume
+
+@instrument
+def residual_metrics(stack, reference, mask=None, cell_area=1.0, base_level=0.0):
+    """
+    Computes the residual metrics of every run of a stack in one vectorized pass.
+
+    Parameters:
+    - stack: ndarray (n_runs, ny, nx)
+        CPFEM fields regridded on the same grid as the reference.
+    - reference: ndarray (ny, nx)
+        AFM field on the common grid.
+    - mask: ndarray of bool (ny, nx), optional
+        Area to compare (e.g. the circular mask). NaN pixels are always ignored.
+    - cell_area: float
+        Area of one grid cell, used for the pile-up volumes.
+    - base_level: float
+        Height of the undeformed surface; pile-up is what lies above it.
+
+    Returns:
+    - dict of ndarray (n_runs,)
+        One entry per name of METRICS. The pile-up errors are CPFEM - AFM.
+    """
+    stack = np.asarray(stack, dtype=float)
+    reference = np.asarray(reference, dtype=float)
+    if stack.ndim == 2:
+        stack = stack[np.newaxis]
+    if stack.shape[1:] != reference.shape:
+        raise ValueError("stack and reference must be on the same grid")
+    region = np.isfinite(reference) if mask is None else np.asarray(mask, dtype=bool) & np.isfinite(reference)
+
+    valid = region & np.isfinite(stack)
+    counts = valid.sum(axis=(1, 2))
+    ref = np.where(valid, reference, 0.0)
+    sim = np.where(valid, stack, 0.0)
+    residuals = sim - ref
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        bias = residuals.sum(axis=(1, 2)) / counts
+        rms = np.sqrt((residuals**2).sum(axis=(1, 2)) / counts)
+        # Pearson correlation over the valid pixels of each run
+        sim_centered = np.where(valid, sim - (sim.sum(axis=(1, 2)) / counts)[:, None, None], 0.0)
+        ref_centered = np.where(valid, ref - (ref.sum(axis=(1, 2)) / counts)[:, None, None], 0.0)
+        correlation = (sim_centered * ref_centered).sum(axis=(1, 2)) / np.sqrt(
+            (sim_centered**2).sum(axis=(1, 2)) * (ref_centered**2).sum(axis=(1, 2)))
+
+    sim_height, sim_volume = _pileup(stack, valid, base_level, cell_area)
+    ref_height, ref_volume = _pileup(reference, region, base_level, cell_area)
+    return {
+        'rms': rms,
+        'max_abs': np.abs(residuals).max(axis=(1, 2)),
+        'bias': bias,
+        'correlation': correlation,
+        'pileup_height': sim_height,
+        'pileup_height_error': sim_height - ref_height,
+        'pileup_volume': sim_volume,
+        'pileup_volume_error': sim_volume - ref_volume,
+    }
+
+@instrument
+def rank_runs(stack, reference, mask=None, cell_area=1.0, base_level=0.0, run_names=None,
+              sort_by='rms', chunk_size=64):
+    """
+    Scores a sweep of CPFEM runs against the AFM reference and ranks them.
+
+    The stack is processed `chunk_size` runs at a time, so it can be a
+    memory-mapped array larger than the available memory.
+
+    Returns:
+    - ndarray (structured)
+        Ranking table with the fields 'rank', 'run', 'index' (position of
+        the run in the stack, as run names need not be unique) and METRICS,
+        best run first. Runs are sorted by increasing `sort_by`, except for
+        'correlation' which is sorted decreasingly.
+    """
+    n_runs = len(stack)
+    if n_runs == 0:
+        raise ValueError("the stack holds no run to rank")
+    run_names = [str(i) for i in range(n_runs)] if run_names is None else [str(name) for name in run_names]
+    metrics = {name: np.empty(n_runs) for name in METRICS}
+    for start in range(0, n_runs, chunk_size):
+        chunk = residual_metrics(stack[start:start + chunk_size], reference, mask, cell_area, base_level)
+        for name in METRICS:
+            metrics[name][start:start + chunk_size] = chunk[name]
+
+    key = -metrics[sort_by] if sort_by == 'correlation' else metrics[sort_by]
+    order = np.argsort(np.nan_to_num(key, nan=np.inf), kind='stable')
+
+    dtype = ([('rank', int), ('run', f'U{max(len(name) for name in run_names)}'), ('index', int)]
+             + [(name, float) for name in METRICS])
+    table = np.empty(n_runs, dtype=dtype)
+    table['rank'] = np.arange(1, n_runs + 1)
+    table['run'] = np.asarray(run_names)[order]
+    table['index'] = order
+    for name in METRICS:
+        table[name] = metrics[name][order]
+    return table
+
+def save_ranking(table, file_path):
+    """Saves the ranking table as a tab-separated text file."""
+    fmt = ['%d', '%s', '%d'] + ['%.6g'] * len(METRICS)
+    np.savetxt(file_path, table, fmt=fmt, delimiter='\t', header='\t'.join(table.dtype.names), comments='')
+
+@instrument
+def plot_ranking(table, stack, reference, grid_x, grid_y, mask=None, n_best=3, save_path=None):
+    """Plots the residual maps (CPFEM - AFM) of the best ranked runs (table of `rank_runs` on the same stack)."""
+    mask = np.ones(reference.shape, dtype=bool) if mask is None else mask
+    n_best = min(n_best, len(table))
+    fig, axs = plt.subplots(1, n_best, figsize=(6*n_best, 5), squeeze=False)
+    for ax, row in zip(axs[0], table[:n_best]):
+        residuals = np.where(mask, stack[row['index']] - reference, np.nan)
+        limit = np.nanmax(np.abs(residuals))
+        plot = ax.pcolormesh(grid_x, grid_y, residuals, cmap='coolwarm', vmin=-limit, vmax=limit, shading='auto')
+        ax.set_title(f"#{row['rank']} run {row['run']} (RMS {row['rms']:.3g})")
+        ax.set_xlabel("X (µm)")
+        ax.set_ylabel("Y (µm)")
+        ax.set_aspect('equal')
+        fig.colorbar(plot, ax=ax, label="Residuals (nm)")
+    fig.tight_layout()
+    if save_path is not None:
+        with span('savefig', path=str(save_path)):
+            fig.savefig(save_path, dpi=300)
+    return fig
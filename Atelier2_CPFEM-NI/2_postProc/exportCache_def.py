@@ -0,0 +1,74 @@
+## Memory-mapped '.npy' cache of parsed text exports (AFM scans, Ansys Mechanical node exports)
+import hashlib
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+def decode_line(line):
+    """Decodes a raw header line: UTF-8 (AFM exports), else the Windows code page of Mechanical exports."""
+    try:
+        return line.decode('utf-8')
+    except UnicodeDecodeError:
+        return line.decode('latin-1')
+
+def cache_files(file_path, cache_dir):
+    """'.npy' data and '.json' metadata files caching an export, unique per absolute path."""
+    key = hashlib.sha1(str(Path(file_path).resolve()).encode()).hexdigest()[:16]
+    stem = Path(cache_dir) / f"{Path(file_path).stem}_{key}"
+    return stem.with_suffix('.npy'), stem.with_suffix('.json')
+
+def read_cache(file_path, cache_dir):
+    """
+    Memory-mapped data and metadata of a cached export.
+
+    Returns None when the export was never cached, or when its mtime or size
+    changed since.
+    """
+    npy_file, meta_file = cache_files(file_path, cache_dir)
+    if not (npy_file.exists() and meta_file.exists()):
+        return None
+    with open(meta_file, 'r', encoding='utf-8') as file:
+        meta = json.load(file)
+    stat = os.stat(file_path)
+    if (meta['mtime_ns'], meta['size']) != (stat.st_mtime_ns, stat.st_size):
+        return None
+    return np.load(npy_file, mmap_mode='r')[:meta['n_rows']], meta
+
+def write_cache(file_path, cache_dir, file, iter_rows, n_cols, **meta):
+    """
+    Parses the rest of an export into the cache and returns its memory-mapped data and metadata.
+
+    Parameters:
+    - file: binary file object
+        The export, positioned on its first data line.
+    - iter_rows: callable
+        `iter_rows(file)` yields the parsed rows as 2D float arrays of
+        `n_cols` columns, a chunk at a time.
+    - meta: JSON-serializable values
+        Saved with the data (e.g. the header of the export).
+
+    The '.npy' file is allocated once, with the number of lines left in
+    `file` as an upper bound of the number of rows, then filled chunk by
+    chunk, so the export never needs to fit in memory.
+    """
+    stat = os.stat(file_path)
+    data_start = file.tell()
+    n_lines = sum(block.count(b'\n') for block in iter(lambda: file.read(1 << 24), b'')) + 1
+    file.seek(data_start)
+
+    npy_file, meta_file = cache_files(file_path, cache_dir)
+    npy_file.parent.mkdir(parents=True, exist_ok=True)
+    data = np.lib.format.open_memmap(npy_file, mode='w+', dtype=np.float64, shape=(n_lines, n_cols))
+    n_rows = 0
+    for chunk in iter_rows(file):
+        data[n_rows:n_rows + len(chunk)] = chunk
+        n_rows += len(chunk)
+    data.flush()
+    del data
+
+    meta = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'n_rows': n_rows, **meta}
+    with open(meta_file, 'w', encoding='utf-8') as file:
+        json.dump(meta, file)
+    return np.load(npy_file, mmap_mode='r')[:n_rows], meta
@@ -0,0 +1,238 @@
+## Opt-in timing and memory instrumentation of the post-processing functions and stages
+"""
+Functions are decorated with `instrument` and notebook stages are wrapped in
+`span(...)`. While the profiler is disabled (the default), a decorated
+function only costs one attribute test per call. Once enabled, every call
+records its wall time, CPU time (all threads of the process), resident
+memory (current and peak, Linux/macOS) and the size of its array arguments
+and result. The records are exported as a Chrome trace (open it in
+chrome://tracing or https://ui.perfetto.dev) and summarized per stage.
+
+Same code as Atelier1_ML-Clustering/Instrumentation.py, so that each
+workshop runs from its own folder (benchmarks/check_shared_copies.py checks
+that the two copies stay in sync).
+
+Enable with the environment variable NI_PROFILE=1 or `PROFILER.enable()`.
+
+Example:
+    PROFILER.enable()
+    with span('smoothing', sigma=1):
+        data = gaussian_filter(data, sigma=1)
+    PROFILER.write_trace(result_dir / "trace.json")
+    print(PROFILER.summary_table())
+"""
+import contextlib
+import functools
+import json
+import numbers
+import os
+import sys
+import threading
+import time
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+# Context of the spans while the profiler is disabled (reusable, no state)
+_DISABLED = contextlib.nullcontext()
+
+def _rss():
+    # Current and peak resident set size of the process in bytes (None when unavailable)
+    current = peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    try:
+        with open('/proc/self/statm') as file:
+            current = int(file.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        pass
+    return current, peak
+
+def _nbytes(value):
+    # Memory of the arrays and DataFrames in a value (arguments or result)
+    nbytes = getattr(value, 'nbytes', None)
+    if isinstance(nbytes, numbers.Integral):
+        return int(nbytes)
+    if callable(getattr(value, 'memory_usage', None)):  # DataFrame
+        return int(value.memory_usage(index=False).sum())
+    if isinstance(value, (list, tuple)):
+        return sum(_nbytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_nbytes(item) for item in value.values())
+    return 0
+
+def _mb(nbytes):
+    return None if nbytes is None else round(nbytes / 2**20, 3)
+
+class _Span:
+    # One timed region; its event is recorded on exit
+    __slots__ = ('profiler', 'name', 'category', 'args', 'start', 'cpu', 'rss', 'children')
+
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.children = 0  # Wall time of the nested spans, to compute the self time
+        self.profiler._stack().append(self)
+        self.rss, _ = _rss()
+        self.cpu = time.process_time_ns()
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        end = time.perf_counter_ns()
+        cpu = time.process_time_ns() - self.cpu
+        rss, peak = _rss()
+        wall = end - self.start
+        stack = self.profiler._stack()
+        stack.pop()
+        if stack:
+            stack[-1].children += wall
+        args = {'cpu_ms': cpu / 1e6, 'self_ms': (wall - self.children) / 1e6, 'rss_mb': _mb(rss),
+                'rss_delta_mb': _mb(rss - self.rss) if rss is not None else None, 'peak_rss_mb': _mb(peak),
+                **self.args}
+        if exc_type is not None:
+            args['error'] = exc_type.__name__
+        self.profiler._record({'name': self.name, 'cat': self.category, 'ph': 'X',
+                               'ts': self.profiler._epoch_us + self.start / 1e3, 'dur': wall / 1e3,
+                               'pid': os.getpid(), 'tid': threading.get_native_id(), 'args': args})
+        return False
+
+class Profiler:
+    """
+    Records the timed regions of one process.
+
+    Events are kept in memory in the Chrome trace format ('X' events, times
+    in µs since the epoch, so the traces of several processes line up).
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.events = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._epoch_us = time.time_ns() / 1e3 - time.perf_counter_ns() / 1e3
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """Forget the recorded events."""
+        with self._lock:
+            self.events = []
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _record(self, event):
+        with self._lock:
+            self.events.append(event)
+
+    def span(self, name, **args):
+        """Context manager timing a region (e.g. a notebook stage); `args` are saved with it."""
+        if not self.enabled:
+            return _DISABLED
+        return _Span(self, name, 'stage', args)
+
+    def instrument(self, function=None, *, name=None):
+        """
+        Decorator timing every call of `function`, with the memory of its
+        array arguments ('in_mb') and result ('out_mb').
+        """
+        if function is None:
+            return functools.partial(self.instrument, name=name)
+        label = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return function(*args, **kwargs)
+            with _Span(self, label, function.__module__, {'in_mb': _mb(_nbytes(args) + _nbytes(kwargs))}) as current:
+                result = function(*args, **kwargs)
+                current.args['out_mb'] = _mb(_nbytes(result))
+            return result
+        return wrapper
+
+    def write_trace(self, file_path):
+        """Save the events as a Chrome trace JSON file."""
+        write_trace(self.events, file_path)
+
+    def summary(self):
+        """Statistics of the recorded events per name (see `summarize`)."""
+        with self._lock:
+            return summarize(self.events)
+
+    def summary_table(self):
+        return format_summary(self.summary())
+
+def write_trace(events, file_path):
+    """Save events as a Chrome trace JSON file, one named row per process."""
+    file_path = Path(file_path)
+    file_path.parent.mkdir(parents=True, exist_ok=True)
+    processes = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': f"python {pid}"}}
+                 for pid in sorted({event['pid'] for event in events})]
+    with open(file_path, 'w') as file:
+        # Span arguments may be numpy scalars or paths
+        json.dump({'traceEvents': processes + list(events), 'displayTimeUnit': 'ms'}, file,
+                  default=lambda value: value.item() if hasattr(value, 'item') else str(value))
+
+def read_trace(file_path):
+    """Timed events of a trace saved by `write_trace`."""
+    with open(file_path, 'r') as file:
+        return [event for event in json.load(file)['traceEvents'] if event.get('ph') == 'X']
+
+def merge_traces(file_paths, output_path):
+    """Merge the traces of several processes (e.g. the workers of a batch run) into one file."""
+    events = [event for file_path in file_paths for event in read_trace(file_path)]
+    write_trace(events, output_path)
+    return events
+
+def summarize(events):
+    """
+    Calls, total wall, self and CPU times (s), largest resident memory
+    increase, peak resident memory and largest arguments and result (MiB)
+    of every recorded name, sorted by total self time.
+    """
+    rows = {}
+    for event in events:
+        args = event['args']
+        row = rows.setdefault(event['name'], {'name': event['name'], 'calls': 0, 'wall_s': 0.0, 'self_s': 0.0,
+                                              'cpu_s': 0.0, 'rss_delta_mb': None, 'peak_rss_mb': None,
+                                              'in_mb': None, 'out_mb': None})
+        row['calls'] += 1
+        row['wall_s'] += event['dur'] / 1e6
+        row['self_s'] += args['self_ms'] / 1e3
+        row['cpu_s'] += args['cpu_ms'] / 1e3
+        for key in ('rss_delta_mb', 'peak_rss_mb', 'in_mb', 'out_mb'):
+            if args.get(key) is not None:
+                row[key] = args[key] if row[key] is None else max(row[key], args[key])
+    return sorted(rows.values(), key=lambda row: row['self_s'], reverse=True)
+
+def format_summary(rows):
+    """Text table of `summarize` rows."""
+    columns = ['name', 'calls', 'wall_s', 'self_s', 'cpu_s', 'rss_delta_mb', 'peak_rss_mb', 'in_mb', 'out_mb']
+    cells = [[str(row[column]) if isinstance(row[column], (str, int)) else
+              '' if row[column] is None else f"{row[column]:.3f}" for column in columns] for row in rows]
+    widths = [max([len(column)] + [len(line[i]) for line in cells]) for i, column in enumerate(columns)]
+    lines = ['  '.join(column.ljust(width) if i == 0 else column.rjust(width)
+                       for i, (column, width) in enumerate(zip(columns, widths)))]
+    lines += ['  '.join(cell.ljust(width) if i == 0 else cell.rjust(width)
+                        for i, (cell, width) in enumerate(zip(line, widths))) for line in cells]
+    return '\n'.join(lines)
+
+# Profiler of the process, shared by all the instrumented modules
+PROFILER = Profiler(enabled=os.environ.get('NI_PROFILE', '0') not in ('', '0'))
+instrument = PROFILER.instrument
+span = PROFILER.span
@@ -0,0 +1,80 @@
+## Bulk parser for Ansys Mechanical node exports (CPFEM_SurfTopo, Displacement...)
+import io
+from collections import namedtuple
+
+import numpy as np
+
+from exportCache_def import decode_line, read_cache, write_cache
+from instrumentation_def import instrument
+
+# Column names of the export and (n_nodes, n_columns) float64 array (or memmap)
+NodeExport = namedtuple('NodeExport', ['columns', 'data'])
+
+def read_node_header(file_path):
+    """Reads the tab-separated header line of a node export."""
+    with open(file_path, 'rb') as file:
+        return decode_line(file.readline()).strip().split('\t')
+
+def _parse_chunk(lines):
+    """Parses a list of raw lines (decimal comma, tab-separated) into a 2D array."""
+    text = b''.join(lines).replace(b',', b'.')
+    try:
+        return np.loadtxt(io.BytesIO(text), delimiter='\t', ndmin=2)
+    except ValueError:
+        # Slow path only for chunks holding invalid lines
+        rows = []
+        for line in text.splitlines():
+            try:
+                rows.append([float(value) for value in line.split(b'\t')])
+            except ValueError:
+                print(f"Skipping invalid line: {decode_line(line).strip()}")
+        return np.array(rows, dtype=float).reshape(len(rows), -1)
+
+def _iter_rows(file, chunk_size=1 << 24):
+    # Parsed data lines of an open export, about chunk_size bytes of text at a time
+    while True:
+        lines = file.readlines(chunk_size)
+        if not lines:
+            break
+        lines = [line for line in lines if line.strip()]
+        if lines:
+            yield _parse_chunk(lines)
+
+def iter_node_export(file_path, chunk_size=1 << 24):
+    """
+    Yields the node export as successive 2D float arrays.
+
+    Each chunk holds about `chunk_size` bytes of text, so files larger than
+    the available memory can be processed.
+    """
+    with open(file_path, 'rb') as file:
+        file.readline()  # Skip the header line
+        yield from _iter_rows(file, chunk_size)
+
+@instrument
+def load_node_export(file_path, cache_dir=None, chunk_size=1 << 24):
+    """
+    Loads a node export as typed NumPy arrays.
+
+    Without `cache_dir`, the chunks are parsed and concatenated in memory.
+    With `cache_dir`, they are written to a '.npy' file on disk chunk by
+    chunk and returned memory-mapped; later loads only map that file as long
+    as the export mtime and size are unchanged (see exportCache_def).
+    """
+    if cache_dir is not None:
+        cached = read_cache(file_path, cache_dir)
+        if cached is not None:
+            data, meta = cached
+            return NodeExport(meta['columns'], data)
+
+    columns = read_node_header(file_path)
+    if cache_dir is None:
+        chunks = list(iter_node_export(file_path, chunk_size))
+        data = np.concatenate(chunks) if chunks else np.empty((0, len(columns)))
+        return NodeExport(columns, data)
+
+    with open(file_path, 'rb') as file:
+        file.readline()  # Skip the header line
+        data, _ = write_cache(file_path, cache_dir, file, lambda file: _iter_rows(file, chunk_size), len(columns),
+                              columns=columns)
+    return NodeExport(columns, data)
@@ -0,0 +1,191 @@
+## Sub-pixel registration (shift, rotation, Z offset) of two topographies on the same grid
+import warnings
+from collections import namedtuple
+
+import numpy as np
+from scipy import fft, ndimage
+
+from instrumentation_def import instrument
+
+# shift: (dy, dx) in pixels, angle: degrees (counterclockwise), z_offset: height units,
+# peak: normalized cross-correlation peak (close to 1 for a perfect match)
+Registration = namedtuple('Registration', ['shift', 'angle', 'z_offset', 'peak'])
+
+def _prepare(field):
+    # Fill NaN with the mean and taper the borders so that FFT wrap-around does not dominate
+    field = np.asarray(field, dtype=float)
+    valid = np.isfinite(field)
+    # Mean of every field of a stack (0 when it has no valid pixel)
+    fill = np.where(valid, field, 0.0).sum(axis=(-2, -1), keepdims=True)
+    field = np.where(valid, field, fill / np.maximum(valid.sum(axis=(-2, -1), keepdims=True), 1))
+    field = field - field.mean(axis=(-2, -1), keepdims=True)
+    return field * np.outer(np.hanning(field.shape[-2]), np.hanning(field.shape[-1]))
+
+def _cross_power(reference_fft, moving_fft):
+    # Cross-power spectrum, normalized so that a perfect match peaks at 1. It is not whitened
+    # (as in phase correlation): whitening amplifies the high-frequency noise that dominates
+    # AFM maps, while the indent and its pile-up live in the low frequencies
+    product = moving_fft * np.conj(reference_fft)
+    total = np.maximum(np.abs(product).sum(axis=(-2, -1), keepdims=True), np.finfo(float).tiny)
+    return product / total * product.shape[-2] * product.shape[-1]
+
+def _low_pass(spectrum, smoothing):
+    # Gaussian low-pass of a (stack of) cross-power spectrum: the correlation of both fields
+    # smoothed with a Gaussian of `smoothing` / sqrt(2) pixels
+    if smoothing <= 0:
+        return spectrum
+    fy, fx = fft.fftfreq(spectrum.shape[-2]), fft.fftfreq(spectrum.shape[-1])
+    return spectrum * np.exp(-2 * np.pi**2 * smoothing**2 * (fy[:, None]**2 + fx[None, :]**2))
+
+def _upsampled_dft(data, centers, upsample_factor, region_size):
+    """Inverse DFT of `data` on a fine grid of `region_size` points per axis around `centers`."""
+    ny, nx = data.shape
+    offsets = (np.arange(region_size) - region_size // 2) / upsample_factor
+    ty, tx = centers[0] + offsets, centers[1] + offsets
+    kernel_y = np.exp(2j * np.pi * np.outer(ty, fft.fftfreq(ny)))
+    kernel_x = np.exp(2j * np.pi * np.outer(fft.fftfreq(nx), tx))
+    return kernel_y @ data @ kernel_x, ty, tx
+
+def cross_correlation(reference, moving, upsample_factor=20, smoothing=0.0):
+    """
+    Sub-pixel translation between two fields by FFT cross-correlation.
+
+    The integer peak of the cross-correlation is refined by evaluating the
+    inverse DFT on a grid `upsample_factor` times finer around it (matrix
+    multiplication instead of a zero-padded FFT). With `smoothing` (pixels),
+    the correlation is low-pass filtered first, so that pixel noise does not
+    move the peak.
+
+    Returns:
+    - shift: ndarray (2,)
+        (dy, dx) in pixels such that moving(p) ~ reference(p - shift).
+    - peak: float
+        Height of the normalized correlation peak.
+    """
+    spectrum = _low_pass(_cross_power(fft.fft2(_prepare(reference), workers=-1),
+                                      fft.fft2(_prepare(moving), workers=-1)), smoothing)
+    correlation = fft.ifft2(spectrum, workers=-1).real
+    peak_index = np.array(np.unravel_index(np.argmax(correlation), correlation.shape), dtype=float)
+    shape = np.array(correlation.shape)
+    shift = np.where(peak_index > shape // 2, peak_index - shape, peak_index)
+    peak = correlation.max()
+    if upsample_factor > 1:
+        region_size = int(np.ceil(3 * upsample_factor)) | 1
+        upsampled, ty, tx = _upsampled_dft(spectrum, shift, upsample_factor, region_size)
+        upsampled = upsampled.real / spectrum.size
+        iy, ix = np.unravel_index(np.argmax(upsampled), upsampled.shape)
+        shift = np.array([ty[iy], tx[ix]])
+        peak = upsampled[iy, ix]
+    return shift, float(peak)
+
+def _transform_coordinates(shape, angle, shift):
+    # Coordinates (in the moving field) of every output pixel: c + R(angle) (p + shift - c)
+    angle = np.atleast_1d(np.radians(angle))
+    cy, cx = (np.array(shape) - 1) / 2
+    py, px = np.indices(shape, dtype=float)
+    py = py + shift[0] - cy
+    px = px + shift[1] - cx
+    cos, sin = np.cos(angle)[:, None, None], np.sin(angle)[:, None, None]
+    return np.stack((cy + cos * py + sin * px, cx - sin * py + cos * px))
+
+def transform_field(field, angle=0.0, shift=(0.0, 0.0), order=1):
+    """Rotates `field` about its center by `angle` degrees and shifts it by -`shift` pixels (NaN outside)."""
+    coordinates = _transform_coordinates(np.shape(field), angle, shift)
+    valid = np.isfinite(field)
+    values = ndimage.map_coordinates(np.where(valid, field, 0.0), coordinates, order=order, cval=np.nan)
+    # Pixels interpolated from NaN neighbours stay NaN
+    weight = ndimage.map_coordinates(valid.astype(float), coordinates, order=1, cval=0.0)
+    return np.where(weight > 1 - 1e-6, values, np.nan)[0]
+
+def _downsample(field, factor):
+    # Block average with NaN ignored
+    if factor == 1:
+        return field
+    ny, nx = (np.array(field.shape) // factor) * factor
+    blocks = field[:ny, :nx].reshape(ny // factor, factor, nx // factor, factor)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # All-NaN blocks
+        return np.nanmean(blocks, axis=(1, 3))
+
+def _angle_scores(reference, moving, angles, shift, smoothing):
+    # Cross-correlation peak of the reference with the moving field shifted by -`shift` and
+    # rotated by every angle at once, both restricted to their overlap so that the borders
+    # brought in by the shift or the rotation do not bias the score
+    coordinates = _transform_coordinates(moving.shape, angles, shift)
+    valid = np.isfinite(moving)
+    rotated = ndimage.map_coordinates(np.where(valid, moving, 0.0), coordinates, order=1, cval=0.0)
+    overlap = ndimage.map_coordinates(valid.astype(float), coordinates, order=1, cval=0.0) > 1 - 1e-6
+    overlap &= np.isfinite(reference)
+    spectra = _low_pass(_cross_power(fft.fft2(_prepare(np.where(overlap, reference, np.nan)), workers=-1),
+                                     fft.fft2(_prepare(np.where(overlap, rotated, np.nan)), workers=-1)), smoothing)
+    return fft.ifft2(spectra, workers=-1).real.max(axis=(-2, -1))
+
+def _refine_shift(reference, moving, angle, shift, upsample_factor, smoothing):
+    # Residual shift of `moving` once rotated by `angle` and shifted by -`shift`, added to `shift`
+    residual, peak = cross_correlation(reference, transform_field(moving, angle, shift), upsample_factor, smoothing)
+    return shift + residual, peak
+
+@instrument
+def register(reference, moving, max_angle=10.0, angle_step=1.0, upsample_factor=20, search_size=256,
+             smoothing=2.0):
+    """
+    Finds the rotation, in-plane shift and Z offset that best align `moving` on `reference`.
+
+    Both fields must be sampled on the same regular grid (e.g. the common grid
+    of the CPFEM/AFM comparison); NaN pixels are ignored. The rotation is
+    about the center of the grid.
+
+    The search runs on fields block-averaged to about `search_size` pixels,
+    alternating shift and rotation so that the angle is always scored on
+    fields already translated onto each other:
+
+    1. Shift: sub-pixel cross-correlation of the unrotated fields (an
+       integer residual shift would bias the angle scores).
+    2. Rotation: every angle of [-max_angle, max_angle] (step `angle_step`)
+       is scored at once by the peak of the cross-correlation; the shift is
+       re-estimated at the best angle, then the angle is refined with a
+       second pass ten times finer and the shift re-estimated again.
+    3. Shift refinement on the full-resolution fields to 1/`upsample_factor`
+       pixel.
+    4. Z offset: mean height difference over the overlapping pixels of the
+       fully aligned fields.
+
+    All the scores are plain (not whitened) cross-correlations, low-pass
+    filtered over `smoothing` pixels of the full-resolution grid, which keeps
+    them robust to the pixel noise of AFM maps.
+
+    Returns:
+    - Registration
+        Pass it to `apply_registration` to get `moving` aligned on `reference`.
+    """
+    reference = np.asarray(reference, dtype=float)
+    moving = np.asarray(moving, dtype=float)
+    if reference.shape != moving.shape:
+        raise ValueError("reference and moving must be on the same grid")
+
+    factor = max(1, max(reference.shape) // search_size)
+    small_reference = _downsample(reference, factor)
+    small_moving = _downsample(moving, factor)
+    angle = 0.0
+    small_smoothing = smoothing / factor
+    shift, _ = cross_correlation(small_reference, small_moving, upsample_factor, small_smoothing)
+    if max_angle > 0:
+        angles = np.arange(-max_angle, max_angle + angle_step / 2, angle_step)
+        angle = angles[np.argmax(_angle_scores(small_reference, small_moving, angles, shift, small_smoothing))]
+        shift, _ = _refine_shift(small_reference, small_moving, angle, shift, upsample_factor, small_smoothing)
+        fine_angles = angle + np.arange(-angle_step, angle_step + angle_step / 20, angle_step / 10)
+        fine_angles = fine_angles[np.abs(fine_angles) <= max_angle + 1e-9]
+        scores = _angle_scores(small_reference, small_moving, fine_angles, shift, small_smoothing)
+        angle = float(fine_angles[np.argmax(scores)])
+        shift, _ = _refine_shift(small_reference, small_moving, angle, shift, upsample_factor, small_smoothing)
+
+    # Sub-pixel refinement at full resolution on the roughly aligned fields
+    # (which also removes the bias of the window on large shifts)
+    shift, peak = _refine_shift(reference, moving, angle, shift * factor, upsample_factor, smoothing)
+    z_offset = float(np.nanmean(reference - transform_field(moving, angle, shift)))
+    return Registration(tuple(shift), angle, z_offset, peak)
+
+@instrument
+def apply_registration(moving, registration, order=1):
+    """Returns `moving` rotated, shifted and offset in Z onto the reference (NaN where undefined)."""
+    return transform_field(moving, registration.angle, registration.shift, order) + registration.z_offset
@@ -0,0 +1,108 @@
+## Reusable regridding of scattered CPFEM/AFM points onto a common grid
+import hashlib
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+from scipy.interpolate import CloughTocher2DInterpolator
+from scipy.spatial import Delaunay
+
+from instrumentation_def import instrument, span
+
+def _key(points, grid_x, grid_y, mask, method):
+    sha = hashlib.sha1(method.encode())
+    for array in (points, grid_x, grid_y, mask):
+        array = np.ascontiguousarray(array)
+        sha.update(f"{array.dtype}{array.shape}".encode())
+        sha.update(array.tobytes())
+    return sha.hexdigest()
+
+class Regridder:
+    """
+    Interpolates values given on a fixed set of scattered points onto a fixed grid.
+
+    The Delaunay triangulation is built once per (points, grid, mask). For
+    the linear method the barycentric weights are also stored as a sparse
+    matrix, so each new set of values costs a single matrix-vector product
+    (same result as `griddata(..., method='linear')`). The cubic method
+    reuses the triangulation for the Clough-Tocher interpolant (same result
+    as `griddata(..., method='cubic')`); only the gradients are estimated
+    again for each set of values.
+
+    With `cache_dir`, the linear weights are saved to disk and reloaded by
+    later sessions for the same points, grid and mask.
+    """
+
+    def __init__(self, points, grid_x, grid_y, method='linear', mask=None, cache_dir=None):
+        self.points = np.ascontiguousarray(points, dtype=float)
+        self.shape = np.shape(grid_x)
+        self.method = method
+        self.mask = np.ones(self.shape, dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+        self.targets = np.column_stack((np.asarray(grid_x)[self.mask], np.asarray(grid_y)[self.mask]))
+        self.key = _key(self.points, grid_x, grid_y, self.mask, method)
+        self._triangulation = None
+
+        cache_file = Path(cache_dir) / f"regrid_{self.key}.npz" if cache_dir is not None else None
+        if method == 'linear':
+            if cache_file is not None and cache_file.exists():
+                self.weights = sparse.load_npz(cache_file)
+            else:
+                self.weights = self._linear_weights()
+                if cache_file is not None:
+                    cache_file.parent.mkdir(parents=True, exist_ok=True)
+                    sparse.save_npz(cache_file, self.weights)
+            # Targets outside the convex hull have no weight
+            self.inside = np.asarray(self.weights.getnnz(axis=1) > 0)
+        elif method == 'cubic':
+            with span('triangulation', n_points=len(self.points)):
+                self._triangulation = Delaunay(self.points)
+        else:
+            raise ValueError("method must be 'linear' or 'cubic'")
+
+    def _linear_weights(self):
+        """Sparse (n_targets, n_points) matrix of barycentric weights."""
+        with span('triangulation', n_points=len(self.points)):
+            triangulation = Delaunay(self.points)
+        simplex = triangulation.find_simplex(self.targets)
+        inside = simplex >= 0
+        transform = triangulation.transform[simplex[inside]]
+        delta = self.targets[inside] - transform[:, 2]
+        bary = np.einsum('nij,nj->ni', transform[:, :2], delta)
+        weights = np.column_stack((bary, 1 - bary.sum(axis=1)))
+
+        rows = np.repeat(np.flatnonzero(inside), 3)
+        cols = triangulation.simplices[simplex[inside]].ravel()
+        return sparse.csr_matrix((weights.ravel(), (rows, cols)), shape=(len(self.targets), len(self.points)))
+
+    def __call__(self, values, fill_value=np.nan):
+        """Interpolates one set of values (one per source point) onto the grid."""
+        values = np.asarray(values, dtype=float)
+        if self.method == 'linear':
+            interpolated = self.weights @ values
+            interpolated[~self.inside] = fill_value
+        else:
+            interpolated = CloughTocher2DInterpolator(self._triangulation, values, fill_value=fill_value)(self.targets)
+        grid_z = np.full(self.shape, np.nan)
+        grid_z[self.mask] = interpolated
+        return grid_z
+
+# Regridders reused within the session, keyed like their on-disk cache
+_regridders = OrderedDict()
+
+@instrument
+def get_regridder(points, grid_x, grid_y, method='linear', mask=None, cache_dir=None, max_size=8):
+    """Returns the Regridder for these inputs, building it only once per session."""
+    mask_array = np.ones(np.shape(grid_x), dtype=bool) if mask is None else np.asarray(mask, dtype=bool)
+    key = _key(np.asarray(points, dtype=float), grid_x, grid_y, mask_array, method)
+    if key not in _regridders:
+        _regridders[key] = Regridder(points, grid_x, grid_y, method, mask, cache_dir)
+        if len(_regridders) > max_size:
+            _regridders.popitem(last=False)
+    _regridders.move_to_end(key)
+    return _regridders[key]
+
+@instrument
+def regrid(points, values, grid_x, grid_y, method='linear', mask=None, cache_dir=None):
+    """Interpolates one set of values onto the grid (see `get_regridder`)."""
+    return get_regridder(points, grid_x, grid_y, method, mask, cache_dir)(values)
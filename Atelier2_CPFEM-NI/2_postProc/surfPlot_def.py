@@ -1,23 +1,121 @@
 ## Import necessary libraries for interpolation and visualization
+import io
+from collections import namedtuple
+
 import matplotlib.pyplot as plt
 import numpy as np
 
+from exportCache_def import decode_line, read_cache, write_cache
+from instrumentation_def import instrument
+
+# AFM topography: (ny, nx) height array (or memmap), physical extent and parsed header
+AFMScan = namedtuple('AFMScan', ['data', 'width', 'height', 'header'])
+
+@instrument
 def read_header(file_path, num_lines=4):
     """Reads the header lines from the file."""
     header_lines = []
-    with open(file_path, "r") as file:
+    with open(file_path, "rb") as file:
         for _ in range(num_lines):
-            header_lines.append(file.readline().strip())
+            header_lines.append(decode_line(file.readline()).strip())
     return header_lines
 
+@instrument
+def parse_afm_header(header_lines):
+    """Parses the '# Key: value' header lines, with Width/Height as floats and their units apart."""
+    header = {}
+    for line in header_lines:
+        key, _, value = line.lstrip('#').partition(':')
+        key, value = key.strip(), value.strip()
+        if key in ('Width', 'Height'):
+            number, _, unit = value.partition(' ')
+            header[key] = float(number)
+            header[f"{key} units"] = unit.strip()
+        elif key:
+            header[key] = value
+    return header
+
+def _iter_afm_rows(file, chunk_size=1 << 24):
+    # Bulk parse of the whitespace-separated matrix, about chunk_size bytes of text at a time
+    while True:
+        lines = file.readlines(chunk_size)
+        if not lines:
+            break
+        rows = np.loadtxt(io.BytesIO(b''.join(lines)), ndmin=2)
+        if rows.size:
+            yield rows
+
+@instrument
 def load_afm_data(file_path, skiprows=4):
     """Loads AFM data from the file, skipping header lines."""
-    try:
-        return np.loadtxt(file_path, skiprows=skiprows)
-    except ValueError as e:
-        print(f"Error loading data: {e}")
-        raise
+    with open(file_path, 'rb') as file:
+        for _ in range(skiprows):
+            file.readline()
+        try:
+            chunks = list(_iter_afm_rows(file))
+        except ValueError as e:
+            print(f"Error loading data: {e}")
+            raise
+    return np.concatenate(chunks) if chunks else np.empty((0, 0))
+
+@instrument
+def load_afm(file_path, cache_dir=None, num_lines=4):
+    """
+    Loads an AFM text export and its header in a single pass.
+
+    With `cache_dir`, the height matrix is written to a '.npy' file chunk by
+    chunk and returned memory-mapped, with the header and extent in a '.json'
+    file next to it. Later loads only map that file as long as the export
+    mtime and size are unchanged (see exportCache_def), so cropping (see
+    `crop_afm`) then reads only the rows it needs.
+    """
+    if cache_dir is not None:
+        cached = read_cache(file_path, cache_dir)
+        if cached is not None:
+            data, meta = cached
+            header = meta['header']
+            return AFMScan(data, header['Width'], header['Height'], header)
+
+    with open(file_path, 'rb') as file:
+        header = parse_afm_header([decode_line(file.readline()).strip() for _ in range(num_lines)])
+        if cache_dir is None:
+            chunks = list(_iter_afm_rows(file))
+            data = np.concatenate(chunks) if chunks else np.empty((0, 0))
+            return AFMScan(data, header['Width'], header['Height'], header)
+
+        # Columns from the first row, to allocate the memmap once
+        data_start = file.tell()
+        n_cols = len(file.readline().split())
+        file.seek(data_start)
+        data, _ = write_cache(file_path, cache_dir, file, _iter_afm_rows, n_cols, header=header)
+    return AFMScan(data, header['Width'], header['Height'], header)
+
+@instrument
+def afm_grid(scan, rows=slice(None), cols=slice(None)):
+    """X/Y meshgrid (physical units) of the scan, or of the given rows and columns of it."""
+    n_rows, n_cols = scan.data.shape
+    x = np.linspace(0, scan.width, n_cols)[cols]
+    y = np.linspace(0, scan.height, n_rows)[rows]
+    return np.meshgrid(x, y)
+
+@instrument
+def crop_afm(scan, x_range, y_range):
+    """
+    Crops the scan to the X/Y ranges (physical units) without reading the rest of it.
+
+    Returns:
+    - data, grid_x, grid_y: ndarray
+        Heights and coordinates of the cropped region.
+    """
+    n_rows, n_cols = scan.data.shape
+    col_step = scan.width / max(n_cols - 1, 1)
+    row_step = scan.height / max(n_rows - 1, 1)
+    cols = slice(max(int(np.ceil(x_range[0] / col_step)), 0), min(int(np.floor(x_range[1] / col_step)) + 1, n_cols))
+    rows = slice(max(int(np.ceil(y_range[0] / row_step)), 0), min(int(np.floor(y_range[1] / row_step)) + 1, n_rows))
+    grid_x, grid_y = afm_grid(scan, rows, cols)
+    return np.array(scan.data[rows, cols]), grid_x, grid_y
 
+@instrument
 def center_on_minimum(data_cropped, grid_x, grid_y):
     """Centers the cropped data on the minimum Z value with (0, 0) at the minimum."""
     # Find the index of the minimum Z value
@@ -32,6 +130,7 @@ def center_on_minimum(data_cropped, grid_x, grid_y):
     
     return grid_x_centered, grid_y_centered
 
+@instrument
 def visualize_data(data_cropped, grid_x_centered, grid_y_centered):
     """Visualizes the cropped and centered data."""
     plt.figure(figsize=(10, 8))
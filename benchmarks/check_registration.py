@@ -0,0 +1,68 @@
+"""
+Accuracy check of the CPFEM/AFM registration on noisy synthetic indents.
+
+A Berkovich-like imprint (depth 200 nm, three pile-up lobes of 40 nm) is
+rotated and shifted, Gaussian noise is added to both the reference and the
+moving field, and `registration_def.register` must recover the angle within
+`--angle-tol` degrees and a pose whose height error (noise-free fields, inner
+disk) is below `--rms-tol` nm. Exits with status 1 on any failure.
+
+Example:
+    python benchmarks/check_registration.py --size 1024 --noise 0 5 10 20
+"""
+import argparse
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'Atelier2_CPFEM-NI' / '2_postProc'))
+
+import numpy as np
+from scipy import ndimage
+
+from registration_def import apply_registration, register, transform_field
+
+def synthetic_indent(size, depth=200.0, pileup=40.0):
+    """Height map (nm) of a triangular imprint with three pile-up lobes, on a (size, size) grid."""
+    y, x = (np.indices((size, size)) - (size - 1) / 2) * (512 / size)
+    theta = np.arctan2(y, x)
+    # Distance to the center along the normal of the nearest side of the triangle
+    distance = np.hypot(x, y) * np.cos(theta % (2 * np.pi / 3) - np.pi / 3)
+    lobes = pileup * np.exp(-(distance - 140)**2 / (2 * 20**2)) * (1 + np.cos(3 * theta)) / 2
+    return -depth * np.clip(1 - distance / 120, 0, None) + lobes, np.hypot(x, y)
+
+def check(size, angle, shift, noise, rng):
+    reference, radius = synthetic_indent(size)
+    moving = transform_field(reference, -angle, (0.0, 0.0), order=3)
+    moving = ndimage.shift(np.where(np.isfinite(moving), moving, 0.0), shift, order=3, cval=np.nan)
+    registration = register(reference + rng.normal(0, noise, reference.shape),
+                            moving + rng.normal(0, noise, moving.shape))
+    error = apply_registration(moving, registration) - reference
+    pose_rms = float(np.sqrt(np.nanmean(error[radius < 200]**2)))
+    return registration, abs(registration.angle - angle), pose_rms
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check the registration accuracy on noisy synthetic indents.")
+    parser.add_argument('--size', type=int, default=512)
+    parser.add_argument('--angles', type=float, nargs='+', default=[5.0, -8.0])
+    parser.add_argument('--shift', type=float, nargs=2, default=[3.2, -1.7])
+    parser.add_argument('--noise', type=float, nargs='+', default=[0.0, 5.0, 10.0], help="Noise std (nm)")
+    parser.add_argument('--angle-tol', type=float, default=0.5)
+    parser.add_argument('--rms-tol', type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(0)
+    failures = 0
+    print(f"{'angle':>6} {'noise':>6} {'found':>6} {'shift':>16} {'peak':>6} {'pose_rms':>9}")
+    for angle in args.angles:
+        for noise in args.noise:
+            registration, angle_error, pose_rms = check(args.size, angle, args.shift, noise, rng)
+            failed = angle_error > args.angle_tol or not pose_rms <= args.rms_tol
+            failures += failed
+            shift = f"({registration.shift[0]:.2f}, {registration.shift[1]:.2f})"
+            print(f"{angle:6.1f} {noise:6.1f} {registration.angle:6.1f} {shift:>16} {registration.peak:6.3f} "
+                  f"{pose_rms:9.3f}{'  FAILED' if failed else ''}")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
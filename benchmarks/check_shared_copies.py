@@ -0,0 +1,49 @@
+"""
+Check that the modules shared by both workshops did not drift apart.
+
+Instrumentation and StageCache are kept as one copy per workshop, so that
+each workshop runs from its own folder without patching sys.path. The code
+of the copies (module docstring and workshop imports aside) must be the
+same. Exits with status 1 and prints a diff otherwise.
+
+Example:
+    python benchmarks/check_shared_copies.py
+"""
+import ast
+import difflib
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# (clustering module, post-processing copy, imports of the workshop modules)
+COPIES = [
+    ('Instrumentation.py', 'instrumentation_def.py', {}),
+    ('StageCache.py', 'stageCache_def.py', {'from Instrumentation import': 'from instrumentation_def import'}),
+]
+
+def code(file_path, renames=None):
+    """Lines of a module after its docstring, with the imports of the other workshop renamed."""
+    source = Path(file_path).read_text(encoding='utf-8')
+    tree = ast.parse(source)
+    start = tree.body[0].end_lineno if isinstance(tree.body[0], ast.Expr) else 0
+    text = '\n'.join(source.splitlines()[start:])
+    for old, new in (renames or {}).items():
+        text = text.replace(old, new)
+    return text.splitlines()
+
+def main():
+    failures = 0
+    for module, copy, renames in COPIES:
+        original = ROOT / 'Atelier1_ML-Clustering' / module
+        duplicate = ROOT / 'Atelier2_CPFEM-NI' / '2_postProc' / copy
+        diff = list(difflib.unified_diff(code(original, renames), code(duplicate), str(original), str(duplicate),
+                                         lineterm=''))
+        failures += bool(diff)
+        print(f"{copy}: {'DIFFERS from ' + module if diff else 'in sync'}")
+        if diff:
+            print('\n'.join(diff))
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""
+Timing and peak-memory benchmarks of the clustering and post-processing hot paths.
+
+Every benchmark runs on synthetic maps of several sizes (25x25, 81x81 and
+193x193 as the workshop maps, 1k and 4k for large maps). The report is saved
+as JSON, named after the current git commit, and two reports can be compared
+to catch regressions.
+
+Times are the minimum and median of `--repeat` runs; the peak memory is that
+of the Python allocations (numpy included) of one extra run, measured with
+tracemalloc.
+
+Examples:
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --sizes 193x193 1k --filter plot
+    python benchmarks/run_benchmarks.py --compare benchmarks/results/1a2b3c4.json benchmarks/results/5d6e7f8.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / 'Atelier1_ML-Clustering'))
+sys.path.insert(0, str(ROOT / 'Atelier2_CPFEM-NI' / '2_postProc'))
+
+import matplotlib
+matplotlib.use('Agg')  # No display: figures are only drawn
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import scipy
+
+SIZES = {
+    '25x25': (25, 25),
+    '81x81': (81, 81),
+    '193x193': (193, 193),
+    '1k': (1000, 1000),
+    '4k': (4000, 4000),
+}
+DEFAULT_SIZES = ['25x25', '81x81', '193x193', '1k']
+
+# name -> setup(shape, work_dir), which returns the function to time
+BENCHMARKS = {}
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+def synthetic_map(shape):
+    """Matrix/fibre map of the given (rows, cols), one indent per µm."""
+    from SyntheticData import composite_phases, fiber_layout, iter_synthetic_map
+    size = (shape[1], shape[0])
+    layout = fiber_layout(size, radius=max(size) / 20, fraction=0.5)
+    chunks = [chunk for chunk, _ in iter_synthetic_map(layout, composite_phases([1.5], [3]), shape, size)]
+    return pd.concat(chunks, ignore_index=True)
+
+def _drawn(plot):
+    # Plotting functions only create artists: include the rendering in the timing.
+    # Each run draws on a new figure, so that artists do not pile up between runs.
+    def run():
+        fig, ax = plt.subplots()
+        plot(ax)
+        fig.canvas.draw()
+        plt.close(fig)
+    return run
+
+@benchmark('plot_map')
+def _plot_map(shape, work_dir):
+    from Mapping import plot_map
+    data = synthetic_map(shape)
+    return _drawn(lambda ax: plot_map(data['X Position_µm'], data['Y Position_µm'], data['HARDNESS_GPa'],
+                                      'Hardness (GPa)', 'X (µm)', 'Y (µm)', ax))
+
+@benchmark('plot_pixel_map')
+def _plot_pixel_map(shape, work_dir):
+    from Mapping import plot_pixel_map
+    data = synthetic_map(shape)
+    labels = (data['HARDNESS_GPa'] > 3).astype(int)
+    return _drawn(lambda ax: plot_pixel_map(data['X Position_µm'], data['Y Position_µm'], labels, 'Clusters',
+                                            'X (µm)', 'Y (µm)', 4, 2, {0: 'tab:blue', 1: 'tab:orange'}, ax=ax))
+
+@benchmark('plot_pdf_with_deconvolution_on_axis')
+def _plot_pdf(shape, work_dir):
+    from Deconvolution import clear_cache
+    from Mapping import plot_pdf_with_deconvolution_on_axis
+    data = synthetic_map(shape)
+
+    def plot(ax):
+        clear_cache()  # Time the GMM fit, not a cache hit
+        plot_pdf_with_deconvolution_on_axis(data, 'HARDNESS_GPa', 3, ax)
+    return _drawn(plot)
+
+@benchmark('plot_cdf_with_weibull_fit_on_axis')
+def _plot_cdf(shape, work_dir):
+    from Mapping import plot_cdf_with_weibull_fit_on_axis
+    data = synthetic_map(shape)
+    return _drawn(lambda ax: plot_cdf_with_weibull_fit_on_axis(data, 'HARDNESS_GPa', ax))
+
+@benchmark('add_kam_metric')
+def _kam(shape, work_dir):
+    from KAMM import add_kam_metric
+    data = synthetic_map(shape)
+    return lambda: add_kam_metric(data, 'HARDNESS_GPa', 'KAMM_HARDNESS_GPa', order=2)
+
+@benchmark('select_n_clusters')
+def _select_n_clusters(shape, work_dir):
+    from ModelSelection import feature_matrix, select_n_clusters
+    X = feature_matrix(synthetic_map(shape), ['HARDNESS_GPa', 'MODULUS_GPa'])
+    # In this process, so that the timing does not depend on the pool start-up
+    return lambda: select_n_clusters(X, n_jobs=1)
+
+def _afm_file(shape, work_dir):
+    file_path = Path(work_dir) / f"AFM_{shape[0]}x{shape[1]}.txt"
+    if not file_path.exists():
+        rng = np.random.default_rng(0)
+        header = f"# Channel: Synthetic\n# Width: {shape[1] / 100} µm\n# Height: {shape[0] / 100} µm\n# Value units: m"
+        np.savetxt(file_path, rng.normal(0, 1e-9, shape), fmt='%.4e', delimiter='\t', header=header, comments='',
+                   encoding='utf-8')
+    return file_path
+
+@benchmark('load_afm_data')
+def _load_afm_data(shape, work_dir):
+    from surfPlot_def import load_afm_data
+    file_path = _afm_file(shape, work_dir)
+    return lambda: load_afm_data(file_path)
+
+@benchmark('center_on_minimum')
+def _center_on_minimum(shape, work_dir):
+    from surfPlot_def import center_on_minimum
+    data = np.random.default_rng(0).normal(size=shape)
+    grid_x, grid_y = np.meshgrid(np.arange(shape[1], dtype=float), np.arange(shape[0], dtype=float))
+    return lambda: center_on_minimum(data, grid_x, grid_y)
+
+def _scattered_points(shape):
+    # CPFEM-like nodes: as many scattered points as grid nodes, on the same square
+    rng = np.random.default_rng(0)
+    points = rng.uniform(0, 1, size=(shape[0] * shape[1], 2))
+    grid_x, grid_y = np.meshgrid(np.linspace(0, 1, shape[1]), np.linspace(0, 1, shape[0]))
+    return points, np.sin(6 * points[:, 0]) * np.cos(4 * points[:, 1]), grid_x, grid_y
+
+@benchmark('griddata')
+def _griddata(shape, work_dir):
+    from scipy.interpolate import griddata
+    points, values, grid_x, grid_y = _scattered_points(shape)
+    return lambda: griddata(points, values, (grid_x, grid_y), method='linear')
+
+@benchmark('Regridder (build and apply)')
+def _regridder(shape, work_dir):
+    from regrid_def import Regridder
+    points, values, grid_x, grid_y = _scattered_points(shape)
+    return lambda: Regridder(points, grid_x, grid_y, method='linear')(values)
+
+@benchmark('Regridder (apply)')
+def _regridder_apply(shape, work_dir):
+    from regrid_def import Regridder
+    points, values, grid_x, grid_y = _scattered_points(shape)
+    regridder = Regridder(points, grid_x, grid_y, method='linear')
+    return lambda: regridder(values)
+
+def measure(function, repeat):
+    """Times of `repeat` runs and peak traced memory (bytes) of one more run."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return times, peak
+
+def git_commit():
+    """Short hash of HEAD, with '-dirty' if the tree has uncommitted changes."""
+    def git(*args):
+        return subprocess.run(['git', *args], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    commit = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    return commit + ('-dirty' if git('status', '--porcelain', '--untracked-files=no') else '')
+
+def run_benchmarks(names, sizes, repeat=3):
+    """Runs the benchmarks at every size and returns the list of results."""
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name in names:
+            for size in sizes:
+                shape = SIZES[size]
+                function = BENCHMARKS[name](shape, work_dir)
+                times, peak = measure(function, repeat)
+                result = {'benchmark': name, 'size': size, 'n': shape[0] * shape[1], 'repeat': repeat,
+                          'time_min': min(times), 'time_median': statistics.median(times), 'peak_memory': peak}
+                results.append(result)
+                print(f"{name:<40} {size:>8} {result['time_min']:10.4f} s {peak / 2**20:10.1f} MiB", flush=True)
+    return results
+
+def compare(baseline, current, threshold=1.2, min_time=0.005, min_memory=2**20):
+    """
+    Prints the time and memory ratios (current / baseline) of two reports.
+
+    Returns the number of regressions: ratios above `threshold` on
+    benchmarks present in both reports. Changes smaller than `min_time`
+    seconds or `min_memory` bytes are timing noise, not regressions.
+    """
+    reference = {(r['benchmark'], r['size']): r for r in baseline['results']}
+    print(f"{baseline['commit']} -> {current['commit']}")
+    regressions = 0
+    for result in current['results']:
+        base = reference.get((result['benchmark'], result['size']))
+        if base is None:
+            continue
+        time_ratio = result['time_min'] / base['time_min']
+        memory_ratio = result['peak_memory'] / max(base['peak_memory'], 1)
+        flag = ((time_ratio > threshold and result['time_min'] - base['time_min'] > min_time)
+                or (memory_ratio > threshold and result['peak_memory'] - base['peak_memory'] > min_memory))
+        regressions += flag
+        print(f"{result['benchmark']:<40} {result['size']:>8} time x{time_ratio:6.2f} "
+              f"memory x{memory_ratio:6.2f}{'  REGRESSION' if flag else ''}")
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the clustering and post-processing hot paths.")
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=DEFAULT_SIZES)
+    parser.add_argument('--filter', default=None, help="Only run the benchmarks whose name contains this text")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None,
+                        help="Report path (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', nargs='+', metavar='REPORT',
+                        help="Compare two reports (or one report with a new run) instead of only running")
+    parser.add_argument('--threshold', type=float, default=1.2, help="Ratio above which a change is a regression")
+    args = parser.parse_args(argv)
+
+    if args.compare and len(args.compare) > 2:
+        parser.error("--compare takes one or two reports")
+    if args.compare and len(args.compare) == 2:
+        reports = []
+        for file_path in args.compare:
+            with open(file_path) as file:
+                reports.append(json.load(file))
+        return 1 if compare(*reports, args.threshold) else 0
+
+    names = [name for name in BENCHMARKS if args.filter is None or args.filter in name]
+    if not names:
+        parser.error("no benchmark matches the filter")
+    report = {
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+                    'python': platform.python_version(), 'numpy': np.__version__, 'scipy': scipy.__version__},
+        'results': run_benchmarks(names, args.sizes, args.repeat),
+    }
+    output = Path(args.output) if args.output else ROOT / 'benchmarks' / 'results' / f"{report['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=1)
+    print(f"Report saved to {output}")
+
+    if args.compare:
+        with open(args.compare[0]) as file:
+            return 1 if compare(json.load(file), report, args.threshold) else 0
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())